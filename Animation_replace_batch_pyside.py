@@ -9,30 +9,2473 @@ MotionBuilder 2019 动画替换批处理脚本 - PySide2版本
 import os
 import sys
 import time
-from pyfbsdk import *
-from pyfbsdk_additions import *
+import json
+import errno
+import socket
+import math
+import mmap
+import struct
+import hashlib
+import shutil
+import tempfile
+import argparse
+import collections
+import contextlib
+import fnmatch
+import itertools
+import csv
+import importlib
+import subprocess
+import multiprocessing
+import threading
 
-# 导入PySide2
 try:
-    from PySide2.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
-                                   QLabel, QLineEdit, QPushButton, QTextEdit, 
-                                   QFileDialog, QMessageBox, QProgressBar, QGroupBox)
-    from PySide2.QtCore import Qt
-    from PySide2.QtGui import QFont
+    import queue
+except ImportError:  # Python 2.7
+    import Queue as queue
+
+try:
+    import psutil  # 可选：读取进程常驻内存
+except ImportError:
+    psutil = None
+
+try:
+    import sqlite3  # 运行历史数据库
 except ImportError:
-    print("错误：无法导入PySide2，请确保已安装PySide2")
-    sys.exit(1)
+    sqlite3 = None
+
+try:
+    import numpy  # 可选：加载动画后的关键帧精简/重采样
+except ImportError:
+    numpy = None
+
+try:
+    unicode
+except NameError:  # Python 3（替身工作进程/调度器测试环境）
+    unicode = str
+
+# 单调时钟，用于计时（Python 2.7没有time.monotonic）
+monotonic = getattr(time, "monotonic", time.time)
+
+# 替换pyfbsdk的模块名（环境变量），用于在没有MotionBuilder的环境中注入替身模块
+FBSDK_MODULE_ENV = "MOBU_BATCH_FBSDK"
+
+
+def load_fbsdk(module_name=None):
+    """导入pyfbsdk（或注入的替身模块），并将其公开名称放入本模块全局命名空间"""
+    module_name = module_name or os.environ.get(FBSDK_MODULE_ENV) or "pyfbsdk"
+    module = importlib.import_module(module_name)
+    names = getattr(module, "__all__", None)
+    if names is None:
+        names = [name for name in dir(module) if not name.startswith("_")]
+    namespace = globals()
+    for name in names:
+        namespace[name] = getattr(module, name)
+    return module
+
+
+try:
+    load_fbsdk()
+    from pyfbsdk_additions import *
+except ImportError:
+    # 不在MotionBuilder中运行（例如调度进程），工作进程启动时再注入
+    pass
+
+# UI用到的Qt类，打开UI时才从PySide2导入（无界面运行不需要PySide2）
+QT_WIDGET_NAMES = ("QApplication", "QWidget", "QVBoxLayout", "QHBoxLayout",
+                   "QLabel", "QLineEdit", "QPushButton", "QTextEdit",
+                   "QFileDialog", "QMessageBox", "QProgressBar", "QGroupBox",
+                   "QSpinBox", "QCheckBox")
+QT_CORE_NAMES = ("Qt", "QTimer")
+QT_GUI_NAMES = ("QFont",)
+
+
+def import_qt():
+    """导入PySide2，并将UI用到的Qt类放入本模块全局命名空间"""
+    from PySide2 import QtWidgets, QtCore, QtGui
+    namespace = globals()
+    for module, names in ((QtWidgets, QT_WIDGET_NAMES), (QtCore, QT_CORE_NAMES), (QtGui, QT_GUI_NAMES)):
+        for name in names:
+            namespace[name] = getattr(module, name)
+
+
+# 工作进程通过stdout回报结果时使用的行前缀，其余输出行按日志转发
+WORKER_RESULT_PREFIX = "@@MOBU_BATCH_RESULT "
+# 工作进程进入一个处理阶段时输出的行前缀（后面是阶段名），用于按阶段检测卡死
+WORKER_STAGE_PREFIX = "@@MOBU_BATCH_STAGE "
+
+# 卡死/崩溃的文件重试前的等待时间（秒），每次重试翻倍
+DEFAULT_RETRY_BACKOFF = 10.0
+
+# 隔离清单文件名（位于保存位置）：反复卡死或导致工作进程崩溃的源文件
+QUARANTINE_NAME = "mobu_batch_quarantine.json"
+
+
+def to_native_str(data):
+    """将子进程输出的字节串转换为当前Python版本的str"""
+    if isinstance(data, bytes) and str is not bytes:
+        return data.decode("utf-8", "replace")
+    return data
+
+
+def to_bytes(text):
+    """将文本转换为字节串（用于计算校验和）"""
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+    return text
+
+
+# 中间动画文件目录（环境变量），建议指向tmpfs/本地SSD
+SCRATCH_DIR_ENV = "MOBU_BATCH_SCRATCH"
+
+
+def default_intermediate_dir():
+    """默认的中间动画文件目录：环境变量指定的目录，否则为系统临时目录"""
+    return os.environ.get(SCRATCH_DIR_ENV) or os.path.join(tempfile.gettempdir(), "mobu_batch_animation")
+
+
+# 源动画Plot到Control Rig时的FBPlotOptions设置
+SOURCE_PLOT_OPTIONS = {
+    "ConstantKeyReducerKeepOneKey": True,
+    "PlotAllTakes": False,
+    "PlotTranslationOnRootOnly": True,
+}
+
+# 最终保存的配置：default为所有元素的默认动作（True保存/False丢弃），elements为单独设置动作的
+# FBFbxOptions元素属性，flags为布尔选项，current_take为True时只保存当前Take。所有配置都强制二进制格式。
+SAVE_PROFILES = {
+    "full": {"default": True},
+    "skeleton+anim": {
+        "default": False,
+        "elements": {"Models": True, "Characters": True, "Constraints": True, "Poses": True},
+        "flags": {"ModelsAnimation": True, "SaveCharacter": True, "SaveControlSet": False},
+    },
+    "animation-only": {
+        "default": False,
+        "elements": {"Models": True, "Characters": True},
+        "flags": {"ModelsAnimation": True, "SaveCharacter": True, "SaveControlSet": False,
+                  "SaveCharacterExtention": False},
+        "current_take": True,
+    },
+}
+
+# 加载角色动画时的传递方式（FBCharacterLoadAnimationMethod成员名）
+TARGET_LOAD_METHOD = "kFBCharacterLoadCopy"
+
+# 断点续跑清单文件名（位于保存位置）；运行中的记录追加到同名加 .<写入者>.journal 的日志文件
+MANIFEST_NAME = ".mobu_batch_manifest.json"
+MANIFEST_JOURNAL_SUFFIX = ".journal"
+
+# 多节点协作：租约有效期（秒），持有期间每三分之一有效期续约一次
+DEFAULT_LEASE_TTL = 300
+LEASE_POLL_INTERVAL = 2.0  # 等待其他节点处理中的文件时的检查间隔（秒）
+
+
+def replace_file(src, dst):
+    """用src原子替换dst（Python 2.7在Windows上没有os.replace）"""
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+        return
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def link_or_copy(src, dst, link=True):
+    """把src硬链接（不支持时复制）为dst：先写到本进程的.partial文件再原子重命名"""
+    temp_path = "{}.{}.partial".format(dst, os.getpid())
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    if link and hasattr(os, "link"):
+        try:
+            os.link(src, temp_path)
+            replace_file(temp_path, dst)
+            return
+        except OSError:
+            pass  # 不同卷或文件系统不支持硬链接
+    shutil.copy2(src, temp_path)
+    replace_file(temp_path, dst)
+
+
+def file_md5(path, chunk_size=1024 * 1024):
+    """计算文件内容的md5"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 默认扫描的文件名模式（不区分大小写）
+FBX_INCLUDE_PATTERNS = ("*.fbx",)
+
+
+def scandir_entries(directory, with_stat=False):
+    """列出目录项(名称, 路径, 是否目录)，优先使用scandir（目录项自带类型，网络共享上不必逐个stat）
+
+    with_stat为True时再加上文件的stat结果（目录为None；Windows上scandir的stat来自目录列表，不需要额外请求）。
+    """
+    scandir = getattr(os, "scandir", None)
+    if scandir is None:
+        try:
+            from scandir import scandir  # Python 2.7的scandir包
+        except ImportError:
+            scandir = None
+    if scandir is None:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            is_dir = os.path.isdir(path)
+            if with_stat:
+                yield name, path, is_dir, None if is_dir else os.stat(path)
+            else:
+                yield name, path, is_dir
+        return
+    iterator = scandir(directory)
+    try:
+        for entry in iterator:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if with_stat:
+                yield entry.name, entry.path, is_dir, None if is_dir else entry.stat()
+            else:
+                yield entry.name, entry.path, is_dir
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+
+
+def match_patterns(name, relative_path, patterns):
+    """文件名或相对路径匹配任一模式（不区分大小写）"""
+    name = name.lower()
+    relative_path = relative_path.replace(os.sep, "/").lower()
+    for pattern in patterns:
+        pattern = pattern.lower()
+        if fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relative_path, pattern):
+            return True
+    return False
+
+
+def iter_files(directory, include=FBX_INCLUDE_PATTERNS, exclude=(), with_stat=False):
+    """流式扫描目录树，每发现一个匹配include且不匹配exclude的文件就产出其路径（with_stat为True时产出(路径, stat)）
+
+    exclude同样作用于子目录（匹配的子目录不再进入）。无法读取的子目录会被跳过。
+    """
+    pending = [(directory, "")]
+    while pending:
+        current, prefix = pending.pop()
+        try:
+            entries = scandir_entries(current, with_stat)
+            subdirs = []
+            for entry in entries:
+                name, path, is_dir = entry[:3]
+                relative_path = prefix + name
+                if exclude and match_patterns(name, relative_path, exclude):
+                    continue
+                if is_dir:
+                    subdirs.append((path, relative_path + "/"))
+                elif match_patterns(name, relative_path, include):
+                    yield (path, entry[3]) if with_stat else path
+        except OSError:
+            if current == directory:
+                raise
+            continue
+        # 倒序压栈，保持与目录列出顺序一致的深度优先遍历
+        pending.extend(reversed(subdirs))
+
+
+# 监视模式：扫描间隔和文件稳定时间（秒）
+DEFAULT_WATCH_INTERVAL = 2.0
+DEFAULT_WATCH_SETTLE = 5.0
+
+
+class SourceWatcher(object):
+    """源目录变化检测 - 每次poll()用scandir扫描一遍目录树，比较每个文件的(大小, 修改时间)
+
+    新增或变化的文件先进入等待状态，大小和修改时间保持settle秒不变（复制/导出已完成）后才返回，
+    返回过的文件只有再次变化时才会再返回。
+    """
+
+    def __init__(self, directory, include=FBX_INCLUDE_PATTERNS, exclude=(), settle=DEFAULT_WATCH_SETTLE):
+        self.directory = directory
+        self.include = include
+        self.exclude = exclude
+        self.settle = settle
+        self.pending = {}  # 路径 -> (签名, 签名开始不变的时间, 第一次发现的时间)
+        self.known = {}  # 路径 -> 已返回时的签名
+        self.detected = {}  # 路径 -> 已返回文件第一次发现的时间（time.time()）
+
+    def poll(self):
+        """扫描一次，返回已稳定的新增或变化文件"""
+        now = monotonic()
+        ready = []
+        current = set()
+        for path, stat in iter_files(self.directory, self.include, self.exclude, with_stat=True):
+            current.add(path)
+            signature = (stat.st_size, stat.st_mtime)
+            if self.known.get(path) == signature:
+                continue
+            state = self.pending.get(path)
+            if state is None:
+                self.pending[path] = (signature, now, time.time())
+            elif state[0] != signature:
+                self.pending[path] = (signature, now, state[2])
+            elif now - state[1] >= self.settle:
+                del self.pending[path]
+                self.known[path] = signature
+                self.detected[path] = state[2]
+                ready.append(path)
+        for states in (self.pending, self.known, self.detected):
+            for path in [path for path in states if path not in current]:
+                del states[path]
+        return ready
+
+    def first_seen(self, path):
+        """文件（本次变化）第一次被发现的时间"""
+        return self.detected.get(path)
+
+
+class FileCatalog(object):
+    """目录扫描结果缓存 - 每个目录只扫描一次
+
+    UI汇总、设置验证和批处理共用同一个目录，可以一边扫描一边消费：
+    iter_files先产出已缓存的文件，再继续推进同一个扫描生成器。
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = tuple(include or FBX_INCLUDE_PATTERNS)
+        self.exclude = tuple(exclude or ())
+        self.entries = {}  # 目录 -> 已发现的文件列表
+        self.scanners = {}  # 目录 -> 尚未结束的扫描生成器
+        self.complete = set()
+
+    def key(self, directory):
+        return os.path.normcase(os.path.abspath(directory))
+
+    def iter_files(self, directory):
+        """产出目录下的匹配文件：先返回缓存，必要时继续扫描"""
+        key = self.key(directory)
+        files = self.entries.setdefault(key, [])
+        index = 0
+        while True:
+            if index < len(files):
+                yield files[index]
+                index += 1
+                continue
+            if key in self.complete:
+                return
+            scanner = self.scanners.get(key)
+            if scanner is None:
+                scanner = iter_files(directory, self.include, self.exclude)
+                self.scanners[key] = scanner
+            try:
+                files.append(next(scanner))
+            except StopIteration:
+                self.complete.add(key)
+                self.scanners.pop(key, None)
+
+    def files(self, directory):
+        """目录下全部匹配文件（扫描到结束）"""
+        return list(self.iter_files(directory))
+
+    def first(self, directory):
+        """第一个匹配文件（只扫描到找到为止），没有时返回None"""
+        for path in self.iter_files(directory):
+            return path
+        return None
+
+    def discovered(self, directory):
+        """已发现的文件数量"""
+        return len(self.entries.get(self.key(directory), ()))
+
+    def is_complete(self, directory):
+        return self.key(directory) in self.complete
+
+    def invalidate(self, directory=None):
+        """丢弃缓存（不指定目录时全部丢弃），下次访问重新扫描"""
+        keys = list(self.entries) if directory is None else [self.key(directory)]
+        for key in keys:
+            self.entries.pop(key, None)
+            self.scanners.pop(key, None)
+            self.complete.discard(key)
+
+
+def copy_file_throttled(src, dst, bandwidth=0, chunk_size=1024 * 1024):
+    """分块复制文件，bandwidth为每秒字节数（0为不限速），返回复制的字节数"""
+    start = monotonic()
+    copied = 0
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            target.write(chunk)
+            copied += len(chunk)
+            if bandwidth:
+                delay = copied / float(bandwidth) - (monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+    return copied
+
+
+class TransferQueue(object):
+    """后台复制线程 - 按提交顺序复制文件（可限速）
+
+    目标文件先写成 目标.partial 再原子重命名，目标位置不会出现写了一半的FBX。
+    完成结果(源, 目标, context, 错误)通过poll()交给调用方（主线程）处理。
+    """
+
+    def __init__(self, bandwidth=0):
+        self.bandwidth = bandwidth  # 每秒字节数，0为不限速
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0
+        self.thread = None
+
+    def submit(self, src, dst, context=None, remove_source=False):
+        self.pending += 1
+        self.tasks.put((src, dst, context, remove_source))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def poll(self, timeout=0):
+        """取出已完成的复制结果，timeout大于0时最多等待这么久"""
+        results = []
+        try:
+            if timeout:
+                results.append(self.results.get(timeout=timeout))
+            while True:
+                results.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        self.pending -= len(results)
+        return results
+
+    def close(self, cancel=False):
+        """等待已提交的复制完成并结束线程，cancel为True时放弃还没开始的复制"""
+        if self.thread is not None:
+            if cancel:
+                try:
+                    while True:
+                        self.tasks.get_nowait()
+                        self.pending -= 1
+                except queue.Empty:
+                    pass
+            self.tasks.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            src, dst, context, remove_source = task
+            partial = dst + ".partial"
+            error = None
+            try:
+                directory = os.path.dirname(dst)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                copy_file_throttled(src, partial, self.bandwidth)
+                replace_file(partial, dst)
+                if remove_source:
+                    os.remove(src)
+            except (IOError, OSError) as e:
+                error = str(e)
+                try:
+                    os.remove(partial)
+                except OSError:
+                    pass
+            self.results.put((src, dst, context, error))
+
+
+class SourcePrefetcher(object):
+    """源文件预读 - 后台线程把接下来要处理的源文件复制到本地缓存目录
+
+    get()返回可以直接FileOpen的路径：预读完成时为本地副本，没有预读或预读失败时为原路径。
+    """
+
+    def __init__(self, cache_dir, bandwidth=0):
+        self.cache_dir = cache_dir
+        self.transfer = TransferQueue(bandwidth)
+        self.states = {}  # 源文件 -> None复制中 / 本地路径 / False失败
+
+    def local_path(self, fbx_file):
+        digest = hashlib.md5(to_bytes(os.path.abspath(fbx_file))).hexdigest()[:8]
+        return os.path.join(self.cache_dir, "{}_{}".format(digest, os.path.basename(fbx_file)))
+
+    def request(self, fbx_file):
+        if fbx_file in self.states:
+            return
+        self.states[fbx_file] = None
+        self.transfer.submit(fbx_file, self.local_path(fbx_file), fbx_file)
+
+    def collect(self, timeout=0):
+        for src, dst, fbx_file, error in self.transfer.poll(timeout):
+            if fbx_file in self.states:
+                self.states[fbx_file] = False if error else dst
+
+    def get(self, fbx_file):
+        """等待该文件预读完成，返回要打开的路径"""
+        if fbx_file not in self.states:
+            return fbx_file
+        self.collect()
+        while self.states[fbx_file] is None:
+            self.collect(0.05)
+        return self.states[fbx_file] or fbx_file
+
+    def release(self, fbx_file):
+        """文件已打开（或不再需要），删除本地副本"""
+        local_path = self.states.pop(fbx_file, None)
+        if local_path:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+
+    def close(self):
+        """放弃排队中的预读，等待正在复制的文件结束，删除所有本地副本"""
+        self.transfer.close(cancel=True)
+        self.collect()
+        for fbx_file in list(self.states):
+            self.release(fbx_file)
+
+
+# 二进制FBX：文件头魔数、版本号（偏移23的uint32），顶层节点从偏移27开始
+FBX_BINARY_MAGIC = b"Kaydara FBX Binary  \x00\x1a\x00"
+FBX_HEADER_SIZE = 27
+FBX_MIN_VERSION = 6100
+FBX_MAX_VERSION = 7700  # MotionBuilder 2019（FBX SDK 2019）能读取的最高版本
+FBX_KTIME_PER_SECOND = 46186158000  # FBX时间单位
+# GlobalSettings中TimeMode枚举对应的帧率（14为自定义，使用CustomFrameRate）
+FBX_TIME_MODE_RATES = {
+    1: 120.0, 2: 100.0, 3: 60.0, 4: 50.0, 5: 48.0, 6: 30.0, 7: 30.0, 8: 29.97, 9: 29.97,
+    10: 25.0, 11: 24.0, 12: 1000.0, 13: 23.976, 15: 96.0, 16: 72.0, 17: 59.94, 18: 119.88,
+}
+FBX_DEFAULT_FRAME_RATE = 30.0
+# 只记录导出时间/导出工具的顶层节点，计算内容哈希时跳过（文件尾也不参与）
+FBX_VOLATILE_NODES = ("FBXHeaderExtension", "FileId", "CreationTime", "Creator")
+
+# 查找重复源文件时并行计算哈希的线程数
+DEFAULT_HASH_THREADS = 4
+
+
+class FbxFormatError(ValueError):
+    """FBX文件损坏、被截断或版本不受支持"""
+
+
+class FbxNode(object):
+    """FBX节点：名称、属性列表、子节点"""
+
+    __slots__ = ("name", "properties", "children")
+
+    def __init__(self, name, properties, children):
+        self.name = name
+        self.properties = properties
+        self.children = children
+
+    def find(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def find_all(self, name):
+        return [child for child in self.children if child.name == name]
+
+
+class FbxReader(object):
+    """纯Python二进制FBX读取器（mmap）- 不需要MotionBuilder
+
+    只遍历顶层节点记录（按结束偏移跳过节点内容），需要时才解析Definitions、
+    GlobalSettings、Takes这几个很小的节点，不读取Objects中的几何和动画数据。
+    """
+
+    # 属性类型 -> (struct格式, 字节数)
+    SCALAR_TYPES = {b"Y": ("<h", 2), b"C": ("<?", 1), b"I": ("<i", 4), b"F": ("<f", 4),
+                    b"D": ("<d", 8), b"L": ("<q", 8)}
+    ARRAY_TYPES = (b"f", b"d", b"l", b"i", b"b")
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.data = None
+        self.size = 0
+        self.version = None
+        self.binary = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        self.file = open(self.path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size < FBX_HEADER_SIZE:
+            head = self.file.read(FBX_HEADER_SIZE)
+            self.binary = False
+            if not head.lstrip().startswith(b";"):
+                raise FbxFormatError("文件过小（{} 字节），不是有效的FBX文件".format(self.size))
+            return
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(FBX_BINARY_MAGIC)] != FBX_BINARY_MAGIC:
+            # ASCII FBX以注释或FBXHeaderExtension开头，不做二进制检查
+            if self.data[:64].lstrip().startswith((b";", b"FBXHeaderExtension")):
+                self.binary = False
+                return
+            raise FbxFormatError("文件头不是FBX格式")
+        self.binary = True
+        self.version = struct.unpack_from("<I", self.data, len(FBX_BINARY_MAGIC))[0]
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def record_header(self, offset):
+        """读取节点记录头：(结束偏移, 属性数量, 属性列表长度, 名称长度, 头大小)"""
+        if self.version >= 7500:
+            fmt, header_size = "<QQQB", 25
+        else:
+            fmt, header_size = "<IIIB", 13
+        if offset + header_size > self.size:
+            raise FbxFormatError("文件被截断：偏移 {} 处的节点记录不完整".format(offset))
+        end_offset, prop_count, prop_length, name_length = struct.unpack_from(fmt, self.data, offset)
+        return end_offset, prop_count, prop_length, name_length, header_size
+
+    def iter_top_level(self):
+        """依次产出顶层节点(名称, 起始偏移, 结束偏移)，检查节点边界是否在文件内"""
+        offset = FBX_HEADER_SIZE
+        while True:
+            end_offset, prop_count, prop_length, name_length, header_size = self.record_header(offset)
+            if end_offset == 0:
+                return  # 顶层节点列表结束（空记录）
+            if end_offset <= offset or end_offset > self.size:
+                raise FbxFormatError("文件被截断：节点结束偏移 {} 超出文件大小 {}".format(end_offset, self.size))
+            name_start = offset + header_size
+            name = self.data[name_start:name_start + name_length].decode("ascii", "replace")
+            yield name, offset, end_offset
+            offset = end_offset
+
+    def read_node(self, offset):
+        """完整解析一个节点（包括属性和子节点）"""
+        end_offset, prop_count, prop_length, name_length, header_size = self.record_header(offset)
+        if end_offset <= offset or end_offset > self.size:
+            raise FbxFormatError("文件被截断：节点结束偏移 {} 超出文件大小 {}".format(end_offset, self.size))
+        position = offset + header_size
+        name = self.data[position:position + name_length].decode("ascii", "replace")
+        position += name_length
+        properties_end = position + prop_length
+        properties = []
+        for _ in range(prop_count):
+            value, position = self.read_property(position)
+            properties.append(value)
+        position = properties_end
+        children = []
+        while position < end_offset:
+            child_end = self.record_header(position)[0]
+            if child_end == 0:
+                break
+            child = self.read_node(position)
+            children.append(child)
+            position = child_end
+        return FbxNode(name, properties, children)
+
+    def content_hash(self, chunk_size=1024 * 1024):
+        """内容哈希：版本号加上除FBX_VOLATILE_NODES以外的顶层节点字节，重新保存只改变文件头时间的文件哈希相同"""
+        digest = hashlib.md5(struct.pack("<I", self.version))
+        for name, start, end in self.iter_top_level():
+            if name in FBX_VOLATILE_NODES:
+                continue
+            for position in range(start, end, chunk_size):
+                digest.update(self.data[position:min(end, position + chunk_size)])
+        return digest.hexdigest()
+
+    def read_property(self, position):
+        """读取一个属性，返回(值, 下一个属性的偏移)；数组属性只返回长度，不解压"""
+        type_code = self.data[position:position + 1]
+        position += 1
+        if type_code in self.SCALAR_TYPES:
+            fmt, size = self.SCALAR_TYPES[type_code]
+            return struct.unpack_from(fmt, self.data, position)[0], position + size
+        if type_code in (b"S", b"R"):
+            length = struct.unpack_from("<I", self.data, position)[0]
+            raw = self.data[position + 4:position + 4 + length]
+            if type_code == b"S":
+                raw = raw.decode("utf-8", "replace")
+            return raw, position + 4 + length
+        if type_code in self.ARRAY_TYPES:
+            array_length, encoding, compressed_length = struct.unpack_from("<III", self.data, position)
+            return array_length, position + 12 + compressed_length
+        raise FbxFormatError("未知的属性类型 {!r}（偏移 {}）".format(type_code, position - 1))
+
+    def inspect(self):
+        """读取文件信息：版本、顶层节点、对象类型数量、Take列表和帧率"""
+        info = {"path": self.path, "size": self.size, "binary": self.binary, "version": self.version,
+                "top_level": [], "object_types": {}, "takes": [], "current_take": None,
+                "frame_rate": FBX_DEFAULT_FRAME_RATE}
+        if not self.binary:
+            return info
+        if not FBX_MIN_VERSION <= self.version <= FBX_MAX_VERSION:
+            raise FbxFormatError("不支持的FBX版本 {}（支持 {}~{}）".format(
+                self.version, FBX_MIN_VERSION, FBX_MAX_VERSION))
+        sections = {}
+        for name, start, end in self.iter_top_level():
+            info["top_level"].append(name)
+            if name in ("Definitions", "GlobalSettings", "Takes"):
+                sections[name] = start
+        if "Definitions" in sections:
+            for object_type in self.read_node(sections["Definitions"]).find_all("ObjectType"):
+                count = object_type.find("Count")
+                info["object_types"][object_type.properties[0]] = count.properties[0] if count else 0
+        if "GlobalSettings" in sections:
+            info["frame_rate"] = self.frame_rate(self.read_node(sections["GlobalSettings"]))
+        if "Takes" in sections:
+            takes = self.read_node(sections["Takes"])
+            current = takes.find("Current")
+            if current and current.properties:
+                info["current_take"] = current.properties[0]
+            for take in takes.find_all("Take"):
+                info["takes"].append(self.take_info(take, info["frame_rate"]))
+        return info
+
+    def frame_rate(self, global_settings):
+        """从GlobalSettings的TimeMode/CustomFrameRate属性得到帧率"""
+        values = {}
+        properties = global_settings.find("Properties70")
+        for prop in (properties.children if properties else []):
+            if len(prop.properties) >= 5:
+                values[prop.properties[0]] = prop.properties[4]
+        time_mode = values.get("TimeMode")
+        if time_mode == 14 and values.get("CustomFrameRate"):
+            return float(values["CustomFrameRate"])
+        return FBX_TIME_MODE_RATES.get(time_mode, FBX_DEFAULT_FRAME_RATE)
+
+    def take_info(self, take, frame_rate):
+        """Take名称、起止时间（秒）和帧数"""
+        name = take.properties[0] if take.properties else ""
+        local_time = take.find("LocalTime") or take.find("ReferenceTime")
+        start = stop = 0
+        if local_time and len(local_time.properties) >= 2:
+            start, stop = local_time.properties[0], local_time.properties[1]
+        seconds = max(0, stop - start) / float(FBX_KTIME_PER_SECOND)
+        return {"name": name, "start": start, "stop": stop, "seconds": seconds,
+                "frames": int(round(seconds * frame_rate)) + 1 if stop > start else 0}
+
+
+def inspect_fbx(path):
+    """读取FBX文件信息（不启动MotionBuilder），文件损坏时抛出FbxFormatError"""
+    try:
+        with FbxReader(path) as reader:
+            return reader.inspect()
+    except (struct.error, ValueError, IndexError) as e:
+        if isinstance(e, FbxFormatError):
+            raise
+        raise FbxFormatError("无法解析FBX文件: {}".format(str(e)))
+
+
+def preflight_fbx(path, require_character=True, require_takes=False):
+    """预检一个FBX文件，返回(错误信息或None, 文件信息或None)
+
+    ASCII FBX不做结构检查；二进制FBX检查文件头、版本、节点边界、角色(HIK)和Take列表。
+    """
+    try:
+        info = inspect_fbx(path)
+    except (IOError, OSError) as e:
+        return "无法读取文件: {}".format(str(e)), None
+    except FbxFormatError as e:
+        return str(e), None
+    if not info["binary"]:
+        return None, info
+    if require_character and not info["object_types"].get("Character"):
+        return "文件中没有角色（Character/HIK）定义", info
+    if require_takes and not info["takes"]:
+        return "文件中没有Take", info
+    return None, info
+
+
+def fbx_frame_count(info):
+    """文件信息中当前Take（没有时取最长Take）的帧数，未知时返回None"""
+    if not info or not info.get("takes"):
+        return None
+    for take in info["takes"]:
+        if take["name"] == info.get("current_take"):
+            return take["frames"]
+    return max(take["frames"] for take in info["takes"])
+
+
+def source_content_hash(path):
+    """源文件内容哈希：二进制FBX用FbxReader.content_hash，其他（或无法解析的）文件为整个文件的md5；无法读取时返回None"""
+    try:
+        with FbxReader(path) as reader:
+            if reader.binary:
+                return reader.content_hash()
+    except (FbxFormatError, IOError, OSError, ValueError, struct.error):
+        pass
+    try:
+        return file_md5(path)
+    except (IOError, OSError):
+        return None
+
+
+def find_duplicate_files(paths, threads=DEFAULT_HASH_THREADS):
+    """找出内容相同的文件，返回[[第一个文件, 重复文件...], ...]（按输入顺序）
+
+    先按文件大小分组，只有大小相同的文件才在线程池中并行计算内容哈希。
+    """
+    by_size = collections.OrderedDict()
+    for path in paths:
+        try:
+            by_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError:
+            continue
+    candidates = [path for group in by_size.values() if len(group) > 1 for path in group]
+    if not candidates:
+        return []
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(max(1, min(threads, len(candidates))))
+    try:
+        digests = pool.map(source_content_hash, candidates)
+    finally:
+        pool.close()
+        pool.join()
+    by_hash = collections.OrderedDict()
+    for path, digest in zip(candidates, digests):
+        if digest:
+            by_hash.setdefault(digest, []).append(path)
+    order = dict((path, index) for index, path in enumerate(paths))
+    return sorted((sorted(group, key=order.get) for group in by_hash.values() if len(group) > 1),
+                  key=lambda group: order[group[0]])
+
+
+# 中间动画缓存：默认容量（MB），键格式变化时修改版本号使旧条目失效
+DEFAULT_ANIMATION_CACHE_MB = 4096
+ANIMATION_CACHE_VERSION = 1
+
+
+class AnimationCache(object):
+    """中间动画缓存 - 以源文件内容哈希、角色名和Plot选项为键，保存SaveCharacterRigAndAnimation导出的动画文件
+
+    换了HIK目标再跑同一批源文件时，命中的文件不再FileOpen、Plot和导出。多个进程或节点可以共用
+    一个目录：条目先写.partial再原子重命名，命中时更新修改时间，总大小超过容量时按修改时间淘汰
+    最久未使用的条目。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evicted_count = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, content_hash, signature):
+        data = json.dumps([ANIMATION_CACHE_VERSION, content_hash, signature], sort_keys=True)
+        return hashlib.md5(to_bytes(data)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".fbx")
+
+    def takes_path(self, key):
+        return os.path.join(self.directory, key + ".takes.json")
+
+    def get(self, key, dst):
+        """命中时把缓存条目链接（或复制）为dst并返回True"""
+        path = self.path(key)
+        try:
+            link_or_copy(path, dst)
+            os.utime(path, None)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def takes(self, key):
+        """条目导出时包含的源Take名称，没有记录时返回None"""
+        try:
+            with open(self.takes_path(key), "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, src, takes=None):
+        """把导出的动画文件（和其中的源Take名称）存入缓存，然后淘汰超过容量的条目"""
+        if takes is not None:
+            temp_path = self.takes_path(key) + ".partial"
+            with open(temp_path, "w") as f:
+                json.dump(takes, f)
+            replace_file(temp_path, self.takes_path(key))
+        link_or_copy(src, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """按修改时间从旧到新删除条目，直到总大小不超过容量"""
+        entries = []
+        total = 0
+        for name, path, is_dir in scandir_entries(self.directory):
+            if is_dir or not name.endswith(".fbx"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evicted_count += 1
+            except OSError:
+                pass  # 其他进程已删除或正在使用
+            try:
+                os.remove(path[:-len(".fbx")] + ".takes.json")
+            except OSError:
+                pass
+            total -= size
+
+
+# 关键帧后处理：按属性类型（translation/rotation/scaling，"*"为默认）的容差
+KEY_CURVE_PROPERTIES = (("Translation", "translation"), ("Rotation", "rotation"), ("Scaling", "scaling"))
+
+
+def reduce_keys(times, values, tolerance):
+    """容差关键帧精简（NumPy向量化），返回保留关键帧的布尔掩码
+
+    删除一个关键帧后用相邻保留帧之间的线性插值代替它，要求区间内所有原始关键帧的误差不超过容差。
+    每轮只尝试奇数或偶数位置的关键帧（互不相邻，区间互不重叠），一次np.interp算出所有候选的误差，
+    交替进行直到没有可以删除的关键帧。首尾关键帧始终保留。
+    """
+    count = len(times)
+    keep = numpy.ones(count, dtype=bool)
+    if count <= 2:
+        return keep
+    idle = 0
+    parity = 1
+    while idle < 2:
+        kept = numpy.flatnonzero(keep)
+        candidates = numpy.arange(parity, len(kept) - 1, 2)
+        parity = 1 - parity
+        candidates = candidates[candidates > 0]
+        if not len(candidates):
+            idle += 1
+            continue
+        trial = keep.copy()
+        trial[kept[candidates]] = False
+        approx = numpy.interp(times, times[trial], values[trial])
+        error = numpy.abs(approx - values)
+        bounds = numpy.empty(2 * len(candidates), dtype=numpy.intp)
+        bounds[0::2] = kept[candidates - 1]
+        bounds[1::2] = kept[candidates + 1]
+        span_error = numpy.maximum.reduceat(error, bounds)[0::2]
+        removable = kept[candidates[span_error <= tolerance]]
+        if len(removable):
+            keep[removable] = False
+            idle = 0
+        else:
+            idle += 1
+    return keep
+
+
+def resample_keys(times, values, frame_rate):
+    """按目标帧率对关键帧线性重采样，返回(新时间, 新数值)"""
+    step = 1.0 / frame_rate
+    new_times = numpy.arange(times[0], times[-1] + step * 0.5, step)
+    return new_times, numpy.interp(new_times, times, values)
+
+
+def source_key(fbx_file, variant=None):
+    """清单/隔离清单中源文件的键（扇出模式下加上目标名）"""
+    key = os.path.normcase(os.path.abspath(fbx_file))
+    if variant:
+        key += "::" + variant
+    return key
+
+
+def source_signature(fbx_file):
+    """源文件签名（大小和修改时间），用于判断源文件是否变化"""
+    stat = os.stat(fbx_file)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+class BatchManifest(object):
+    """断点续跑清单 - 以源文件路径（扇出模式下加上目标名）为键，记录成功输出时的源文件签名、HIK目标和选项
+
+    每次成功保存后把一条记录追加到日志文件（一行JSON，flush并fsync），写入量与清单大小无关；
+    运行结束时（close）或下次加载时把日志合并进完整的清单文件并删除日志。最后一行写到一半时忽略该行。
+    shared为True时（多个节点共用保存位置）每个节点写自己的日志文件，加载和合并时读取所有节点的日志，
+    只删除自己的日志。
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        writer = "{}-{}".format(socket.gethostname(), os.getpid()) if shared else "local"
+        self.journal_path = "{}.{}{}".format(path, writer, MANIFEST_JOURNAL_SUFFIX)
+        self.journal = None
+        self.entries = {}
+        self.load()
+
+    def journal_paths(self):
+        """保存位置中属于该清单的所有日志文件"""
+        directory, name = os.path.split(self.path)
+        try:
+            names = os.listdir(directory or ".")
+        except OSError:
+            return []
+        return [os.path.join(directory, other) for other in sorted(names)
+                if other.startswith(name + ".") and other.endswith(MANIFEST_JOURNAL_SUFFIX)]
+
+    def read_entries(self):
+        """读取完整清单和所有日志，同一个键保留时间最新的记录"""
+        entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                entries.update(json.load(f).get("files", {}))
+        for journal_path in self.journal_paths():
+            try:
+                with open(journal_path, "r") as f:
+                    lines = f.readlines()
+            except (IOError, OSError):
+                continue
+            for line in lines:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue  # 写到一半的最后一行
+                current = entries.get(item["key"])
+                if current is None or item["entry"].get("time", 0) >= current.get("time", 0):
+                    entries[item["key"]] = item["entry"]
+        return entries
+
+    def load(self):
+        try:
+            self.entries = self.read_entries()
+        except (IOError, OSError, ValueError):
+            # 清单损坏时从头开始，不影响批处理
+            self.entries = {}
+            return
+        if not self.shared and os.path.isfile(self.journal_path):
+            # 上次运行没有正常结束，先合并它留下的日志
+            self.compact()
+
+    def append(self, key, entry):
+        """把一条记录追加到本写入者的日志文件并落盘"""
+        if self.journal is None:
+            self.journal = open(self.journal_path, "a")
+        self.journal.write(json.dumps({"key": key, "entry": entry}, sort_keys=True) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def compact(self):
+        """把日志合并进完整的清单文件（原子替换），然后删除本写入者的日志"""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if not os.path.isfile(self.journal_path):
+            return
+        if self.shared:
+            try:
+                entries = self.read_entries()
+            except (IOError, OSError, ValueError):
+                entries = {}
+            entries.update(self.entries)
+            self.entries = entries
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid()) if self.shared else self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": 1, "files": self.entries}, f, indent=1, sort_keys=True)
+        replace_file(temp_path, self.path)
+        os.remove(self.journal_path)
+
+    def close(self):
+        self.compact()
+
+    def key(self, fbx_file, variant=None):
+        return source_key(fbx_file, variant)
+
+    def source_signature(self, fbx_file):
+        return source_signature(fbx_file)
+
+    def is_up_to_date(self, fbx_file, target_hash, options_hash, output_file, variant=None):
+        """源文件、HIK目标、选项都未变化且输出文件仍然存在时返回True"""
+        entry = self.entries.get(self.key(fbx_file, variant))
+        if not entry:
+            return False
+        try:
+            if entry.get("source") != self.source_signature(fbx_file):
+                return False
+            if entry.get("target_hash") != target_hash or entry.get("options_hash") != options_hash:
+                return False
+            if entry.get("output") != output_file:
+                return False
+            if entry.get("outputs"):
+                # 每个Take一个输出文件
+                return all(os.path.getsize(path) == size for path, size in entry["outputs"].items())
+            return os.path.getsize(output_file) == entry.get("output_size")
+        except OSError:
+            return False
+
+    def record(self, fbx_file, target_hash, options_hash, output_file, variant=None, outputs=None):
+        """记录一个成功输出并立即追加到日志；outputs为拆分Take时的各个输出文件（output_file只作为键的一部分）"""
+        entry = {
+            "source": self.source_signature(fbx_file),
+            "target_hash": target_hash,
+            "options_hash": options_hash,
+            "output": output_file,
+            "time": int(time.time()),
+        }
+        if outputs:
+            entry["outputs"] = dict((path, os.path.getsize(path)) for path in outputs)
+        else:
+            entry["output_size"] = os.path.getsize(output_file)
+        key = self.key(fbx_file, variant)
+        self.entries[key] = entry
+        self.append(key, entry)
+
+
+class LeaseDirectory(object):
+    """共享目录中的租约文件 - 多个节点（渲染农场机器）不经过中心服务器协作处理同一批文件
+
+    每个工作单元一个键：
+        <键>.lease   以O_CREAT|O_EXCL原子创建，谁创建成功谁处理；持有期间后台线程定期更新修改时间（心跳）
+        <键>.done    处理成功的完成标记；<键>.failed 处理失败的标记（删除后可以重试）
+    租约超过ttl秒没有心跳视为节点已死亡：先把租约改名（只有一个节点能成功）再重新创建。
+    节点之间用文件修改时间判断过期，需要同步时钟（NTP）。
+    """
+
+    def __init__(self, directory, node_id=None, ttl=DEFAULT_LEASE_TTL):
+        self.directory = directory
+        self.node_id = node_id or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.ttl = float(ttl)
+        self.held = {}  # 键 -> 租约文件路径
+        self.lock = threading.Lock()
+        self.reclaimed_count = 0  # 回收的过期租约数量
+        self.lost_count = 0  # 心跳时发现已被其他节点回收的租约数量
+        self.stopped = threading.Event()
+        self.thread = None
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # 其他节点同时创建
+                if not os.path.isdir(directory):
+                    raise
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def is_finished(self, key):
+        """已有完成或失败标记"""
+        return os.path.exists(self.path(key, ".done")) or os.path.exists(self.path(key, ".failed"))
+
+    def claim(self, key, info=None):
+        """尝试获得键的租约，成功返回True；已完成或被其他节点持有时返回False"""
+        if self.is_finished(key):
+            return False
+        lease_path = self.path(key, ".lease")
+        for _ in range(2):
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                if not self.reclaim_expired(lease_path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump(dict(info or {}, node=self.node_id, claimed=time.time()), f)
+            if self.is_finished(key):
+                # 检查完成标记之后、创建租约之前其他节点刚好完成
+                self.remove(lease_path)
+                return False
+            with self.lock:
+                self.held[key] = lease_path
+            self.start_heartbeat()
+            return True
+        return False
+
+    def reclaim_expired(self, lease_path):
+        """租约已过期时把它移走，返回True表示可以重新创建"""
+        try:
+            age = time.time() - os.path.getmtime(lease_path)
+        except OSError:
+            return True  # 租约刚被释放
+        if age < self.ttl:
+            return False
+        stale_path = "{}.{}.stale".format(lease_path, self.node_id)
+        try:
+            os.rename(lease_path, stale_path)
+        except OSError:
+            return False  # 其他节点抢先回收
+        self.remove(stale_path)
+        self.reclaimed_count += 1
+        return True
+
+    def owner(self, key):
+        """租约持有者信息（没有租约或无法读取时为None）"""
+        try:
+            with open(self.path(key, ".lease"), "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def complete(self, key, success, info=None):
+        """写入完成/失败标记并释放租约"""
+        marker_path = self.path(key, ".done" if success else ".failed")
+        try:
+            fd = os.open(marker_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, "w") as f:
+                json.dump(dict(info or {}, node=self.node_id, time=time.time()), f)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.release(key)
+
+    def release(self, key):
+        """释放租约（不写标记），其他节点可以重新领取"""
+        with self.lock:
+            lease_path = self.held.pop(key, None)
+        if lease_path:
+            self.remove(lease_path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def start_heartbeat(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._heartbeat)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.ttl / 3.0):
+            with self.lock:
+                held = list(self.held.items())
+            for key, lease_path in held:
+                owner = self.owner(key)
+                if owner is None or owner.get("node") != self.node_id:
+                    # 心跳太迟，租约已被其他节点回收
+                    with self.lock:
+                        if self.held.pop(key, None):
+                            self.lost_count += 1
+                    continue
+                try:
+                    os.utime(lease_path, None)
+                except OSError:
+                    pass
+
+    def close(self):
+        """停止心跳并释放仍持有的租约"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for key in list(self.held):
+            self.release(key)
+
+
+class QuarantineList(object):
+    """隔离清单 - 超过重试次数仍然卡死或导致工作进程崩溃的源文件
+
+    之后的运行跳过这些文件；源文件发生变化或从清单中删除后重新处理。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f).get("files", {})
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": 1, "files": self.entries}, f, indent=1, sort_keys=True)
+        replace_file(temp_path, self.path)
+
+    def key(self, fbx_file):
+        return source_key(fbx_file)
+
+    def source_signature(self, fbx_file):
+        return source_signature(fbx_file)
+
+    def contains(self, fbx_file):
+        """源文件在清单中且没有变化"""
+        entry = self.entries.get(self.key(fbx_file))
+        if not entry:
+            return False
+        try:
+            return entry.get("source") == self.source_signature(fbx_file)
+        except OSError:
+            return False
+
+    def add(self, fbx_file, error, attempts):
+        self.entries[self.key(fbx_file)] = {
+            "source": self.source_signature(fbx_file),
+            "error": error,
+            "attempts": attempts,
+            "time": int(time.time()),
+        }
+        self.save()
+
+
+def format_duration(seconds):
+    """把秒数格式化为H:MM:SS"""
+    seconds = int(max(0, seconds))
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+# 日志控件最多保留的行数（超出后丢弃最早的行）
+LOG_WIDGET_MAX_LINES = 2000
+
+# 日志控件的刷新间隔（毫秒）
+LOG_FLUSH_INTERVAL_MS = 200
+
+# 结构化日志文件名（位于保存位置）
+LOG_FILE_NAME = "mobu_batch_log.jsonl"
+
+
+class LogSink(object):
+    """有界日志缓冲 - 日志先进入环形缓冲，由UI定时器按固定频率批量刷新到控件
+
+    两次刷新之间的日志超过容量时丢弃最早的行，刷新时提示丢弃了多少行。
+    """
+
+    def __init__(self, capacity=LOG_WIDGET_MAX_LINES):
+        self.buffer = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def emit(self, text):
+        with self.lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(text)
+
+    def drain(self):
+        """取出缓冲中的全部日志行"""
+        with self.lock:
+            lines = list(self.buffer)
+            self.buffer.clear()
+            dropped = self.dropped
+            self.dropped = 0
+        if dropped:
+            lines.insert(0, "... (省略{}行日志，完整日志见日志文件)".format(dropped))
+        return lines
+
+
+class JsonlLogWriter(object):
+    """结构化日志文件 - 每条记录一行JSON，超过max_bytes后轮转为.1/.2/...备份"""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.stream = None
+        self.size = 0
+
+    def write(self, record):
+        line = to_bytes(json.dumps(record) + "\n")
+        if self.stream is None:
+            self.stream = open(self.path, "ab")
+            self.size = os.path.getsize(self.path)
+        if self.max_bytes and self.size and self.size + len(line) > self.max_bytes:
+            self.rotate()
+        self.stream.write(line)
+        self.stream.flush()
+        self.size += len(line)
+
+    def rotate(self):
+        self.stream.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            src = "{}.{}".format(self.path, index)
+            if os.path.exists(src):
+                replace_file(src, "{}.{}".format(self.path, index + 1))
+        if self.backup_count > 0:
+            replace_file(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.stream = open(self.path, "ab")
+        self.size = 0
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def percentile(values, fraction):
+    """最近秩百分位数（values已排序）"""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[min(len(values) - 1, max(0, rank))]
+
+
+class RunReport(object):
+    """运行报告 - 每个文件一行（状态、各阶段耗时、文件大小），并汇总每个阶段的p50/p95/max"""
+
+    def __init__(self):
+        self.rows = []
+        self.shared_stages = {}  # 不属于单个文件的阶段耗时（例如常驻目标场景加载）
+        self.start_time = time.time()
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def add_shared(self, stage, elapsed):
+        self.shared_stages[stage] = self.shared_stages.get(stage, 0.0) + elapsed
+
+    def stage_names(self):
+        names = set()
+        for row in self.rows:
+            names.update(row["stages"])
+        return sorted(names)
+
+    def size_names(self):
+        names = set()
+        for row in self.rows:
+            names.update(row["sizes"])
+        return sorted(names)
+
+    def summary(self):
+        """每个阶段的次数、总耗时、p50、p95、最大值"""
+        summary = {}
+        for stage in self.stage_names() + ["total"]:
+            if stage == "total":
+                values = sorted(row["total"] for row in self.rows)
+            else:
+                values = sorted(row["stages"][stage] for row in self.rows if stage in row["stages"])
+            summary[stage] = {
+                "count": len(values),
+                "sum": sum(values),
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "max": values[-1] if values else 0.0,
+            }
+        return summary
+
+    def write(self, directory, extra=None, name_suffix=None):
+        """写出JSON和CSV报告，返回(JSON路径, CSV路径)；name_suffix用于区分同时运行的节点"""
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.start_time))
+        base = os.path.join(directory, "mobu_batch_report_{}".format(stamp))
+        if name_suffix:
+            base += "_" + name_suffix
+        data = {
+            "start_time": self.start_time,
+            "end_time": time.time(),
+            "summary": self.summary(),
+            "shared_stages": self.shared_stages,
+            "files": self.rows,
+        }
+        if extra:
+            data.update(extra)
+        with open(base + ".json", "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+        stages = self.stage_names()
+        sizes = self.size_names()
+        if str is bytes:  # Python 2.7的csv模块只支持二进制文件
+            csv_file = open(base + ".csv", "wb")
+        else:
+            csv_file = open(base + ".csv", "w", newline="")
+        with csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["index", "file", "status", "error", "total", "frames", "rss_mb", "key_ratio", "latency"] +
+                            ["stage_" + name for name in stages] + ["size_" + name for name in sizes])
+            for row in self.rows:
+                writer.writerow([row["index"], row["file"], row["status"], row.get("error") or "",
+                                 "{:.3f}".format(row["total"]), row.get("frames", ""),
+                                 "{:.1f}".format(row["rss"] / (1024.0 * 1024.0)) if row.get("rss") else "",
+                                 "{:.3f}".format(row["keys"]["ratio"]) if row.get("keys") else "",
+                                 "{:.1f}".format(row["latency"]) if row.get("latency") is not None else ""] +
+                                ["{:.3f}".format(row["stages"][name]) if name in row["stages"] else ""
+                                 for name in stages] +
+                                [row["sizes"].get(name, "") for name in sizes])
+        return base + ".json", base + ".csv"
+
+
+# 运行历史数据库：环境变量指定的路径，否则为用户目录下的文件
+HISTORY_DB_ENV = "MOBU_BATCH_HISTORY"
+DEFAULT_REGRESSION_THRESHOLD = 20.0  # 比上一次运行变慢超过多少百分比算回归
+
+
+def default_history_db():
+    return os.environ.get(HISTORY_DB_ENV) or os.path.join(os.path.expanduser("~"), ".mobu_batch", "history.sqlite")
+
+
+class RunHistory(object):
+    """运行历史 - 本地SQLite数据库，每次运行一行（runs），每个文件一行（results：状态、错误、各阶段耗时、文件大小）
+
+    用于查看吞吐量趋势、最慢的文件和耗时比上一次运行变慢的文件。
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, start_time REAL, end_time REAL, node TEXT,"
+        " source_path TEXT, hik_path TEXT, save_path TEXT, worker_count INTEGER, options_hash TEXT,"
+        " success INTEGER, failed INTEGER, skipped INTEGER, message TEXT)",
+        "CREATE TABLE IF NOT EXISTS results (run_id INTEGER, file TEXT, status TEXT, error TEXT, total REAL,"
+        " frames INTEGER, rss INTEGER, stages TEXT, sizes TEXT)",
+        "CREATE INDEX IF NOT EXISTS results_file ON results (file, run_id)",
+        "CREATE INDEX IF NOT EXISTS results_run ON results (run_id)",
+    )
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, run, rows):
+        """在一个事务中写入一次运行和它的所有文件结果，返回运行id"""
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (start_time, end_time, node, source_path, hik_path, save_path, worker_count,"
+                " options_hash, success, failed, skipped, message) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run["start_time"], run["end_time"], run["node"], run["source_path"], run["hik_path"],
+                 run["save_path"], run["worker_count"], run["options_hash"], run["success"], run["failed"],
+                 run["skipped"], run["message"]))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO results (run_id, file, status, error, total, frames, rss, stages, sizes)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, os.path.normcase(os.path.abspath(row["file"])), row["status"], row.get("error"),
+                  row["total"], row.get("frames"), row.get("rss"), json.dumps(row.get("stages", {}), sort_keys=True),
+                  json.dumps(row.get("sizes", {}), sort_keys=True)) for row in rows])
+        return run_id
+
+    def trends(self, limit=20):
+        """最近limit次运行的[(id, 开始时间, 节点, 成功, 失败, 跳过, 墙钟秒数, 文件/秒, 平均单文件秒数)]，从旧到新"""
+        rows = self.connection.execute(
+            "SELECT runs.id, runs.start_time, runs.end_time, runs.node, runs.success, runs.failed, runs.skipped,"
+            " AVG(results.total) FROM runs LEFT JOIN results ON results.run_id = runs.id"
+            " GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (limit,)).fetchall()
+        trends = []
+        for run_id, start, end, node, success, failed, skipped, mean in reversed(rows):
+            wall = max(0.0, end - start)
+            processed = success + failed
+            trends.append((run_id, start, node, success, failed, skipped, wall,
+                           processed / wall if wall > 0 else 0.0, mean or 0.0))
+        return trends
+
+    def latest_results(self, runs=2):
+        """每个文件最近runs次成功结果的耗时：{文件: [(运行id, 耗时), ...]}（从新到旧）"""
+        latest = {}
+        cursor = self.connection.execute(
+            "SELECT file, run_id, total FROM results WHERE status = 'success' ORDER BY file, run_id DESC")
+        for path, run_id, total in cursor:
+            items = latest.setdefault(path, [])
+            if len(items) < runs:
+                items.append((run_id, total))
+        return latest
+
+    def slowest(self, limit=20):
+        """每个文件最近一次成功的耗时，按耗时从大到小的[(文件, 运行id, 耗时)]"""
+        latest = self.latest_results(1)
+        items = [(path, items[0][0], items[0][1]) for path, items in latest.items()]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return items[:limit]
+
+    def regressions(self, threshold=DEFAULT_REGRESSION_THRESHOLD, limit=20):
+        """最近一次成功耗时比上一次成功变慢超过threshold%的文件：[(文件, 上次耗时, 本次耗时, 百分比)]"""
+        items = []
+        for path, results in self.latest_results(2).items():
+            if len(results) < 2 or results[1][1] <= 0:
+                continue
+            current, previous = results[0][1], results[1][1]
+            change = (current - previous) / previous * 100.0
+            if change > threshold:
+                items.append((path, previous, current, change))
+        items.sort(key=lambda item: item[3], reverse=True)
+        return items[:limit]
+
+
+def history_main(command, path=None, limit=20, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """查询运行历史：trends（吞吐量趋势）、slowest（最慢的文件）、regressions（耗时回归）"""
+    path = path or default_history_db()
+    if sqlite3 is None or not os.path.isfile(path):
+        print("没有运行历史数据库: {}".format(path))
+        return 1
+    history = RunHistory(path)
+    try:
+        if command == "trends":
+            print("{:>6}  {:<19} {:<24}{:>7}{:>6}{:>6}{:>10}{:>9}{:>10}".format(
+                "run", "开始时间", "节点", "成功", "失败", "跳过", "墙钟", "文件/秒", "平均(s)"))
+            for run_id, start, node, success, failed, skipped, wall, rate, mean in history.trends(limit):
+                print("{:>6}  {:<19} {:<24}{:>7}{:>6}{:>6}{:>10}{:>9.2f}{:>10.2f}".format(
+                    run_id, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)), node or "",
+                    success, failed, skipped, format_duration(wall), rate, mean))
+        elif command == "slowest":
+            for path_, run_id, total in history.slowest(limit):
+                print("{:>10.2f}s  run {:<6} {}".format(total, run_id, path_))
+        else:
+            items = history.regressions(threshold, limit)
+            print("耗时比上一次运行变慢超过 {:g}% 的文件: {}".format(threshold, len(items)))
+            for path_, previous, current, change in items:
+                print("{:>+8.1f}%  {:>9.2f}s -> {:>9.2f}s  {}".format(change, previous, current, path_))
+    finally:
+        history.close()
+    return 0
+
+
+# 没有历史数据时的耗时估计：每文件固定开销 + 每帧 + 每MB
+DEFAULT_COST_BASE = 5.0
+DEFAULT_COST_PER_FRAME = 0.01
+DEFAULT_COST_PER_MB = 0.5
+HISTORY_REPORT_COUNT = 5  # 读取最近几次运行报告作为历史耗时
+SCHEDULE_STEP_FILES = 50  # 调度时每估计多少个文件yield一次（UI在两步之间处理界面事件）
+
+
+def solve_linear(matrix, vector):
+    """高斯消元解小型线性方程组，奇异时返回None"""
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(size):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][size] / rows[i][i] for i in range(size)]
+
+
+class CostModel(object):
+    """单文件耗时估计 - 同一文件有历史耗时时直接使用，否则按 固定开销 + 帧数 + 文件大小 线性估计
+
+    线性系数用历史报告中成功文件的(帧数, 大小, 耗时)最小二乘拟合，数据不足时使用默认值。
+    """
+
+    def __init__(self):
+        self.history = {}  # 源文件 -> {"total", "size", "frames"}
+        self.coefficients = (DEFAULT_COST_BASE, DEFAULT_COST_PER_FRAME, DEFAULT_COST_PER_MB)
+        self.fitted = False
+
+    def key(self, fbx_file):
+        return os.path.normcase(os.path.abspath(fbx_file))
+
+    def load_reports(self, directory, count=HISTORY_REPORT_COUNT):
+        """读取目录中最近count个运行报告（按文件名时间戳排序，新的覆盖旧的）"""
+        try:
+            names = sorted(name for name in os.listdir(directory)
+                           if name.startswith("mobu_batch_report_") and name.endswith(".json"))
+        except OSError:
+            return 0
+        for name in names[-count:]:
+            try:
+                with open(os.path.join(directory, name), "r") as f:
+                    rows = json.load(f).get("files", [])
+            except (IOError, OSError, ValueError):
+                continue
+            for row in rows:
+                if row.get("status") == "success" and row.get("total"):
+                    self.history[self.key(row["file"])] = {
+                        "total": row["total"], "size": row.get("sizes", {}).get("source"),
+                        "frames": row.get("frames")}
+        self.fit()
+        return len(self.history)
+
+    def fit(self):
+        """用历史数据拟合 耗时 = a + b*帧数 + c*MB"""
+        samples = [(1.0, float(item["frames"]), item["size"] / 1048576.0, item["total"])
+                   for item in self.history.values() if item.get("frames") is not None and item.get("size")]
+        if len(samples) < 3:
+            return False
+        matrix = [[sum(sample[i] * sample[j] for sample in samples) for j in range(3)] for i in range(3)]
+        vector = [sum(sample[i] * sample[3] for sample in samples) for i in range(3)]
+        solution = solve_linear(matrix, vector)
+        if solution is None or min(solution) < 0:
+            # 共线或出现负系数时只拟合 固定开销 + 每帧耗时
+            matrix = [row[:2] for row in matrix[:2]]
+            solution = solve_linear(matrix, vector[:2])
+            if solution is None or min(solution) < 0:
+                # 仍然不行时用耗时中位数作为固定开销
+                solution = [percentile(sorted(sample[3] for sample in samples), 0.5), 0.0]
+            solution = list(solution) + [0.0]
+        self.coefficients = tuple(solution)
+        self.fitted = True
+        return True
+
+    def estimate(self, fbx_file, size=None, frames=None):
+        """估计一个文件的处理耗时（秒）"""
+        item = self.history.get(self.key(fbx_file))
+        if item and (size is None or item.get("size") in (None, size)):
+            return item["total"]
+        base, per_frame, per_mb = self.coefficients
+        return base + per_frame * (frames or 0) + per_mb * (size or 0) / 1048576.0
+
+
+def schedule_jobs(costs, worker_count, mode="longest"):
+    """按估计耗时安排任务，返回(按派发顺序排列的[(任务, 工作进程序号或None)], 预计总耗时)
+
+    costs为[(任务, 耗时)]。longest：最长的先派发到共享队列；binpack：按LPT把任务固定分配给
+    负载最小的工作进程。两种方式预计总耗时相同（贪心列表调度）。
+    """
+    ordered = sorted(costs, key=lambda item: -item[1])
+    loads = [0.0] * max(1, worker_count)
+    assignment = []
+    for job, cost in ordered:
+        slot = loads.index(min(loads))
+        loads[slot] += cost
+        assignment.append((job, slot if mode == "binpack" else None))
+    return assignment, max(loads)
+
+
+def validate_batch_settings(source_path, hik_path, save_path, current_character=None, require_character=True,
+                            catalog=None):
+    """检查批处理设置，返回错误列表[(标题, 消息)]，没有错误时返回空列表
+
+    给出catalog（FileCatalog）时还检查目录中是否有FBX文件，扫描结果留给批处理复用。
+    """
+    errors = []
+    if not source_path:
+        errors.append(("警告", "请选择源数据目录"))
+    if not hik_path:
+        errors.append(("警告", "请选择HIK文件目录"))
+    if not save_path:
+        errors.append(("警告", "请选择保存位置"))
+    if require_character and not current_character:
+        errors.append(("警告", "请先获取当前场景角色"))
+    if source_path and not os.path.exists(source_path):
+        errors.append(("错误", "源数据目录不存在: {}".format(source_path)))
+    if hik_path and not os.path.exists(hik_path):
+        errors.append(("错误", "HIK文件目录不存在: {}".format(hik_path)))
+    if save_path and not os.path.exists(save_path):
+        errors.append(("错误", "保存位置不存在: {}".format(save_path)))
+    if catalog is not None and not errors:
+        if catalog.first(source_path) is None:
+            errors.append(("错误", "在源数据目录中没有找到FBX文件: {}".format(source_path)))
+        if catalog.first(hik_path) is None:
+            errors.append(("错误", "在HIK文件目录中没有找到FBX文件: {}".format(hik_path)))
+    return errors
+
+
+def default_worker_command():
+    """默认的工作进程命令：优先使用MotionBuilder自带的无界面解释器mobupy"""
+    bin_dir = os.path.dirname(sys.executable)
+    for name in ("mobupy.exe", "mobupy"):
+        candidate = os.path.join(bin_dir, name)
+        if os.path.isfile(candidate):
+            return [candidate]
+    return [sys.executable]
+
+
+def process_rss():
+    """当前进程的常驻内存（字节）：优先psutil，否则Windows用GetProcessMemoryInfo、Linux读/proc，不可用时返回None"""
+    if psutil is not None:
+        try:
+            return psutil.Process(os.getpid()).memory_info().rss
+        except Exception:
+            pass
+    if os.name == "nt":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+            get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+            if get_memory_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except (AttributeError, OSError, ValueError):
+            pass
+        return None
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class WorkerHealth(object):
+    """一个工作进程的健康状况：已处理文件数、常驻内存、单文件耗时相对初始基线的漂移
+
+    耗时按帧数归一化（没有帧数时用原始耗时），基线为进程启动后前DRIFT_WINDOW个文件的中位数，
+    当前值为最近DRIFT_WINDOW个文件的中位数。任一阈值被超过时recycle_reason()返回原因。
+    """
+
+    DRIFT_WINDOW = 5
+
+    def __init__(self, recycle_after=0, max_rss_mb=0, max_slowdown=0):
+        self.recycle_after = recycle_after  # 处理多少个文件后重启，0为不限
+        self.max_rss_mb = max_rss_mb  # 常驻内存上限（MB），0为不限
+        self.max_slowdown = max_slowdown  # 单文件耗时相对基线的最大倍数，0为不检查
+        self.reset()
+
+    def reset(self):
+        """工作进程重启后重新开始统计"""
+        self.files = 0
+        self.rss = None
+        self.baseline = []
+        self.recent = collections.deque(maxlen=self.DRIFT_WINDOW)
+
+    def add(self, duration, frames=None, rss=None):
+        self.files += 1
+        if rss:
+            self.rss = rss
+        cost = duration / frames if frames else duration
+        if len(self.baseline) < self.DRIFT_WINDOW:
+            self.baseline.append(cost)
+        else:
+            self.recent.append(cost)
+
+    def drift(self):
+        """最近耗时 / 基线耗时，样本不足时为None"""
+        if len(self.recent) < self.DRIFT_WINDOW:
+            return None
+        baseline = percentile(sorted(self.baseline), 0.5)
+        if baseline <= 0:
+            return None
+        return percentile(sorted(self.recent), 0.5) / baseline
+
+    def rss_mb(self):
+        return self.rss / (1024.0 * 1024.0) if self.rss else None
+
+    def recycle_reason(self):
+        if self.recycle_after and self.files >= self.recycle_after:
+            return "已处理 {} 个文件".format(self.files)
+        if self.max_rss_mb and self.rss and self.rss_mb() > self.max_rss_mb:
+            return "常驻内存 {:.0f} MB 超过 {} MB".format(self.rss_mb(), self.max_rss_mb)
+        drift = self.drift()
+        if self.max_slowdown and drift and drift > self.max_slowdown:
+            return "单文件耗时变为初始的 {:.2f} 倍".format(drift)
+        return None
+
+
+class WorkerPool(object):
+    """多进程工作池 - 每个工作进程是一个无界面的MotionBuilder，一次只打开一个场景
+
+    所有任务放在共享队列中，每个工作进程处理完当前文件后再领取下一个，
+    日志和结果通过事件队列交给调用方（主线程）处理，工作线程不直接调用UI。
+    recycle_policy（WorkerHealth的参数）不为空时，工作进程超过文件数/内存/耗时漂移阈值后
+    在两个文件之间重启，下一个任务由新进程处理。
+    工作进程每进入一个阶段输出一行阶段事件；某个阶段超过stage_timeouts中的时间（"*"为默认值）
+    视为卡死，结束并重启该工作进程。卡死或崩溃的任务等待retry_backoff秒（每次翻倍）后重试，
+    超过max_retries次的结果带"quarantined"标记。
+    """
+
+    def __init__(self, worker_count, worker_command, script_path, worker_config, recycle_policy=None,
+                 stage_timeouts=None, max_retries=0, retry_backoff=DEFAULT_RETRY_BACKOFF):
+        self.worker_count = max(1, int(worker_count))
+        self.worker_command = list(worker_command)
+        self.script_path = script_path
+        self.worker_config = worker_config
+        self.jobs = queue.Queue()
+        self.slot_jobs = {}  # 工作进程序号(从0开始) -> 固定分配给它的任务队列（binpack调度）
+        self.events = queue.Queue()
+        self.threads = []
+        self.pending = 0
+        self.stopped = False
+        self.closed = True  # 不会再添加任务（流式添加时先为False，close()后为True）
+        self.recycle_policy = recycle_policy
+        self.recycled_count = 0  # 因超过阈值而重启的次数
+        self.stage_timeouts = dict(stage_timeouts or {})  # 阶段名 -> 超时秒数
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.delayed = []  # 等待重试的任务 [(可以开始的时间, 任务)]
+        self.lock = threading.Lock()
+        self.timeout_count = 0  # 阶段超时次数
+        self.dead_slots = 0  # 因异常退出的调度线程数量
+        self.broken = None  # 所有调度线程都已异常退出时的错误信息，之后的任务直接判为失败
+
+    def build_command(self):
+        """构造启动单个工作进程的命令行"""
+        return self.worker_command + [self.script_path, "--worker",
+                                      "--worker-config", json.dumps(self.worker_config)]
+
+    def start(self, jobs, closed=True):
+        """放入任务并启动工作进程；closed=False时之后还可以用add()继续添加任务，最后调用close()"""
+        self.closed = closed
+        for job in jobs:
+            self.jobs.put(job)
+            self.pending += 1
+        self._start_slots(max(1, self.pending))
+
+    def add(self, job):
+        """流式添加一个任务，任务数超过已启动的工作进程时再启动新的
+
+        任务中有"slot"时只交给该序号的工作进程处理。
+        """
+        slot = job.get("slot")
+        self.pending += 1
+        with self.lock:
+            if self.broken is not None:
+                self._fail_job(None, job, self.broken)
+                return
+        if slot is None:
+            self.jobs.put(job)
+            self._start_slots(self.pending)
+        else:
+            self.slot_jobs.setdefault(slot, queue.Queue()).put(job)
+            self._start_slots(slot + 1)
+
+    def close(self):
+        """不再添加任务，队列取空后工作进程退出"""
+        self.closed = True
+
+    def _start_slots(self, wanted):
+        for slot in range(len(self.threads), min(self.worker_count, wanted)):
+            thread = threading.Thread(target=self._run_slot, args=(slot + 1,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def poll(self, timeout=0.2):
+        """取出当前可用的事件：('log', {message, index}) 或 ('result', 结果字典)"""
+        events = []
+        try:
+            events.append(self.events.get(timeout=timeout))
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        for kind, payload in events:
+            if kind == "result":
+                self.pending -= 1
+        return events
+
+    def is_done(self):
+        return self.closed and self.pending <= 0
+
+    def stop(self):
+        """停止派发新任务，正在处理的文件完成后工作进程退出"""
+        self.stopped = True
+        self.closed = True
+        with self.lock:
+            self.pending -= len(self.delayed)
+            self.delayed = []
+        for jobs in [self.jobs] + list(self.slot_jobs.values()):
+            try:
+                while True:
+                    jobs.get_nowait()
+                    self.pending -= 1
+            except queue.Empty:
+                pass
+
+    def shutdown(self, timeout=None):
+        """等待所有工作线程结束"""
+        self.stop()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _spawn(self, slot):
+        env = dict(os.environ)
+        env["PYTHONUNBUFFERED"] = "1"
+        env["PYTHONIOENCODING"] = "utf-8"
+        self.events.put(("log", {"message": "[工作进程{}] 启动: {}".format(slot, " ".join(self.worker_command)),
+                                 "index": None}))
+        process = subprocess.Popen(self.build_command(), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        # 输出行由读取线程放入队列，调度线程等待时可以检查阶段超时
+        process.lines = queue.Queue()
+        reader = threading.Thread(target=self._read_lines, args=(process,))
+        reader.daemon = True
+        reader.start()
+        return process
+
+    def _read_lines(self, process):
+        try:
+            for line in iter(process.stdout.readline, b""):
+                process.lines.put(line)
+        except (IOError, OSError, ValueError):
+            pass
+        finally:
+            process.lines.put(None)
+
+    def _run_slot(self, slot):
+        process = None
+        job = None
+        health = WorkerHealth(**self.recycle_policy) if self.recycle_policy else None
+        try:
+            while not self.stopped:
+                # 先读closed再取任务：close()之前放入的任务一定能被取到
+                closed = self.closed
+                job = self._next_job(slot)
+                if job is None:
+                    if closed and not self.delayed:
+                        break
+                    continue
+                if process is None or process.poll() is not None:
+                    if health is not None:
+                        health.reset()
+                    process = self._spawn(slot)
+                result = self._dispatch(slot, process, job)
+                if result.pop("retry", False):
+                    # 工作进程已卡死被结束或已崩溃，下一个任务启动新进程
+                    self._close(process)
+                    process = None
+                    if self.stopped:
+                        # 批处理已停止：不再重试，只记为失败，不加入隔离清单
+                        pass
+                    elif self._retry(slot, job, result["error"]):
+                        continue
+                    else:
+                        result["quarantined"] = True
+                result["worker"] = slot
+                result["attempts"] = job.get("attempt", 0) + 1
+                job = None
+                self.events.put(("result", result))
+                if process is not None and health is not None and self._should_recycle(slot, health, result):
+                    self._close(process)
+                    process = None
+        except Exception as e:
+            error = "[工作进程{}] 调度线程异常: {}".format(slot, str(e))
+            self.events.put(("log", {"message": error, "index": None}))
+            self._abandon_slot(slot, job, error)
+        finally:
+            if process is not None:
+                self._close(process)
+
+    def _fail_job(self, slot, job, error):
+        """不经过工作进程直接给出任务的失败结果（保证每个任务都有结果，pending能归零）"""
+        self.events.put(("result", {"index": job["index"], "fbx_file": job["fbx_file"], "success": False,
+                                    "error": error, "worker": slot, "attempts": job.get("attempt", 0) + 1}))
+
+    def _drain(self, jobs, slot, error):
+        try:
+            while True:
+                self._fail_job(slot, jobs.get_nowait(), error)
+        except queue.Empty:
+            pass
+
+    def _abandon_slot(self, slot, job, error):
+        """调度线程异常退出：当前任务和固定分配给它的任务判为失败；所有线程都退出时其余任务也判为失败"""
+        if job is not None:
+            self._fail_job(slot, job, error)
+        own_jobs = self.slot_jobs.get(slot - 1)
+        if own_jobs is not None:
+            self._drain(own_jobs, slot, error)
+        with self.lock:
+            self.dead_slots += 1
+            if self.dead_slots < len(self.threads):
+                return
+            self.broken = "所有工作进程都无法运行: {}".format(error)
+            self.events.put(("log", {"message": self.broken, "index": None}))
+            for ready_time, delayed_job in self.delayed:
+                self._fail_job(None, delayed_job, self.broken)
+            self.delayed = []
+            for jobs in [self.jobs] + list(self.slot_jobs.values()):
+                self._drain(jobs, None, self.broken)
+
+    def _should_recycle(self, slot, health, result):
+        """记录一个文件的耗时和内存，超过阈值时返回True（在下一个文件之前重启工作进程）"""
+        record = result.get("record") or {}
+        health.add(sum(record.get("stages", {}).values()), record.get("frames"), record.get("rss"))
+        reason = health.recycle_reason()
+        if not reason:
+            return False
+        self.recycled_count += 1
+        rss = health.rss_mb()
+        self.events.put(("log", {"message": "[工作进程{}] 重启: {}（{} 个文件，常驻内存 {}）".format(
+            slot, reason, health.files, "{:.0f} MB".format(rss) if rss else "未知"), "index": None}))
+        return True
+
+    def _retry(self, slot, job, error):
+        """把卡死/崩溃的任务放回等待队列（退避），超过重试次数时返回False"""
+        attempt = job.get("attempt", 0) + 1
+        if attempt > self.max_retries:
+            return False
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        with self.lock:
+            self.delayed.append((monotonic() + delay, dict(job, attempt=attempt, slot=None)))
+        self.events.put(("log", {"message": "[工作进程{}] {}，{:.0f}s后重试（第{}次）".format(
+            slot, error, delay, attempt), "index": job["index"]}))
+        return True
+
+    def stage_timeout(self, stage):
+        """阶段的超时秒数，没有设置时为None"""
+        timeout = self.stage_timeouts.get(stage) if stage else None
+        if timeout is None:
+            timeout = self.stage_timeouts.get("*")
+        return timeout or None
+
+    def _next_job(self, slot):
+        """先取到期的重试任务和固定分配给该工作进程的任务，再取共享队列中的任务，没有时返回None"""
+        if self.delayed:
+            now = monotonic()
+            with self.lock:
+                for index, (ready_time, job) in enumerate(self.delayed):
+                    if ready_time <= now:
+                        del self.delayed[index]
+                        return job
+        own_jobs = self.slot_jobs.get(slot - 1)
+        if own_jobs is not None:
+            try:
+                return own_jobs.get_nowait()
+            except queue.Empty:
+                pass
+        try:
+            return self.jobs.get(timeout=0.05)
+        except queue.Empty:
+            return None
+
+    def _dispatch(self, slot, process, job):
+        """把一个任务交给工作进程，转发其日志直到收到结果行"""
+        try:
+            process.stdin.write((json.dumps(job) + "\n").encode("ascii"))
+            process.stdin.flush()
+        except (IOError, OSError) as e:
+            return {"index": job["index"], "fbx_file": job["fbx_file"], "success": False,
+                    "error": "无法向工作进程发送任务: {}".format(str(e))}
+        stage = None
+        stage_start = monotonic()
+        while True:
+            timeout = self.stage_timeout(stage)
+            try:
+                if timeout is None:
+                    line = process.lines.get()
+                else:
+                    line = process.lines.get(timeout=max(0.01, stage_start + timeout - monotonic()))
+            except queue.Empty:
+                self.timeout_count += 1
+                self._kill(process)
+                return {"index": job["index"], "fbx_file": job["fbx_file"], "success": False, "retry": True,
+                        "error": "阶段 {} 超时（{}s），已结束工作进程".format(stage, timeout)}
+            if line is None:
+                process.wait()
+                return {"index": job["index"], "fbx_file": job["fbx_file"], "success": False, "retry": True,
+                        "error": "工作进程意外退出 (返回码 {})".format(process.returncode)}
+            line = to_native_str(line).rstrip("\r\n")
+            if line.startswith(WORKER_STAGE_PREFIX):
+                stage = line[len(WORKER_STAGE_PREFIX):]
+                stage_start = monotonic()
+                continue
+            if line.startswith(WORKER_RESULT_PREFIX):
+                try:
+                    return json.loads(line[len(WORKER_RESULT_PREFIX):])
+                except ValueError as e:
+                    # 结果行损坏时工作进程的状态未知，结束它，下一个任务启动新进程
+                    self._kill(process)
+                    process.wait()
+                    return {"index": job["index"], "fbx_file": job["fbx_file"], "success": False,
+                            "error": "工作进程返回的结果无法解析: {}".format(str(e))}
+            self.events.put(("log", {"message": "[工作进程{}] {}".format(slot, line), "index": job["index"]}))
+
+    def _kill(self, process):
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+    def _close(self, process):
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            process.wait()
+        except OSError:
+            pass
+
+
+def worker_main(config):
+    """工作进程入口：从stdin逐行读取任务，处理后把结果写回stdout"""
+    if config.get("fbsdk_module"):
+        load_fbsdk(config["fbsdk_module"])
+    processor = BatchProcessor(config["source_path"], config["hik_path"], config["save_path"],
+                               config.get("current_character"), None,
+                               intermediate_dir=config.get("intermediate_dir"),
+                               keep_intermediates=config.get("keep_intermediates", False),
+                               fan_out=config.get("fan_out", False),
+                               preflight=config.get("preflight", True),
+                               takes=config.get("takes", "current"),
+                               take_filter=config.get("take_filter"),
+                               split_takes=config.get("split_takes", False),
+                               animation_cache_dir=config.get("animation_cache_dir"),
+                               animation_cache_mb=config.get("animation_cache_mb", DEFAULT_ANIMATION_CACHE_MB),
+                               key_reduction=config.get("key_reduction"),
+                               resample_fps=config.get("resample_fps", 0),
+                               save_profile=config.get("save_profile"),
+                               save_profiles=config.get("save_profiles"),
+                               benchmark_save_profiles=config.get("benchmark_save_profiles"))
+
+    def emit_stage(stage):
+        sys.stdout.write(WORKER_STAGE_PREFIX + stage + "\n")
+        sys.stdout.flush()
+
+    processor.stage_callback = emit_stage
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        job = json.loads(line)
+        error = None
+        record = processor.begin_file(job["fbx_file"], job["index"] + 1)
+        anim_file = None
+        exported_takes = None
+        try:
+            if job.get("export_only"):
+                # 监视模式：只导出源动画，由调度进程在常驻的HIK目标场景上加载
+                for _ in processor.iter_prepare_source_animation(processor.ensure_str(job["fbx_file"])):
+                    pass
+                anim_file = processor.prepared_anim_file
+                exported_takes = processor.anim_takes.get(anim_file)
+                success = bool(anim_file)
+                if not success:
+                    error = processor.file_error or "导出源动画失败"
+            else:
+                success = bool(processor.process_single_file(job["fbx_file"], job["hik_files"]))
+                if not success:
+                    error = processor.file_error or "文件处理失败"
+        except Exception as e:
+            success = False
+            error = str(e)
+        processor.file_records.pop(job["fbx_file"], None)
+        processor.current_record = None
+        result = {"index": job["index"], "fbx_file": job["fbx_file"], "success": success, "error": error,
+                  "anim_file": anim_file, "takes": exported_takes,
+                  "record": {"stages": record["stages"], "sizes": record["sizes"], "targets": record["targets"],
+                             "frames": record.get("frames"), "rss": process_rss(),
+                             "split_outputs": record.get("split_outputs", {}), "take_times": record.get("take_times"),
+                             "animation_cache": record.get("animation_cache"), "keys": record.get("keys"),
+                             "save_profiles": record.get("save_profiles")}}
+        sys.stdout.write(WORKER_RESULT_PREFIX + json.dumps(result) + "\n")
+        sys.stdout.flush()
+    return 0
+
+
+class CharacterResolver(object):
+    """角色查找 - 每个打开的场景只建立一次 名称->FBCharacter 索引
+
+    优先使用Scene.Characters，旧版本没有时才遍历Scene.Components。
+    FileOpen/FileNew/FileAppend之后场景中的角色会变化，必须调用invalidate()。
+    """
+
+    def __init__(self, preferred_name=None, log=None):
+        self.preferred_name = preferred_name  # UI中选择的角色名
+        self.log = log  # log(message, level)，场景中没有选择的角色时输出警告
+        self.index = None  # 角色名 -> FBCharacter（保持场景中的顺序）
+        self.fallback_warned = False  # 当前场景是否已输出过改用其他角色的警告
+
+    def invalidate(self):
+        self.index = None
+        self.fallback_warned = False
+
+    def build(self):
+        scene = FBSystem().Scene
+        characters = getattr(scene, "Characters", None)
+        if characters is None:
+            characters = [comp for comp in scene.Components if comp.ClassName() == 'FBCharacter']
+        index = collections.OrderedDict()
+        for character in characters:
+            index.setdefault(character.Name, character)
+        self.index = index
+        return index
+
+    def characters(self):
+        """场景中的所有角色"""
+        if self.index is None:
+            self.build()
+        return list(self.index.values())
+
+    def names(self):
+        if self.index is None:
+            self.build()
+        return list(self.index)
+
+    def find(self, name):
+        """按名称查找角色，没有时返回None"""
+        if self.index is None:
+            self.build()
+        return self.index.get(name)
+
+    def resolve(self, make_current=True):
+        """确定要使用的角色：UI选择的角色 > CurrentCharacter > 场景中第一个角色
+
+        make_current为True时把结果设为CurrentCharacter，后续加载/保存操作作用于同一个角色。
+        """
+        character = self.find(self.preferred_name) if self.preferred_name else None
+        if character is None:
+            character = FBApplication().CurrentCharacter
+        if character is None:
+            characters = self.characters()
+            character = characters[0] if characters else None
+        if self.preferred_name and character is not None and character.Name != self.preferred_name:
+            self.warn_fallback(character)
+        if character is not None and make_current and FBApplication().CurrentCharacter != character:
+            FBApplication().CurrentCharacter = character
+        return character
+
+    def warn_fallback(self, character):
+        """场景中没有选择的角色、改用其他角色时警告（每个场景一次）"""
+        if self.fallback_warned or not self.log:
+            return
+        self.fallback_warned = True
+        self.log("    --> 警告：场景中没有角色 {}，改用 {}（场景中的角色: {}）".format(
+            self.preferred_name, character.Name, ", ".join(self.names()) or "无"), level="warning")
 
 
 class BatchProcessor:
-    """批处理器 - 单线程版本"""
+    """批处理器 - 单线程版本，worker_count > 1 时分发给多个无界面工作进程"""
     
-    def __init__(self, source_path, hik_path, save_path, current_character, log_callback):
+    # 任务描述中作为路径/角色单独给出的构造参数
+    JOB_PATH_ARGS = ("source_path", "hik_path", "save_path", "current_character")
+
+    def __init__(self, source_path, hik_path, save_path, current_character, log_callback,
+                 worker_count=1, worker_command=None, fbsdk_module=None,
+                 resident_target=False, resident_chunk_size=50,
+                 intermediate_dir=None, keep_intermediates=False, resume=True,
+                 progress_callback=None, poll_interval=0.2,
+                 log_file=None, echo_console=True,
+                 catalog=None, include_patterns=None, exclude_patterns=None, fan_out=False,
+                 preflight=True, schedule=None, prefetch_depth=0, async_upload=False, transfer_bandwidth=0,
+                 lease_dir=None, lease_ttl=DEFAULT_LEASE_TTL,
+                 recycle_after=0, max_worker_rss_mb=0, max_slowdown=0,
+                 stage_timeouts=None, max_retries=2, retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 dedupe=False, dedupe_threads=DEFAULT_HASH_THREADS, dedupe_link=True,
+                 takes="current", take_filter=None, split_takes=False,
+                 animation_cache_dir=None, animation_cache_mb=DEFAULT_ANIMATION_CACHE_MB,
+                 key_reduction=None, resample_fps=0,
+                 save_profile=None, save_profiles=None, benchmark_save_profiles=None,
+                 history_db=None, watch_interval=DEFAULT_WATCH_INTERVAL, watch_settle=DEFAULT_WATCH_SETTLE,
+                 watch_idle_exit=0):
         self.source_path = source_path
         self.hik_path = hik_path
         self.save_path = save_path
         self.current_character = current_character
+        self.character_resolver = CharacterResolver(current_character, self.log)  # 当前场景的角色索引
         self.log_callback = log_callback  # 日志回调函数
+        self.worker_count = worker_count  # 工作进程数量，1为当前进程内串行处理
+        self.worker_command = worker_command  # 启动工作进程的命令，默认使用mobupy
+        self.fbsdk_module = fbsdk_module  # 工作进程中代替pyfbsdk导入的模块名
+        self.resident_target = resident_target  # 常驻HIK目标场景，不再每个文件FileNew+FileAppend
+        self.resident_chunk_size = resident_chunk_size  # 常驻模式下每批先导出多少个源动画
+        self.resident_fingerprint = None  # 常驻目标场景加载后的组件指纹
+        self.resident_take_name = None  # 常驻目标场景的基础Take名称
+        self.intermediate_dir = intermediate_dir or default_intermediate_dir()  # 中间动画文件目录
+        self.keep_intermediates = keep_intermediates  # 是否保留中间动画文件（默认在加载到最后一个目标之后删除）
+        self.round_trip_total = 0.0  # 本次批处理中间文件往返总耗时
+        self.resume = resume  # 根据保存位置中的清单跳过已完成的文件
+        self.manifest = None
+        self.fan_out = fan_out  # 扇出模式：每个源动画依次加载到所有HIK目标上，输出按目标分目录
+        self.target_files = []  # 本次使用的HIK目标文件
+        self.target_hashes = {}  # HIK目标文件 -> 内容的md5
+        self.source_targets = {}  # 源文件 -> 尚未完成的HIK目标（断点续跑）
+        self.options_hash = None  # 当前Plot/FBX选项集合的md5
+        self.progress_callback = progress_callback  # 进度回调(已完成, 总数, 预计剩余秒数)
+        self.poll_interval = poll_interval  # 多进程模式下每步等待工作进程事件的时间
+        self.progress_total = 0
+        self.progress_start = monotonic()
+        self.success_count = 0
+        self.error_count = 0
+        self.file_result = None
+        self.file_error = None  # 当前文件失败的原因（没有具体原因时为None）
+        self.preflight = preflight  # FileOpen前用FBX读取器预检文件，损坏的文件直接判为失败
+        self.fbx_info = {}  # 源文件 -> 预检结果(错误, 文件信息)，调度时读取后在处理时复用
+        self.scheduled_files = []  # 按调度顺序排列的源文件（非stream调度）
+        self.schedule = schedule  # stream/longest/binpack，None为多进程时longest、否则stream
+        self.cost_model = CostModel()
+        self.job_slots = {}  # 源文件 -> binpack调度分配的工作进程序号
+        self.predicted_makespan = None  # 调度时预计的总耗时（秒）
+        self.prefetch_depth = prefetch_depth  # 后台预读到本地缓存的源文件数量，0为不预读
+        self.async_upload = async_upload  # 输出先保存到本地，再由后台线程移动到保存位置
+        self.transfer_bandwidth = transfer_bandwidth  # 预读/上传限速（MB/s），0为不限速
+        self.prefetcher = None
+        self.uploader = None
+        self.upload_error_count = 0
+        self.lease_dir = lease_dir  # 多节点协作的共享租约目录，None为单节点
+        self.lease_ttl = lease_ttl  # 租约有效期（秒），超过后视为节点已死亡
+        self.node_id = "{}-{}".format(socket.gethostname(), os.getpid())
+        self.leases = None
+        self.lease_keys = {}  # 源文件 -> 租约键
+        self.lease_skipped_count = 0  # 其他节点已完成的文件数量
+        self.recycle_after = recycle_after  # 工作进程处理多少个文件后重启，0为不限
+        self.max_worker_rss_mb = max_worker_rss_mb  # 工作进程常驻内存超过多少MB后重启，0为不限
+        self.max_slowdown = max_slowdown  # 单文件耗时超过初始基线多少倍后重启，0为不检查
+        self.stage_timeouts = stage_timeouts  # 阶段名 -> 超时秒数（"*"为默认），由工作进程的监督线程检查
+        self.max_retries = max_retries  # 卡死/崩溃的文件最多重试几次
+        self.retry_backoff = retry_backoff  # 第一次重试前等待的秒数，之后每次翻倍
+        self.quarantine = None
+        self.quarantined_count = 0  # 本次加入隔离清单的文件数量
+        self.quarantine_skipped_count = 0  # 隔离清单中跳过的文件数量
+        self.dedupe = dedupe  # 内容相同的源文件只处理一次，输出分发给其他文件
+        self.dedupe_threads = dedupe_threads  # 计算内容哈希的线程数
+        self.dedupe_link = dedupe_link  # 分发输出时优先使用硬链接（不支持时复制）
+        self.duplicates = {}  # 处理的源文件 -> 内容相同、共用其输出的源文件
+        self.duplicate_output_count = 0  # 已分发的重复输出数量
+        self.takes = takes  # current只处理当前Take，all处理所有Take
+        self.take_filter = take_filter  # Take名称模式列表（fnmatch），设置后只处理匹配的Take
+        self.split_takes = split_takes  # 每个Take单独保存一个输出文件
+        self.upload_remaining = {}  # (源文件, HIK目标) -> 拆分Take时尚未上传完成的输出数量
+        self.animation_cache_dir = animation_cache_dir  # 中间动画缓存目录（可多个节点共用），None为不缓存
+        self.animation_cache_mb = animation_cache_mb  # 中间动画缓存容量（MB）
+        self.animation_cache = None
+        self.key_reduction = key_reduction  # 属性类型 -> 关键帧精简容差（"*"为默认），None为不精简
+        self.resample_fps = resample_fps  # 加载动画后重采样到的帧率，0为不重采样
+        self.save_profile = save_profile  # 最终保存使用的配置名（SAVE_PROFILES或save_profiles），None为默认FileSave
+        self.save_profiles = dict(SAVE_PROFILES, **(save_profiles or {}))  # 可用的保存配置（任务中可以增加/覆盖）
+        self.benchmark_save_profiles = benchmark_save_profiles  # 每个文件额外用这些配置试保存，记录耗时和大小
+        self.missing_fbx_options = set()  # 当前版本FBFbxOptions没有的属性（已记录过警告）
+        self.history_db = history_db  # 运行历史数据库路径，None为默认路径，False不写
+        self.history_run_id = None  # 本次运行在历史数据库中的id
+        self.watch_interval = watch_interval  # 监视模式扫描源目录的间隔（秒）
+        self.watch_settle = watch_settle  # 监视模式：文件大小和修改时间保持不变多少秒后才处理
+        self.watch_idle_exit = watch_idle_exit  # 监视模式：空闲多少秒后结束，0为一直运行
+        self.watch_detected = {}  # 源文件 -> 监视模式中第一次发现它（本次变化）的时间
+        self.resident_hik_file = None  # 当前场景是哪个HIK目标的常驻场景（被FileOpen/FileNew替换后为None）
+        self.stage_callback = None  # 进入阶段时的回调（工作进程用它向监督线程报告阶段）
+        self.prepared_anim_file = None
+        self.anim_takes = {}  # 中间动画文件 -> 导出时包含的源Take名称（拆分Take保存时只保存这些Take）
+        self.loaded_takes = None  # 最近加载到目标场景的中间动画包含的源Take名称
+        self.run_result = (False, "批处理未开始")
+        self.log_file = log_file  # 结构化日志文件，None为保存位置下的默认文件，False不写
+        self.echo_console = echo_console  # 是否同时输出到控制台（工作进程必须输出）
+        self.log_writer = None
+        self.current_file_index = None  # 当前文件序号，写入结构化日志
+        self.current_stage = None  # 当前阶段，写入结构化日志
+        self.report = RunReport()  # 本次运行的报告
+        self.file_records = {}  # 源文件 -> 正在处理的文件记录（阶段耗时、文件大小）
+        self.current_record = None  # 当前文件记录，timed()的耗时记在这里
+        self.catalog = catalog or FileCatalog(include_patterns, exclude_patterns)  # 目录扫描缓存（可与UI共用）
+        self.discovered_count = 0  # 源目录中已发现的文件数量
+        self.skipped_count = 0  # 断点续跑跳过的文件数量
+        self.scan_complete = False  # 源目录是否已扫描完
         self.is_running = True
         
     def stop(self):
@@ -44,362 +2487,2040 @@ class BatchProcessor:
             return str(path)
         return path
         
-    def log(self, message):
+    def log(self, message, level="info"):
         """统一的日志方法"""
-        print(message)  # 输出到控制台
+        if self.echo_console:
+            print(message)  # 输出到控制台
         if self.log_callback:
             self.log_callback(message)  # 通过回调发送到UI
+        if self.log_writer:
+            try:
+                self.log_writer.write({"time": time.time(), "level": level, "file_index": self.current_file_index,
+                                       "stage": self.current_stage, "message": message})
+            except (IOError, OSError, ValueError):
+                # 日志文件写入失败不影响批处理
+                self.log_writer = None
+    
+    def begin_stage(self, stage):
+        """进入一个处理阶段"""
+        self.current_stage = stage
+        if self.stage_callback:
+            self.stage_callback(stage)
+    
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """用单调时钟计时一个阶段，耗时累加到当前文件记录（没有当前文件时记为共享阶段）"""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            elapsed = monotonic() - start
+            if self.current_record is not None:
+                stages = self.current_record["stages"]
+                stages[stage] = stages.get(stage, 0.0) + elapsed
+            else:
+                self.report.add_shared(stage, elapsed)
+    
+    def record_size(self, name, path):
+        """把文件大小记录到当前文件记录"""
+        if self.current_record is None:
+            return
+        try:
+            self.current_record["sizes"][name] = os.path.getsize(path)
+        except OSError:
+            pass
+    
+    def begin_file(self, fbx_file, index):
+        """开始（或在常驻模式第二阶段继续）处理一个文件，之后的计时记入该文件"""
+        self.current_file_index = index
+        record = self.file_records.get(fbx_file)
+        if record is None:
+            record = {"index": index, "file": fbx_file, "stages": {}, "sizes": {}, "targets": []}
+            self.file_records[fbx_file] = record
+        self.current_record = record
+        self.record_size("source", fbx_file)
+        return record
+    
+    def open_log_file(self):
+        """打开保存位置下的结构化日志文件"""
+        if self.log_file is False or not self.save_path:
+            return
+        name = LOG_FILE_NAME
+        if self.lease_dir:
+            # 多节点共用保存位置时每个节点写自己的日志文件
+            name = "{}_{}{}".format(os.path.splitext(name)[0], self.node_id, os.path.splitext(name)[1])
+        path = self.log_file or os.path.join(self.save_path, name)
+        try:
+            self.log_writer = JsonlLogWriter(self.ensure_str(path))
+        except (IOError, OSError) as e:
+            self.log("无法打开日志文件: {}".format(str(e)), level="warning")
+    
+    def close_log_file(self):
+        if self.log_writer:
+            self.log_writer.close()
+            self.log_writer = None
         
     def run(self):
-        """运行批处理"""
+        """运行批处理（阻塞直到结束），返回(是否成功, 消息)"""
+        for _ in self.iter_run():
+            pass
+        return self.run_result
+    
+    def iter_run(self):
+        """分步运行批处理的生成器：每完成一个阶段yield一次，结果保存在self.run_result
+
+        UI用QTimer逐步驱动它，两次调用之间处理界面事件，stop()在阶段之间生效。
+        """
+        self.run_result = (False, "批处理未完成")
+        self.success_count = 0
+        self.error_count = 0
+        self.open_log_file()
+        try:
+            self.begin_stage("scan")
+            self.log("=== 批处理开始 ===")
+            self.log("线程初始化完成，开始处理...")
+            self.log("源路径: {}".format(self.source_path))
+            self.log("HIK路径: {}".format(self.hik_path))
+            self.log("保存路径: {}".format(self.save_path))
+            self.log("角色: {}".format(self.current_character))
+            
+            self.log("=== 开始批处理 ===")
+            
+            # HIK目录通常只有几个文件，先完整扫描并验证
+            target_files = self.select_target_files()
+            if not target_files:
+                return
+            
+            # 断点续跑：读取清单，扫描时跳过输出仍然有效的文件
+            self.begin_resume(target_files)
+            yield "validate"
+            
+            # 源目录边扫描边处理：发现一个文件就交给处理流程
+            self.begin_stage("scan")
+            self.log("扫描源目录: {}".format(self.source_path))
+            fbx_files = self.iter_source_files()
+            if self.dedupe:
+                # 查找重复文件需要完整的文件列表
+                fbx_files = self.dedupe_files(list(fbx_files))
+                yield "dedupe"
+            if self.schedule_mode() != "stream":
+                # 按估计耗时调度需要完整的文件列表：边扫描边估计，分步yield
+                for stage in self.iter_schedule_files(fbx_files):
+                    yield stage
+                fbx_files = self.scheduled_files
+            
+            # 开始批处理（扫描和调度已经统计了progress_total，不能重置为0）
+            self.start_progress(self.progress_total)
+            self.start_leases()
+            if self.leases:
+                # 多进程模式在等待其他节点时不能阻塞：还要回收本节点工作进程的结果、释放租约
+                fbx_files = self.iter_claimed(fbx_files, wait=not self.uses_worker_pool())
+            self.start_transfers()
+            if self.prefetcher:
+                fbx_files = self.iter_prefetched(fbx_files)
+            if self.uses_worker_pool():
+                steps = self.iter_pool(fbx_files)
+            elif self.resident_target:
+                steps = self.iter_resident(fbx_files)
+            else:
+                steps = self.iter_serial(fbx_files)
+            for stage in steps:
+                yield stage
+            for stage in self.iter_finish_uploads():
+                yield stage
+            
+            skipped_count = self.skipped_count
+            if self.is_running and not self.discovered_count:
+                self.log("错误：在指定目录中没有找到FBX文件", level="error")
+                self.run_result = (False, "在指定目录中没有找到FBX文件")
+                return
+            
+            if self.is_running:
+                final_msg = "批处理完成！成功: {}, 失败: {}".format(self.success_count, self.error_count)
+            else:
+                final_msg = "批处理已停止！成功: {}, 失败: {}".format(self.success_count, self.error_count)
+            if skipped_count:
+                final_msg += ", 跳过: {}".format(skipped_count)
+            if self.quarantine_skipped_count:
+                final_msg += ", 隔离清单跳过: {}".format(self.quarantine_skipped_count)
+            if self.upload_error_count:
+                final_msg += ", 上传失败: {}".format(self.upload_error_count)
+            if self.quarantined_count:
+                final_msg += ", 隔离: {}".format(self.quarantined_count)
+            if self.duplicate_output_count:
+                final_msg += ", 重复文件共用输出: {}".format(self.duplicate_output_count)
+            if self.benchmark_save_profiles:
+                self.log_profile_benchmark()
+            cache_hits = sum(1 for row in self.report.rows if row.get("animation_cache") == "hit")
+            if cache_hits:
+                final_msg += ", 动画缓存命中: {}".format(cache_hits)
+            if self.animation_cache and self.animation_cache.evicted_count:
+                self.log("动画缓存: 淘汰 {} 个条目".format(self.animation_cache.evicted_count))
+            if self.leases:
+                self.log("多节点协作: 其他节点完成 {} 个文件，回收过期租约 {} 个".format(
+                    self.lease_skipped_count, self.leases.reclaimed_count))
+                if self.leases.lost_count:
+                    self.log("警告：{} 个租约在处理期间被其他节点回收（心跳超时）".format(self.leases.lost_count),
+                             level="warning")
+            self.write_report()
+            self.write_history(final_msg)
+            self.log("\n=== 批处理结束 ===")
+            if self.predicted_makespan is not None:
+                self.log("实际总耗时: {}（预计 {}）".format(format_duration(monotonic() - self.progress_start),
+                                                       format_duration(self.predicted_makespan)))
+            if self.round_trip_total:
+                self.log("中间文件往返总耗时: {:.2f}s".format(self.round_trip_total))
+            self.log(final_msg)
+            self.run_result = (self.is_running and not self.upload_error_count, final_msg)
+            
+        except Exception as e:
+            error_msg = "批处理过程中出错: {}".format(str(e))
+            self.log("批处理主线程异常: {}".format(str(e)), level="error")
+            import traceback
+            # 获取完整的异常信息
+            exc_info = traceback.format_exc()
+            self.log("主线程异常详情: {}".format(exc_info), level="error")
+            self.run_result = (False, error_msg)
+        finally:
+            self.close_transfers()
+            self.close_manifest()
+            self.close_leases()
+            self.current_file_index = None
+            self.current_stage = None
+            self.close_log_file()
+    
+    def select_target_files(self):
+        """扫描并验证HIK目录和保存配置，返回本次使用的HIK目标；失败时设置run_result并返回None"""
+        self.begin_stage("validate")
+        hik_files = self.catalog.files(self.hik_path)
+        
+        self.log("扫描HIK目录: {}".format(self.hik_path))
+        self.log("找到HIK文件数量: {}".format(len(hik_files)))
+        
+        # 验证HIK文件
+        valid_hik_files = self.validate_hik_files(hik_files)
+        self.log("有效HIK文件数量: {}".format(len(valid_hik_files)))
+        
+        if not valid_hik_files:
+            self.run_result = (False, "没有找到有效的HIK FBX文件")
+            return None
+        
+        unknown_profiles = [name for name in [self.save_profile] + list(self.benchmark_save_profiles or [])
+                            if name and name not in self.save_profiles]
+        if unknown_profiles:
+            self.run_result = (False, "未知的保存配置: {}（可用: {}）".format(
+                ", ".join(unknown_profiles), ", ".join(sorted(self.save_profiles))))
+            return None
+        if self.save_profile:
+            self.log("保存配置: {}".format(self.save_profile))
+        
+        if self.fan_out:
+            self.log("扇出模式：每个源动画应用到 {} 个HIK目标".format(len(valid_hik_files)))
+            return valid_hik_files
+        return valid_hik_files[:1]
+    
+    def watch(self):
+        """运行监视模式（阻塞直到停止或空闲超时），返回(是否成功, 消息)"""
+        for _ in self.iter_watch():
+            pass
+        return self.run_result
+    
+    def iter_watch(self):
+        """监视模式的生成器：常驻运行，定期扫描源目录，大小和修改时间稳定后立即处理新增或变化的文件
+
+        常驻目标模式下源文件的打开、Plot和导出交给常驻的无界面工作进程，本进程一直保持HIK目标场景，
+        只加载动画、保存并清空Take；无法启动工作进程（找不到脚本文件）时在本进程中按常驻目标模式处理
+        每次扫描发现的文件（每批重新加载一次目标）。没有设置常驻目标时在本进程中逐个处理，
+        每个文件都重新FileNew+FileAppend目标。Ctrl+C、stop()或空闲超过watch_idle_exit秒后结束。
+        """
+        self.run_result = (False, "监视未完成")
+        self.success_count = 0
+        self.error_count = 0
+        self.progress_total = 0
+        self.scan_complete = True
+        self.open_log_file()
+        pool = None
+        try:
+            self.log("=== 监视模式开始 ===")
+            self.log("源路径: {}（每 {}s 扫描，文件稳定 {}s 后处理）".format(
+                self.source_path, self.watch_interval, self.watch_settle))
+            self.log("HIK路径: {}".format(self.hik_path))
+            self.log("保存路径: {}".format(self.save_path))
+            target_files = self.select_target_files()
+            if not target_files:
+                return
+            self.begin_resume(target_files)
+            yield "validate"
+            
+            watcher = SourceWatcher(self.source_path, self.catalog.include, self.catalog.exclude, self.watch_settle)
+            if self.resident_target:
+                pool = self.start_export_pool()
+            else:
+                self.log("未设置常驻目标（resident_target），每个文件都重新新建场景并合并HIK目标；"
+                         "现场低延迟处理建议设置 \"resident_target\": true", level="warning")
+            next_scan = monotonic()
+            idle_since = monotonic()
+            try:
+                while self.is_running:
+                    if monotonic() >= next_scan:
+                        self.begin_stage("watch")
+                        next_scan = monotonic() + self.watch_interval
+                        ready = [fbx_file for fbx_file in watcher.poll() if self.accept_watched(fbx_file, watcher)]
+                        if ready:
+                            idle_since = monotonic()
+                            self.log("\n发现 {} 个新增或变化的文件".format(len(ready)))
+                            if pool is not None:
+                                first_index = self.progress_total - len(ready)
+                                for offset, fbx_file in enumerate(ready):
+                                    pool.add({"index": first_index + offset, "fbx_file": self.ensure_str(fbx_file),
+                                              "hik_files": [], "export_only": True})
+                            elif self.resident_target:
+                                for stage in self.iter_resident(ready):
+                                    yield stage
+                            else:
+                                for stage in self.iter_serial(ready):
+                                    yield stage
+                    if pool is not None:
+                        if pool.pending > 0:
+                            idle_since = monotonic()
+                        for kind, payload in pool.poll(self.poll_interval):
+                            if kind == "log":
+                                self.log(payload["message"])
+                            else:
+                                self.apply_exported(payload)
+                    else:
+                        time.sleep(min(self.poll_interval, max(0.0, next_scan - monotonic())))
+                    if self.watch_idle_exit and monotonic() - idle_since > self.watch_idle_exit:
+                        self.log("空闲超过 {}s，结束监视".format(self.watch_idle_exit))
+                        break
+                    yield "watch"
+            except KeyboardInterrupt:
+                self.log("收到中断，结束监视")
+                self.is_running = False
+            
+            final_msg = "监视结束！成功: {}, 失败: {}".format(self.success_count, self.error_count)
+            if self.quarantine_skipped_count:
+                final_msg += ", 隔离清单跳过: {}".format(self.quarantine_skipped_count)
+            self.write_report()
+            self.write_history(final_msg)
+            self.log(final_msg)
+            self.run_result = (True, final_msg)
+        except Exception as e:
+            self.log("监视模式异常: {}".format(str(e)), level="error")
+            import traceback
+            self.log("监视模式异常详情: {}".format(traceback.format_exc()), level="error")
+            self.run_result = (False, "监视过程中出错: {}".format(str(e)))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            self.close_manifest()
+            self.current_file_index = None
+            self.current_stage = None
+            self.close_log_file()
+    
+    def accept_watched(self, fbx_file, watcher):
+        """监视到的文件是否需要处理（跳过隔离清单中和输出仍然有效的文件），需要时记录发现时间"""
+        self.discovered_count += 1
+        if self.quarantine is not None and self.quarantine.contains(fbx_file):
+            self.log("跳过隔离清单中的文件: {}".format(fbx_file), level="warning")
+            self.quarantine_skipped_count += 1
+            return False
+        targets = self.pending_targets(fbx_file)
+        if not targets:
+            self.skipped_count += 1
+            return False
+        if len(targets) < len(self.target_files):
+            self.source_targets[fbx_file] = targets
+        self.progress_total += 1
+        self.watch_detected[fbx_file] = watcher.first_seen(fbx_file)
+        return True
+    
+    def start_export_pool(self):
+        """启动常驻的源动画导出工作进程（监视模式），无法定位脚本文件时返回None（在本进程中按批处理）"""
+        script_path = os.path.abspath(globals().get("__file__", ""))
+        if not os.path.isfile(script_path):
+            self.log("无法定位脚本文件，不能启动导出工作进程：在本进程中打开源文件，"
+                     "HIK目标场景不能一直常驻，每批新文件重新加载一次", level="warning")
+            return None
+        worker_command = self.worker_command or default_worker_command()
+        self.log("源动画导出工作进程: {} 个，本进程保持HIK目标场景".format(max(1, self.worker_count)))
+        pool = WorkerPool(self.worker_count, worker_command, script_path, self.get_worker_config(),
+                          self.recycle_policy(), self.stage_timeouts, self.max_retries, self.retry_backoff)
+        pool.start([], closed=False)
+        return pool
+    
+    def apply_exported(self, payload):
+        """工作进程导出源动画后，在本进程常驻的HIK目标场景上加载、保存，然后结束该文件"""
+        fbx_file = payload["fbx_file"]
+        record = self.begin_file(fbx_file, payload["index"] + 1)
+        worker_record = payload.get("record") or {}
+        record["stages"].update(worker_record.get("stages", {}))
+        record["sizes"].update(worker_record.get("sizes", {}))
+        for name in ("frames", "animation_cache"):
+            if worker_record.get(name) is not None:
+                record[name] = worker_record[name]
+        if not payload["success"]:
+            self.log("导出源动画失败 ({}): {} - {}".format(self.file_position(payload["index"] + 1),
+                                                    os.path.basename(fbx_file), payload.get("error")), level="error")
+            if payload.get("quarantined"):
+                self.quarantine_file(fbx_file, payload.get("error"), payload.get("attempts"))
+            self.file_done(fbx_file, False, payload.get("error"))
+            return
+        self.log("\n--- 处理文件 {} ---".format(self.file_position(payload["index"] + 1)))
+        self.log("文件: {}".format(fbx_file))
+        anim_file = payload["anim_file"]
+        if payload.get("takes") is not None:
+            self.anim_takes[anim_file] = payload["takes"]
+        self.file_error = None
+        result = True
+        try:
+            targets = self.targets_for(fbx_file)
+            for position, hik_file in enumerate(targets):
+                hik_file = self.ensure_str(hik_file)
+                if not self.ensure_resident_target(hik_file):
+                    result = False
+                    continue
+                result = self.apply_on_resident_target(fbx_file, anim_file, hik_file,
+                                                       discard=position == len(targets) - 1) and result
+        except Exception as e:
+            self.log("处理文件异常: {}".format(str(e)), level="error")
+            result = False
+        finally:
+            self.discard_intermediate(anim_file)
+        if result:
+            self.log("文件处理成功")
+        else:
+            self.log("文件处理失败", level="error")
+        self.file_done(fbx_file, result, self.file_error)
+    
+    def start_progress(self, total_files):
+        """开始计算进度和剩余时间"""
+        self.progress_total = total_files
+        self.progress_start = monotonic()
+        self.report_progress()
+    
+    def file_done(self, fbx_file, success, error=None, record=None):
+        """一个文件处理结束：更新计数、清单、运行报告和进度
+
+        record为工作进程回传的记录（多进程模式），否则使用本进程中的文件记录。
+        """
+        self.collect_uploads()
+        if self.leases:
+            self.complete_lease(fbx_file, success, error)
+        if not success and self.duplicates.get(fbx_file):
+            self.log("  -> 内容相同的 {} 个文件同样没有输出".format(len(self.duplicates[fbx_file])), level="error")
+        if success:
+            self.success_count += 1
+        else:
+            self.error_count += 1
+        if record is None:
+            record = self.file_records.pop(fbx_file, None) or {"stages": {}, "sizes": {}}
+            record["rss"] = process_rss()
+        if self.current_record is record:
+            self.current_record = None
+        self.record_targets(fbx_file, record)
+        detected = self.watch_detected.pop(fbx_file, None)
+        latency = time.time() - detected if detected else None
+        if latency is not None:
+            self.log("  -> 从发现到输出: {:.1f}s".format(latency))
+        self.report.add({
+            "index": self.current_file_index,
+            "file": fbx_file,
+            "status": "success" if success else "failed",
+            "error": error,
+            "total": sum(record.get("stages", {}).values()),
+            "stages": record.get("stages", {}),
+            "sizes": record.get("sizes", {}),
+            "frames": record.get("frames"),
+            "rss": record.get("rss"),
+            "takes": record.get("take_times"),
+            "animation_cache": record.get("animation_cache"),
+            "keys": record.get("keys"),
+            "save_profiles": record.get("save_profiles"),
+            "latency": latency,
+        })
+        self.report_progress()
+    
+    def start_leases(self):
+        """多节点协作模式：打开共享租约目录"""
+        self.leases = None
+        self.lease_keys = {}
+        self.lease_skipped_count = 0
+        if not self.lease_dir:
+            return
+        self.leases = LeaseDirectory(self.ensure_str(self.lease_dir), self.node_id, self.lease_ttl)
+        self.log("多节点协作: 租约目录 {}，节点 {}，租约有效期 {}s".format(
+            self.lease_dir, self.node_id, self.lease_ttl))
+    
+    def lease_key(self, fbx_file):
+        """租约键：源文件相对路径、源文件签名、HIK目标和选项的校验和（任何一项变化都是新的工作单元）"""
+        key = self.lease_keys.get(fbx_file)
+        if key is None:
+            relative = os.path.normcase(os.path.relpath(fbx_file, self.source_path)).replace("\\", "/")
+            stat = os.stat(fbx_file)
+            signature = [relative, stat.st_size, int(stat.st_mtime), self.options_hash,
+                         sorted(self.target_hashes.values())]
+            key = hashlib.md5(to_bytes(json.dumps(signature))).hexdigest()
+            self.lease_keys[fbx_file] = key
+        return key
+    
+    def iter_claimed(self, fbx_files, wait=True):
+        """只产出本节点领取到租约的文件
+
+        其他节点正在处理的文件放到最后等待：对方完成则跳过，租约过期（节点死亡）则由本节点回收处理。
+        wait为False时等待期间不休眠而是产出None（表示暂时没有文件），调用方可以先处理其他事件。
+        """
+        deferred = []
+        for fbx_file in fbx_files:
+            if self.leases.claim(self.lease_key(fbx_file), {"file": fbx_file}):
+                yield fbx_file
+                continue
+            self.progress_total -= 1
+            if self.leases.is_finished(self.lease_key(fbx_file)):
+                self.lease_skipped_count += 1
+            else:
+                deferred.append(fbx_file)
+        announced = False
+        while deferred and self.is_running:
+            waiting = []
+            for fbx_file in deferred:
+                key = self.lease_key(fbx_file)
+                if self.leases.claim(key, {"file": fbx_file}):
+                    self.log("回收过期租约: {}".format(os.path.basename(fbx_file)))
+                    self.progress_total += 1
+                    yield fbx_file
+                elif self.leases.is_finished(key):
+                    self.lease_skipped_count += 1
+                else:
+                    waiting.append(fbx_file)
+            deferred = waiting
+            if deferred and not announced:
+                self.log("等待其他节点处理中的 {} 个文件（租约过期时回收）".format(len(deferred)))
+                announced = True
+            if deferred:
+                delay = min(LEASE_POLL_INTERVAL, self.leases.ttl / 3.0)
+                if wait:
+                    time.sleep(delay)
+                    continue
+                retry_time = monotonic() + delay
+                while monotonic() < retry_time and self.is_running:
+                    yield None
+    
+    def complete_lease(self, fbx_file, success, error=None):
+        """写入完成/失败标记并释放租约"""
+        try:
+            self.leases.complete(self.lease_key(fbx_file), success, {"file": fbx_file, "error": error})
+        except (IOError, OSError) as e:
+            self.log("写入完成标记失败: {}".format(str(e)), level="warning")
+    
+    def close_leases(self):
+        """停止心跳，释放未完成（被停止）的文件的租约"""
+        if self.leases:
+            self.leases.close()
+            self.leases = None
+    
+    def start_transfers(self):
+        """创建源文件预读和输出异步上传的后台线程（只用于当前进程内处理），本地副本放在中间文件目录下"""
+        self.prefetcher = None
+        self.uploader = None
+        self.upload_error_count = 0
+        if not (self.prefetch_depth or self.async_upload):
+            return
+        if self.uses_worker_pool():
+            self.log("多进程模式不使用源文件预读/异步上传（工作进程之间的读写已经互相重叠）", level="warning")
+            return
+        bandwidth = int(float(self.transfer_bandwidth or 0) * 1024 * 1024)
+        limit = "{} MB/s".format(self.transfer_bandwidth) if bandwidth else "不限速"
+        cache_dir = self.ensure_str(self.intermediate_dir)
+        if self.prefetch_depth:
+            self.prefetcher = SourcePrefetcher(os.path.join(cache_dir, "prefetch"), bandwidth)
+            self.log("源文件预读: 提前 {} 个文件，{}".format(self.prefetch_depth, limit))
+        if self.async_upload:
+            self.uploader = TransferQueue(bandwidth)
+            self.log("输出异步上传: 先保存到 {}，{}".format(os.path.join(cache_dir, "upload"), limit))
+    
+    def iter_prefetched(self, fbx_files):
+        """产出待处理文件，同时保证后面prefetch_depth个文件已经提交给后台预读"""
+        files = iter(fbx_files)
+        window = collections.deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(window) <= self.prefetch_depth:
+                fbx_file = next(files, None)
+                if fbx_file is None:
+                    exhausted = True
+                    break
+                self.prefetcher.request(fbx_file)
+                window.append(fbx_file)
+            if not window:
+                return
+            yield window.popleft()
+    
+    def fetch_source(self, fbx_file):
+        """要打开的源文件路径：已预读时为本地缓存中的副本（预读未完成时等待）"""
+        if self.prefetcher is None:
+            return fbx_file
+        with self.timed("prefetch_wait"):
+            return self.ensure_str(self.prefetcher.get(fbx_file))
+    
+    def upload_staging_file(self, save_file):
+        """异步上传时输出先保存到的本地路径"""
+        digest = hashlib.md5(to_bytes(os.path.abspath(save_file))).hexdigest()[:8]
+        return self.ensure_str(os.path.join(self.intermediate_dir, "upload",
+                                            "{}_{}".format(digest, os.path.basename(save_file))))
+    
+    def collect_uploads(self, timeout=0):
+        """处理已完成的后台上传：成功的写入清单，失败的计数（本地文件保留）"""
+        if self.uploader is None:
+            return
+        for local_file, save_file, (fbx_file, hik_file, takes), error in self.uploader.poll(timeout):
+            key = (fbx_file, hik_file)
+            if error:
+                self.upload_error_count += 1
+                self.upload_remaining.pop(key, None)  # 拆分Take时其他Take也不再写入清单
+                self.log("上传输出失败: {} - {}（本地文件: {}）".format(save_file, error, local_file), level="error")
+                continue
+            if takes:
+                if key not in self.upload_remaining:
+                    continue
+                self.upload_remaining[key] -= 1
+                if self.upload_remaining[key]:
+                    continue
+                del self.upload_remaining[key]
+            self.record_completed(fbx_file, hik_file, takes)
+    
+    def iter_finish_uploads(self):
+        """等待后台上传全部完成，等待期间持续yield"""
+        if self.uploader is None or not self.uploader.pending:
+            return
+        self.begin_stage("upload")
+        self.log("等待 {} 个输出上传到保存位置...".format(self.uploader.pending))
+        with self.timed("upload_wait"):
+            while self.uploader.pending:
+                self.collect_uploads(self.poll_interval)
+                yield "upload"
+    
+    def close_transfers(self):
+        """结束后台线程：放弃排队中的预读，已保存的输出全部上传完再返回"""
+        if self.prefetcher:
+            self.prefetcher.close()
+            self.prefetcher = None
+        if self.uploader:
+            self.uploader.close()
+            self.collect_uploads()
+            self.uploader = None
+    
+    def write_report(self):
+        """写出运行报告并在日志中输出各阶段耗时汇总"""
+        if not self.report.rows:
+            return
+        self.log("\n=== 阶段耗时 (秒) ===")
+        self.log("{:<16}{:>7}{:>10}{:>10}{:>10}{:>11}".format("阶段", "次数", "p50", "p95", "最大", "合计"))
+        summary = self.report.summary()
+        for stage in self.report.stage_names() + ["total"]:
+            item = summary[stage]
+            self.log("{:<16}{:>7}{:>10.3f}{:>10.3f}{:>10.3f}{:>11.2f}".format(
+                stage, item["count"], item["p50"], item["p95"], item["max"], item["sum"]))
+        for stage, elapsed in sorted(self.report.shared_stages.items()):
+            self.log("{:<16}{:>7}{:>41.2f}".format(stage, "共享", elapsed))
+        try:
+            json_path, csv_path = self.report.write(self.ensure_str(self.save_path),
+                                                    {"source_path": self.source_path, "hik_path": self.hik_path,
+                                                     "worker_count": self.worker_count, "node": self.node_id,
+                                                     "duplicates": self.duplicates, "totals": self.run_totals()},
+                                                    self.node_id if self.lease_dir else None)
+            self.log("运行报告: {}".format(json_path))
+            self.log("运行报告: {}".format(csv_path))
+        except (IOError, OSError) as e:
+            self.log("写入运行报告失败: {}".format(str(e)), level="warning")
+    
+    def run_totals(self):
+        """本次运行的文件计数（发现、成功、失败和各种原因跳过的文件）"""
+        return {
+            "discovered": self.discovered_count,
+            "success": self.success_count,
+            "failed": self.error_count,
+            "skipped": self.skipped_count,
+            "quarantine_skipped": self.quarantine_skipped_count,
+            "quarantined": self.quarantined_count,
+            "lease_skipped": self.lease_skipped_count,
+        }
+    
+    def write_history(self, message):
+        """把本次运行和每个文件的结果写入运行历史数据库，并输出耗时比上一次运行变慢的文件数量"""
+        self.history_run_id = None
+        if self.history_db is False:
+            return
+        if sqlite3 is None:
+            self.log("没有sqlite3模块，不写入运行历史", level="warning")
+            return
+        path = self.ensure_str(self.history_db or default_history_db())
+        try:
+            history = RunHistory(path)
+            try:
+                self.history_run_id = history.add_run({
+                    "start_time": self.report.start_time, "end_time": time.time(), "node": self.node_id,
+                    "source_path": self.source_path, "hik_path": self.hik_path, "save_path": self.save_path,
+                    "worker_count": self.worker_count, "options_hash": self.options_hash,
+                    "success": self.success_count, "failed": self.error_count, "skipped": self.skipped_count,
+                    "message": message}, self.report.rows)
+                processed = set(os.path.normcase(os.path.abspath(row["file"])) for row in self.report.rows)
+                regressions = [item for item in history.regressions(DEFAULT_REGRESSION_THRESHOLD, None)
+                               if item[0] in processed]
+            finally:
+                history.close()
+        except (sqlite3.Error, IOError, OSError) as e:
+            self.log("写入运行历史失败: {}".format(str(e)), level="warning")
+            return
+        self.log("运行历史: {}（run {}）".format(path, self.history_run_id))
+        if regressions:
+            self.log("耗时比上一次运行变慢超过 {:g}% 的文件: {}".format(DEFAULT_REGRESSION_THRESHOLD, len(regressions)),
+                     level="warning")
+            for path_, previous, current, change in regressions[:5]:
+                self.log("  {:+.0f}%  {:.2f}s -> {:.2f}s  {}".format(change, previous, current, path_))
+    
+    def report_progress(self):
+        """通过progress_callback报告(已完成, 总数, 预计剩余秒数)"""
+        done = self.success_count + self.error_count
+        eta = None
+        if done and self.scan_complete:
+            eta = (monotonic() - self.progress_start) / done * (self.progress_total - done)
+        if self.progress_callback:
+            self.progress_callback(done, self.progress_total, eta)
+    
+    def iter_serial(self, fbx_files):
+        """在当前MotionBuilder进程中逐个处理文件（分阶段），fbx_files可以是扫描中的生成器"""
+        for i, fbx_file in enumerate(fbx_files):
+            if not self.is_running:
+                break
+            
+            self.begin_file(fbx_file, i + 1)
+            self.log("\n--- 处理文件 {} ---".format(self.file_position(i + 1)))
+            self.log("文件: {}".format(fbx_file))
+            
+            # 处理单个文件
+            for stage in self.iter_process_single_file(fbx_file, self.targets_for(fbx_file)):
+                yield stage
+            if self.file_result is None:
+                # 在阶段之间被停止，不计入成功或失败（已保存的目标仍记入清单）
+                self.record_targets(fbx_file, self.file_records.pop(fbx_file, None))
+                self.current_record = None
+                continue
+            if self.file_result:
+                self.log("文件处理成功")
+            else:
+                self.log("文件处理失败", level="error")
+            self.file_done(fbx_file, self.file_result, self.file_error)
+        if not self.is_running:
+            self.log("批处理被中止")
+    
+    def iter_resident(self, fbx_files):
+        """常驻目标场景模式（分阶段）
+
+        源文件必须用FileOpen打开，会替换掉目标场景，所以按批处理：先把一批源文件的角色动画
+        全部导出，再加载一次HIK目标，逐个加载动画、保存、只清空Take动画。
+        扇出模式下每个目标各加载一次，本批动画依次应用到每个目标上。
+        每次加载前检查场景指纹，发现漂移则重新加载目标场景。
+        """
+        chunk_size = max(1, int(self.resident_chunk_size))
+        self.log("=== 常驻目标场景模式，每批{}个文件 ===".format(chunk_size))
+        
+        files = enumerate(fbx_files)
+        while self.is_running:
+            chunk = list(itertools.islice(files, chunk_size))
+            if not chunk:
+                break
+            
+            # 第一阶段：导出本批源文件的角色动画
+            prepared = []
+            for i, fbx_file in chunk:
+                if not self.is_running:
+                    break
+                fbx_file = self.ensure_str(fbx_file)
+                self.begin_file(fbx_file, i + 1)
+                self.log("\n--- 导出源动画 {} ---".format(self.file_position(i + 1)))
+                self.log("文件: {}".format(fbx_file))
+                for stage in self.iter_prepare_source_animation(fbx_file):
+                    yield stage
+                self.current_record = None
+                if self.prepared_anim_file:
+                    prepared.append((i, fbx_file, self.prepared_anim_file))
+                elif self.is_running:
+                    self.log("文件处理失败", level="error")
+                    self.file_done(fbx_file, False, self.file_error)
+            
+            # 第二阶段：每个目标场景只加载一次，逐个应用动画并保存
+            failed = {}  # 源文件 -> 错误信息
+            last_targets = {}  # 源文件 -> 最后一个目标（加载到该目标后删除中间动画文件）
+            for hik_file in self.target_files:
+                for _, fbx_file, _ in prepared:
+                    if hik_file in self.targets_for(fbx_file):
+                        last_targets[fbx_file] = self.ensure_str(hik_file)
+            for hik_file in self.target_files:
+                targets = [item for item in prepared if hik_file in self.targets_for(item[1])]
+                if not targets or not self.is_running:
+                    continue
+                hik_file = self.ensure_str(hik_file)
+                loaded = self.ensure_resident_target(hik_file)
+                yield "load_target"
+                for i, fbx_file, anim_file in targets:
+                    if not self.is_running:
+                        break
+                    self.begin_file(fbx_file, i + 1)
+                    if not loaded:
+                        failed[fbx_file] = "HIK目标加载失败"
+                        continue
+                    self.log("\n--- 处理文件 {} ---".format(self.file_position(i + 1)))
+                    self.log("文件: {}".format(fbx_file))
+                    if self.fan_out:
+                        self.log("目标: {}".format(self.target_name(hik_file)))
+                    try:
+                        result = self.apply_on_resident_target(fbx_file, anim_file, hik_file,
+                                                               discard=last_targets.get(fbx_file) == hik_file)
+                    except Exception as e:
+                        self.log("处理文件异常: {}".format(str(e)), level="error")
+                        result = False
+                    if not result:
+                        failed.setdefault(fbx_file, None)
+                    self.current_record = None
+                    yield "save_result"
+            
+            for i, fbx_file, anim_file in prepared:
+                # 正常情况下已在加载到最后一个目标后删除，这里兜底（失败或被停止）
+                self.discard_intermediate(anim_file)
+                self.begin_file(fbx_file, i + 1)
+                if not self.is_running and fbx_file not in failed:
+                    # 被停止：不计入成功或失败（已保存的目标仍记入清单）
+                    self.record_targets(fbx_file, self.file_records.pop(fbx_file, None))
+                    self.current_record = None
+                    continue
+                if fbx_file in failed:
+                    self.log("文件处理失败: {}".format(fbx_file), level="error")
+                    self.file_done(fbx_file, False, failed[fbx_file])
+                else:
+                    self.log("文件处理成功: {}".format(fbx_file))
+                    self.file_done(fbx_file, True)
+        
+        if not self.is_running:
+            self.log("批处理被中止")
+    
+    def load_resident_target(self, hik_file):
+        """加载常驻目标场景并记录指纹和基础Take"""
+        self.log("  -> 加载常驻HIK目标场景...")
+        if not self.load_target_scene(hik_file):
+            self.resident_fingerprint = None
+            return False
+        self.resident_take_name = FBSystem().CurrentTake.Name
+        self.resident_fingerprint = self.scene_fingerprint()
+        self.resident_hik_file = hik_file
+        self.log("  -> 常驻目标场景指纹: {} 个组件, {}".format(*self.resident_fingerprint))
+        return True
+    
+    def ensure_resident_target(self, hik_file):
+        """当前场景已是该HIK目标的常驻场景（之后没有FileOpen/FileNew）时直接复用，否则重新加载"""
+        if self.resident_hik_file == hik_file and self.resident_fingerprint is not None:
+            self.log("  -> 复用常驻HIK目标场景")
+            return True
+        return self.load_resident_target(hik_file)
+    
+    def apply_on_resident_target(self, fbx_file, anim_file, hik_file, discard=False):
+        """在常驻目标场景上加载一个动画并保存，然后清空Take动画
+
+        discard为True（最后一个目标）时加载之后立即删除中间动画文件，否则由调用方删除。
+        """
+        with self.timed("fingerprint"):
+            fingerprint = self.scene_fingerprint()
+        if fingerprint != self.resident_fingerprint:
+            self.log("  -> 常驻目标场景发生漂移，重新加载HIK目标")
+            if not self.load_resident_target(hik_file):
+                return False
+        loaded = self.load_animation_on_target(anim_file)
+        if discard:
+            self.discard_intermediate(anim_file)
+        if not loaded:
+            with self.timed("reset_takes"):
+                self.reset_resident_takes()
+            return False
+        if self.post_processes_keys():
+            self.post_process_keys()
+        result = self.save_result_scene(fbx_file, hik_file)
+        with self.timed("reset_takes"):
+            self.reset_resident_takes()
+        return result
+    
+    def scene_fingerprint(self):
+        """场景指纹：组件数量和组件类型/名称的校验和（不含Take，Take会被重置）"""
+        names = []
+        for comp in FBSystem().Scene.Components:
+            class_name = comp.ClassName()
+            if class_name == 'FBTake':
+                continue
+            names.append("{}:{}".format(class_name, getattr(comp, 'LongName', comp.Name)))
+        names.sort()
+        digest = hashlib.md5(to_bytes("\n".join(names))).hexdigest()
+        return len(names), digest
+    
+    def reset_resident_takes(self):
+        """删除加载动画时产生的Take，只保留清空后的基础Take"""
+        system = FBSystem()
+        takes = list(system.Scene.Takes)
+        base_index = None
+        for index, take in enumerate(takes):
+            if take.Name == self.resident_take_name:
+                base_index = index
+                break
+        if base_index is None:
+            base_take = FBTake(self.resident_take_name or "Take 001")
+        else:
+            base_take = takes[base_index]
+        system.CurrentTake = base_take
+        for index, take in enumerate(takes):
+            if index != base_index:
+                take.FBDelete()
+        try:
+            base_take.ClearAllProperties(False)
+        except AttributeError:
+            # 旧版本没有ClearAllProperties：换成一个全新的空Take
+            fresh_take = FBTake(base_take.Name)
+            system.CurrentTake = fresh_take
+            base_take.FBDelete()
+    
+    def iter_pool(self, fbx_files):
+        """把文件分发给多个无界面工作进程处理，边扫描边派发，轮询结果期间持续yield"""
+        script_path = os.path.abspath(globals().get("__file__", ""))
+        if not os.path.isfile(script_path):
+            self.log("错误：无法定位脚本文件，不能启动工作进程", level="error")
+            for fbx_file in fbx_files:
+                self.file_done(fbx_file, False)
+            return
+        
+        self.begin_stage("worker")
+        worker_command = self.worker_command or default_worker_command()
+        self.log("=== 多进程模式: {}个工作进程 ===".format(self.worker_count))
+        self.log("工作进程命令: {}".format(" ".join(worker_command)))
+        
+        recycle_policy = self.recycle_policy()
+        if recycle_policy:
+            self.log("工作进程回收: 每 {} 个文件，常驻内存上限 {} MB，耗时漂移上限 {} 倍（0为不限）".format(
+                self.recycle_after, self.max_worker_rss_mb, self.max_slowdown))
+        if self.stage_timeouts:
+            self.log("阶段超时: {}，卡死或崩溃的文件最多重试 {} 次".format(
+                ", ".join("{}={}s".format(stage, timeout) for stage, timeout in sorted(self.stage_timeouts.items())),
+                self.max_retries))
+        pool = WorkerPool(self.worker_count, worker_command, script_path, self.get_worker_config(), recycle_policy,
+                          self.stage_timeouts, self.max_retries, self.retry_backoff)
+        pool.start([], closed=False)
+        files = iter(fbx_files)
+        index = 0
+        # 边扫描边派发时每个工作进程预留两个排队任务；已调度的列表一次全部派发
+        backlog = self.worker_count * 2 if self.schedule_mode() == "stream" else float("inf")
+        if self.leases:
+            # 文件在产出时领取租约：只为空闲的工作进程领取，其余文件留给其他节点
+            backlog = self.worker_count
         try:
-            self.log("=== 批处理开始 ===")
-            self.log("线程初始化完成，开始处理...")
-            self.log("源路径: {}".format(self.source_path))
-            self.log("HIK路径: {}".format(self.hik_path))
-            self.log("保存路径: {}".format(self.save_path))
-            self.log("角色: {}".format(self.current_character))
-            
-            self.log("=== 开始批处理 ===")
-            
-            # 获取所有FBX文件
-            fbx_files = self.get_fbx_files(self.source_path)
-            self.log("扫描源目录: {}".format(self.source_path))
-            self.log("找到FBX文件数量: {}".format(len(fbx_files)))
-            
-            # 立即发送找到的文件列表
-            if fbx_files:
-                self.log("找到的FBX文件:")
-                for i, fbx_file in enumerate(fbx_files):
-                    if i < 5:  # 只显示前5个文件
-                        self.log("  - {}".format(os.path.basename(fbx_file)))
-                    elif i == 5:
-                        self.log("  - ... (还有{}个文件)".format(len(fbx_files) - 5))
+            while not pool.is_done():
+                if not self.is_running and not pool.stopped:
+                    self.log("批处理被中止，等待工作进程完成当前文件...")
+                    pool.stop()
+                while not pool.closed and pool.pending < backlog:
+                    fbx_file = next(files, StopIteration)
+                    if fbx_file is StopIteration:
+                        pool.close()
                         break
-            
-            if not fbx_files:
-                self.log("错误：在指定目录中没有找到FBX文件")
-                return False, "在指定目录中没有找到FBX文件"
-            
-            # 获取HIK文件列表
-            hik_files = []
-            for root, dirs, files in os.walk(self.hik_path):
-                for file in files:
-                    if file.lower().endswith('.fbx'):
-                        hik_files.append(os.path.join(root, file))
-            
-            self.log("扫描HIK目录: {}".format(self.hik_path))
-            self.log("找到HIK文件数量: {}".format(len(hik_files)))
-            
-            # 验证HIK文件
-            valid_hik_files = self.validate_hik_files(hik_files)
-            self.log("有效HIK文件数量: {}".format(len(valid_hik_files)))
-            
-            if not valid_hik_files:
-                return False, "没有找到有效的HIK FBX文件"
-            
-            # 开始批处理
-            total_files = len(fbx_files)
-            success_count = 0
-            error_count = 0
-            
-            for i, fbx_file in enumerate(fbx_files):
-                if not self.is_running:
-                    self.log("批处理被中止")
-                    break
-                    
-                try:
-                    self.log("\n--- 处理文件 {}/{} ---".format(i+1, total_files))
-                    self.log("文件: {}".format(fbx_file))
-                    
-                    # 处理单个文件
-                    result = self.process_single_file(fbx_file, valid_hik_files[0])
-                    if result:
-                        success_count += 1
-                        self.log("文件处理成功")
+                    if fbx_file is None:
+                        # 等待其他节点的租约，先处理本节点的结果
+                        break
+                    pool.add({"index": index, "fbx_file": self.ensure_str(fbx_file),
+                              "hik_files": [self.ensure_str(path) for path in self.targets_for(fbx_file)],
+                              "slot": self.job_slots.get(fbx_file)})
+                    index += 1
+                for kind, payload in pool.poll(self.poll_interval):
+                    if kind == "log":
+                        self.current_file_index = None if payload["index"] is None else payload["index"] + 1
+                        self.log(payload["message"])
+                        continue
+                    self.current_file_index = payload["index"] + 1
+                    position = self.file_position(payload["index"] + 1)
+                    name = os.path.basename(payload["fbx_file"])
+                    if payload["success"]:
+                        self.log("文件处理成功 ({}): {}".format(position, name))
                     else:
-                        error_count += 1
-                        self.log("文件处理失败")
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_msg = "错误: 处理文件 {} 时出错 - {}".format(os.path.basename(fbx_file), str(e))
-                    self.log("处理文件异常: {}".format(str(e)))
-                    import traceback
-                    # 获取完整的异常信息
-                    exc_info = traceback.format_exc()
-                    self.log("异常详情: {}".format(exc_info))
-                    continue
-            
-            final_msg = "批处理完成！成功: {}, 失败: {}".format(success_count, error_count)
-            self.log("\n=== 批处理结束 ===")
-            self.log(final_msg)
-            return True, final_msg
-            
-        except Exception as e:
-            error_msg = "批处理过程中出错: {}".format(str(e))
-            self.log("批处理主线程异常: {}".format(str(e)))
-            import traceback
-            # 获取完整的异常信息
-            exc_info = traceback.format_exc()
-            self.log("主线程异常详情: {}".format(exc_info))
-            return False, error_msg
+                        self.log("文件处理失败 ({}): {} - {}".format(position, name, payload.get("error")),
+                                 level="error")
+                    if payload.get("quarantined"):
+                        self.quarantine_file(payload["fbx_file"], payload.get("error"), payload.get("attempts"))
+                    self.file_done(payload["fbx_file"], payload["success"], payload.get("error"),
+                                   payload.get("record"))
+                yield "pool"
+        finally:
+            pool.shutdown()
+            if pool.recycled_count:
+                self.log("工作进程共重启 {} 次".format(pool.recycled_count))
+            if pool.timeout_count:
+                self.log("阶段超时 {} 次".format(pool.timeout_count), level="warning")
+    
+    @classmethod
+    def from_job(cls, job, log_callback):
+        """根据任务描述（JSON字典）创建批处理器
+
+        任务格式: {"source_path": ..., "hik_path": ..., "save_path": ..., "character": ...,
+                  "options": {构造参数名: 值}}
+        """
+        init = getattr(cls.__init__, "__func__", cls.__init__)
+        allowed = init.__code__.co_varnames[:init.__code__.co_argcount]
+        options = dict(job.get("options") or {})
+        unknown = [name for name in options
+                   if name not in allowed or name in ("self", "log_callback") or name in cls.JOB_PATH_ARGS]
+        if unknown:
+            raise ValueError("未知的任务选项: {}".format(", ".join(sorted(unknown))))
+        return cls(job.get("source_path"), job.get("hik_path"), job.get("save_path"),
+                   job.get("character"), log_callback, **options)
+    
+    def option_signature(self):
+        """影响输出结果的Plot/FBX选项集合"""
+        signature = {
+            "character": self.current_character,
+            "source_plot": SOURCE_PLOT_OPTIONS,
+            "load_method": TARGET_LOAD_METHOD,
+            "load_process_animation_on_extension": False,
+        }
+        if self.save_profile:
+            signature["save_profile"] = self.save_profiles.get(self.save_profile)
+        if self.multi_take() or self.split_takes:
+            signature["takes"] = {"mode": self.takes, "filter": self.take_filter, "split": self.split_takes}
+        return signature
+    
+    def multi_take(self):
+        """是否处理多个Take（所有Take或按名称过滤）"""
+        return self.takes == "all" or bool(self.take_filter)
+    
+    def take_selected(self, name):
+        """Take名称是否要处理"""
+        if self.take_filter:
+            return match_patterns(name, name, self.take_filter)
+        return True
+    
+    def selected_takes(self):
+        """当前场景中要处理的Take"""
+        system = FBSystem()
+        if not self.multi_take():
+            return [system.CurrentTake]
+        return [take for take in system.Scene.Takes if self.take_selected(take.Name)]
+    
+    def select_takes(self, fbx_options, names=None):
+        """在FBFbxOptions中只选中要处理的Take（names为Take名称列表，None时按take_filter），返回选中的名称"""
+        selected = []
+        for index in range(fbx_options.GetTakeCount()):
+            name = fbx_options.GetTakeName(index)
+            on = name in names if names is not None else self.take_selected(name)
+            fbx_options.SetTakeSelect(index, on)
+            if on:
+                selected.append(name)
+        return selected
+    
+    def record_take_time(self, take_name, stage, elapsed):
+        """记录一个Take在某个阶段的耗时"""
+        if self.current_record is None:
+            return
+        times = self.current_record.setdefault("take_times", {}).setdefault(take_name, {})
+        times[stage] = times.get(stage, 0.0) + elapsed
+    
+    def begin_resume(self, hik_files):
+        """记录本次的HIK目标，计算目标和选项校验和，读取清单（断点续跑）"""
+        self.target_files = list(hik_files)
+        self.target_hashes = dict((hik_file, file_md5(hik_file)) for hik_file in self.target_files)
+        self.options_hash = hashlib.md5(to_bytes(json.dumps(self.option_signature(), sort_keys=True))).hexdigest()
+        self.source_targets = {}
+        self.quarantined_count = 0
+        if not self.resume:
+            self.manifest = None
+            self.quarantine = None
+            return
+        self.quarantine = QuarantineList(os.path.join(self.save_path, QUARANTINE_NAME))
+        self.manifest = BatchManifest(os.path.join(self.save_path, MANIFEST_NAME), shared=bool(self.lease_dir))
+    
+    def close_manifest(self):
+        """运行结束时把清单日志合并进清单文件"""
+        if self.manifest is None:
+            return
+        try:
+            self.manifest.close()
+        except (IOError, OSError) as e:
+            self.log("合并清单失败（下次运行时重试）: {}".format(str(e)), level="warning")
+    
+    def quarantine_file(self, fbx_file, error, attempts):
+        """把反复卡死/崩溃的文件加入隔离清单，之后的运行跳过它"""
+        self.quarantined_count += 1
+        self.log("加入隔离清单（已尝试 {} 次）: {}".format(attempts, fbx_file), level="error")
+        if self.quarantine is None:
+            return
+        try:
+            self.quarantine.add(fbx_file, error, attempts)
+        except (IOError, OSError) as e:
+            self.log("更新隔离清单失败: {}".format(str(e)), level="warning")
+    
+    def manifest_variant(self, hik_file):
+        """清单键的目标部分：扇出模式下每个目标单独记录"""
+        return self.target_name(hik_file) if self.fan_out else None
+    
+    def pending_targets(self, fbx_file):
+        """源文件尚未完成（清单中没有有效输出）的HIK目标"""
+        if self.manifest is None:
+            return list(self.target_files)
+        return [hik_file for hik_file in self.target_files
+                if not self.manifest.is_up_to_date(fbx_file, self.target_hashes[hik_file], self.options_hash,
+                                                   self.output_file_for(fbx_file, hik_file),
+                                                   self.manifest_variant(hik_file))]
+    
+    def targets_for(self, fbx_file):
+        """源文件本次需要处理的HIK目标"""
+        return self.source_targets.get(fbx_file, self.target_files)
+    
+    def iter_source_files(self):
+        """边扫描源目录边产出待处理文件，跳过已完成的文件，并随扫描更新进度总数"""
+        self.discovered_count = 0
+        self.skipped_count = 0
+        self.quarantine_skipped_count = 0
+        self.progress_total = 0
+        self.scan_complete = False
+        for fbx_file in self.catalog.iter_files(self.source_path):
+            self.discovered_count += 1
+            if self.discovered_count <= 5:  # 只显示前5个文件
+                self.log("  发现: {}".format(os.path.basename(fbx_file)))
+            if self.quarantine is not None and self.quarantine.contains(fbx_file):
+                self.quarantine_skipped_count += 1
+                continue
+            targets = self.pending_targets(fbx_file)
+            if not targets:
+                self.skipped_count += 1
+                continue
+            if len(targets) < len(self.target_files):
+                self.source_targets[fbx_file] = targets
+            self.progress_total += 1
+            yield fbx_file
+            if not self.is_running:
+                return
+        self.scan_complete = True
+        self.log("源目录扫描完成，找到FBX文件数量: {}".format(self.discovered_count))
+        if self.skipped_count:
+            self.log("断点续跑：清单中已完成 {} 个文件，剩余 {} 个".format(
+                self.skipped_count, self.discovered_count - self.skipped_count - self.quarantine_skipped_count))
+        if self.quarantine_skipped_count:
+            self.log("跳过隔离清单中的 {} 个文件（{}）".format(
+                self.quarantine_skipped_count, os.path.join(self.save_path, QUARANTINE_NAME)), level="warning")
+        self.report_progress()
+    
+    def dedupe_files(self, fbx_files):
+        """找出内容相同的源文件，每组只保留第一个文件处理，其余文件在它成功保存后共用输出"""
+        self.begin_stage("dedupe")
+        with self.timed("dedupe"):
+            groups = find_duplicate_files(fbx_files, self.dedupe_threads)
+        self.duplicates = dict((group[0], group[1:]) for group in groups)
+        self.duplicate_output_count = 0
+        duplicate_files = set(path for group in groups for path in group[1:])
+        if duplicate_files:
+            self.progress_total -= len(duplicate_files)
+            self.log("重复源文件: {} 组，{} 个文件将共用输出".format(len(groups), len(duplicate_files)))
+            for group in groups[:5]:
+                self.log("  {} <= {}".format(os.path.basename(group[0]),
+                                             ", ".join(os.path.basename(path) for path in group[1:])))
+        return [fbx_file for fbx_file in fbx_files if fbx_file not in duplicate_files]
+    
+    def copy_duplicate_output(self, fbx_file, duplicate, hik_file, takes=None):
+        """把源文件的输出（拆分Take时为每个Take的输出）硬链接（不支持时复制）为重复源文件的输出，并记入清单"""
+        for take in takes or [None]:
+            if not self.link_output(self.output_file_for(fbx_file, hik_file, take),
+                                    self.output_file_for(duplicate, hik_file, take)):
+                return
+        self.duplicate_output_count += 1
+        self.record_completed(duplicate, hik_file, takes)
+    
+    def link_output(self, source_output, output):
+        """硬链接（不支持时复制）一个输出文件，先写.partial再原子重命名"""
+        if os.path.normcase(output) != os.path.normcase(source_output):
+            try:
+                link_or_copy(source_output, output, self.dedupe_link)
+            except (IOError, OSError) as e:
+                self.log("分发重复文件的输出失败: {} - {}".format(output, str(e)), level="error")
+                return False
+        return True
+    
+    def schedule_mode(self):
+        if self.schedule:
+            return self.schedule
+        return "longest" if self.worker_count and self.worker_count > 1 else "stream"
+    
+    def iter_schedule_files(self, fbx_files):
+        """估计每个文件的耗时（大小、帧数、历史耗时），按调度方式排序并输出预计总耗时（分阶段）
+
+        fbx_files可以是扫描中的生成器，每估计SCHEDULE_STEP_FILES个文件yield一次。
+        开启预检时读取文件头得到帧数（单进程处理时复用预检结果），否则只按文件大小和历史耗时估计。
+        结果保存在self.scheduled_files。
+        """
+        self.begin_stage("schedule")
+        mode = self.schedule_mode()
+        workers = self.worker_count if self.worker_count and self.worker_count > 1 else 1
+        history_count = self.cost_model.load_reports(self.ensure_str(self.save_path))
+        costs = []
+        for fbx_file in fbx_files:
+            if self.preflight:
+                error, info = preflight_fbx(fbx_file, require_takes=True)
+                if workers == 1:
+                    # 在本进程处理时复用预检结果（工作进程会自己预检）
+                    self.fbx_info[fbx_file] = (error, info)
+                size, frames = (info["size"] if info else None), fbx_frame_count(info)
+            else:
+                try:
+                    size, frames = os.path.getsize(fbx_file), None
+                except OSError:
+                    size, frames = None, None
+            costs.append((fbx_file, self.cost_model.estimate(fbx_file, size, frames)))
+            if len(costs) % SCHEDULE_STEP_FILES == 0:
+                yield "schedule"
+        assignment, makespan = schedule_jobs(costs, workers, mode)
+        self.job_slots = dict((fbx_file, slot) for fbx_file, slot in assignment if slot is not None)
+        self.predicted_makespan = makespan
+        
+        self.log("\n=== 调度 ({}) ===".format(mode))
+        self.log("历史耗时记录: {} 个文件{}".format(
+            history_count, "，已拟合耗时模型" if self.cost_model.fitted else "，使用默认耗时模型"))
+        if costs:
+            longest_file, longest_cost = max(costs, key=lambda item: item[1])
+            self.log("估计串行合计: {}，最长文件: {} ({})".format(
+                format_duration(sum(cost for _, cost in costs)), os.path.basename(longest_file),
+                format_duration(longest_cost)))
+        self.log("预计总耗时: {}（{} 个工作进程）".format(format_duration(makespan), workers))
+        self.scheduled_files = [fbx_file for fbx_file, slot in assignment]
+        yield "schedule"
+    
+    def file_position(self, index):
+        """日志中的文件序号：扫描未结束时总数后加“+”"""
+        return "{}/{}{}".format(index, self.progress_total, "" if self.scan_complete else "+")
+    
+    def record_targets(self, fbx_file, record):
+        """把文件记录中已成功保存的目标写入清单"""
+        self.source_targets.pop(fbx_file, None)
+        if record is None:
+            return
+        for hik_file in record.get("targets", ()):
+            self.record_completed(fbx_file, hik_file, record.get("split_outputs", {}).get(hik_file))
+    
+    def record_completed(self, fbx_file, hik_file, takes=None):
+        """成功保存后把输出分发给内容相同的源文件，并更新清单（takes为拆分保存的Take名称）"""
+        for duplicate in self.duplicates.get(fbx_file, ()):
+            self.copy_duplicate_output(fbx_file, duplicate, hik_file, takes)
+        if self.manifest is None:
+            return
+        outputs = [self.output_file_for(fbx_file, hik_file, take) for take in takes] if takes else None
+        try:
+            self.manifest.record(fbx_file, self.target_hashes[hik_file], self.options_hash,
+                                 self.output_file_for(fbx_file, hik_file), self.manifest_variant(hik_file), outputs)
+        except (IOError, OSError, KeyError) as e:
+            self.log("更新清单失败: {}".format(str(e)), level="warning")
+    
+    def target_name(self, hik_file):
+        """HIK目标名（文件名，不含扩展名）"""
+        return os.path.splitext(os.path.basename(hik_file))[0]
+    
+    def output_file_for(self, fbx_file, hik_file=None, take=None):
+        """源文件对应的最终输出路径，扇出模式下放在以目标名命名的子目录中，拆分Take时文件名加上Take名"""
+        base_name = os.path.splitext(os.path.basename(fbx_file))[0]
+        if take:
+            base_name += "_" + "".join(c if c.isalnum() or c in "-_." else "_" for c in take)
+        if self.fan_out and hik_file:
+            return self.ensure_str(os.path.join(self.save_path, self.target_name(hik_file), "{}.fbx".format(base_name)))
+        return self.ensure_str(os.path.join(self.save_path, "{}.fbx".format(base_name)))
+    
+    def recycle_policy(self):
+        """工作进程回收阈值（WorkerHealth参数），都没有设置时为None"""
+        if not (self.recycle_after or self.max_worker_rss_mb or self.max_slowdown):
+            return None
+        return {"recycle_after": self.recycle_after, "max_rss_mb": self.max_worker_rss_mb,
+                "max_slowdown": self.max_slowdown}
+    
+    def uses_worker_pool(self):
+        """是否交给无界面工作进程处理：多个工作进程，或者设置了回收阈值/阶段超时（当前进程不能重启或结束自己，单个工作进程也走工作池）"""
+        if self.worker_count and self.worker_count > 1:
+            return True
+        return self.worker_count == 1 and (self.recycle_policy() is not None or bool(self.stage_timeouts))
+    
+    def get_worker_config(self):
+        """传给工作进程的配置（JSON可序列化）"""
+        return {
+            "source_path": self.ensure_str(self.source_path),
+            "hik_path": self.ensure_str(self.hik_path),
+            "save_path": self.ensure_str(self.save_path),
+            "current_character": self.current_character,
+            "fbsdk_module": self.fbsdk_module,
+            "intermediate_dir": self.ensure_str(self.intermediate_dir),
+            "keep_intermediates": self.keep_intermediates,
+            "fan_out": self.fan_out,
+            "preflight": self.preflight,
+            "takes": self.takes,
+            "take_filter": self.take_filter,
+            "split_takes": self.split_takes,
+            "animation_cache_dir": self.animation_cache_dir,
+            "animation_cache_mb": self.animation_cache_mb,
+            "key_reduction": self.key_reduction,
+            "resample_fps": self.resample_fps,
+            "save_profile": self.save_profile,
+            "save_profiles": self.save_profiles,
+            "benchmark_save_profiles": self.benchmark_save_profiles,
+        }
     
     def get_fbx_files(self, directory):
-        """获取目录下的所有FBX文件"""
-        fbx_files = []
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith('.fbx'):
-                    fbx_files.append(os.path.join(root, file))
-        return fbx_files
+        """获取目录下的所有FBX文件（使用扫描缓存）"""
+        return self.catalog.files(directory)
     
     def validate_hik_files(self, hik_files):
-        """验证HIK文件列表，只返回有效的FBX文件"""
+        """验证HIK文件列表，只返回有效的FBX文件（预检文件结构和角色定义）"""
         valid_files = []
         for hik_file in hik_files:
             try:
                 if (os.path.exists(hik_file) and os.path.isfile(hik_file) and 
                     os.path.getsize(hik_file) > 0 and hik_file.lower().endswith('.fbx')):
+                    if self.preflight:
+                        error, info = preflight_fbx(hik_file)
+                        if error:
+                            self.log("HIK文件预检失败: {} - {}".format(os.path.basename(hik_file), error),
+                                     level="warning")
+                            continue
                     valid_files.append(hik_file)
-            except:
-                pass
+            except (IOError, OSError) as e:
+                self.log("无法读取HIK文件: {} - {}".format(os.path.basename(hik_file), str(e)), level="warning")
         return valid_files
     
-    def process_single_file(self, fbx_file, hik_file):
-        """处理单个FBX文件"""
+    def process_single_file(self, fbx_file, hik_files):
+        """处理单个FBX文件（一次执行完所有阶段）"""
+        for _ in self.iter_process_single_file(fbx_file, hik_files):
+            pass
+        return bool(self.file_result)
+    
+    def stopped_between_stages(self):
+        """两个阶段之间检查是否已停止，已停止时把当前文件标记为未完成"""
+        if self.is_running:
+            return False
+        self.file_result = None
+        self.log("  -> 已停止，当前文件未完成")
+        return True
+    
+    def iter_process_single_file(self, fbx_file, hik_files):
+        """分阶段处理单个FBX文件的生成器，每完成一个阶段yield阶段名
+
+        hik_files可以是一个HIK目标或目标列表（扇出）：源文件只打开、Plot、导出一次，
+        动画依次加载到每个目标上分别保存。中间动画文件加载到最后一个目标之后立即删除，
+        失败或被停止时在finally中删除。
+        结果保存在self.file_result：True全部目标成功，False有目标失败，None表示在阶段之间被停止。
+        """
+        self.file_result = False
+        self.file_error = None
+        anim_file = None
         try:
             # 确保文件路径是str类型，不是unicode
             fbx_file = self.ensure_str(fbx_file)
-            hik_file = self.ensure_str(hik_file)
+            if isinstance(hik_files, (str, unicode)):
+                hik_files = [hik_files]
             
-            self.log("  -> 打开源FBX文件...")
-            # 打开源FBX文件
-            if not FBApplication().FileOpen(fbx_file):
-                self.log("  -> 打开源FBX文件失败")
-                return False
+            for stage in self.iter_prepare_source_animation(fbx_file):
+                yield stage
+            anim_file = self.prepared_anim_file
+            if self.stopped_between_stages() or not anim_file:
+                return
+            
+            all_saved = True
+            for position, hik_file in enumerate(hik_files):
+                hik_file = self.ensure_str(hik_file)
+                if len(hik_files) > 1:
+                    self.log("  -> 目标: {}".format(self.target_name(hik_file)))
+                if not self.load_target_scene(hik_file):
+                    all_saved = False
+                    continue
+                yield "load_target"
+                if self.stopped_between_stages():
+                    return
+                
+                loaded = self.load_animation_on_target(anim_file)
+                if position == len(hik_files) - 1:
+                    # 已加载到最后一个目标，保存之前就删除中间动画文件
+                    self.discard_intermediate(anim_file)
+                if not loaded:
+                    all_saved = False
+                    continue
+                yield "load_animation"
+                if self.post_processes_keys():
+                    self.post_process_keys()
+                    yield "reduce_keys"
+                if self.stopped_between_stages():
+                    return
+                
+                if not self.save_result_scene(fbx_file, hik_file):
+                    all_saved = False
+                yield "save_result"
+                if self.stopped_between_stages():
+                    return
+            self.file_result = all_saved
+            
+        except Exception as e:
+            self.file_result = False
+            self.log("  -> process_single_file异常: {}".format(str(e)), level="error")
+            import traceback
+            # 获取完整的异常信息
+            exc_info = traceback.format_exc()
+            self.log("process_single_file异常详情: {}".format(exc_info), level="error")
+        finally:
+            if anim_file:
+                self.discard_intermediate(anim_file)
+    
+    def iter_prepare_source_animation(self, fbx_file):
+        """打开源文件、Plot到Control Rig并保存角色动画（分阶段）
+
+        动画文件路径保存在self.prepared_anim_file，失败或被停止时为None。
+        """
+        self.prepared_anim_file = None
+        self.file_error = None
+        try:
+            self.begin_stage("open_source")
+            open_file = self.fetch_source(fbx_file)
+            try:
+                if self.preflight and not self.preflight_source(fbx_file, open_file):
+                    return
+                cache_key = self.animation_cache_key(open_file)
+                if cache_key:
+                    anim_file = self.cached_animation(fbx_file, cache_key)
+                    if anim_file:
+                        self.prepared_anim_file = anim_file
+                        yield "save_animation"
+                        return
+                self.log("  -> 打开源FBX文件...")
+                # 打开源FBX文件（已预读时打开本地副本），会替换掉常驻目标场景
+                self.resident_hik_file = None
+                with self.timed("file_open"):
+                    opened = FBApplication().FileOpen(open_file)
+            finally:
+                if self.prefetcher:
+                    self.prefetcher.release(fbx_file)
+            self.character_resolver.invalidate()
+            if not opened:
+                self.log("  -> 打开源FBX文件失败", level="error")
+                return
             self.log("  -> 源FBX文件打开成功")
- 
+            yield "open_source"
+            if not self.is_running:
+                return
+            
             # 打开后先将动画Plot到Control Rig
-            try:
-                self.log("  -> 准备将动画Plot到Control Rig...")
-                character = FBApplication().CurrentCharacter
-                if not character:
-                    # 备用：从场景中查找第一个FBCharacter
-                    self.log("    --> 当前未设置CurrentCharacter，尝试从场景中查找角色...")
-                    for comp in FBSystem().Scene.Components:
-                        if comp.ClassName() == 'FBCharacter':
-                            character = comp
-                            break
-                if not character:
-                    self.log("    --> 未找到角色，无法Plot到Control Rig")
-                else:
-                    self.log("    --> 使用角色: {}".format(character.Name))
-                    # 确保角色已Characterize
-                    if not character.GetCharacterize():
-                        self.log("    --> 角色未Characterize，执行Characterize...")
-                        character.SetCharacterizeOn(True)
-                    # 确保存在Control Rig
-                    if not getattr(character, 'ControlRig', None):
-                        self.log("    --> 未检测到Control Rig，自动创建...")
-                        character.CreateControlRig(True)
-                        self.log("    --> Control Rig创建完成")
-                    # Plot到Control Rig
-                    plot_options = FBPlotOptions()
-                    plot_options.ConstantKeyReducerKeepOneKey = True
-                    plot_options.PlotAllTakes = False
-                    plot_options.PlotTranslationOnRootOnly = True
-                    plot_result = character.PlotAnimation(FBCharacterPlotWhere.kFBCharacterPlotOnControlRig, plot_options)
-                    self.log("    --> Plot到Control Rig结果: {}".format(plot_result))
-            except Exception as e:
-                self.log("    --> Plot到Control Rig异常: {}".format(str(e)))
-
+            self.plot_to_control_rig()
+            yield "plot"
+            if not self.is_running:
+                return
+            
             self.log("  -> 保存角色动画...")
             # 保存角色动画
             anim_file = self.save_character_animation(fbx_file)
             if not anim_file:
-                self.log("  -> 保存角色动画失败")
-                return False
+                self.log("  -> 保存角色动画失败", level="error")
+                return
             self.log("  -> 角色动画保存成功: {}".format(anim_file))
-            
-            self.log("  -> 创建新场景...")
-            # 创建新场景
+            if cache_key:
+                self.store_cached_animation(cache_key, anim_file)
+            self.prepared_anim_file = anim_file
+            yield "save_animation"
+        except Exception as e:
+            self.prepared_anim_file = None
+            self.log("  -> 导出源动画异常: {}".format(str(e)), level="error")
+    
+    def open_animation_cache(self):
+        """打开中间动画缓存（第一次使用时），没有设置缓存目录或目录不可用时返回None"""
+        if self.animation_cache is None and self.animation_cache_dir:
+            try:
+                self.animation_cache = AnimationCache(self.ensure_str(self.animation_cache_dir),
+                                                      self.animation_cache_mb * 1024 * 1024)
+            except (IOError, OSError) as e:
+                self.log("动画缓存目录不可用，不使用缓存: {}".format(str(e)), level="warning")
+                self.animation_cache_dir = None
+        return self.animation_cache
+    
+    def animation_cache_key(self, path):
+        """中间动画缓存键：源文件内容哈希 + 角色名 + Plot/Take选项，不使用缓存时返回None"""
+        if not self.open_animation_cache():
+            return None
+        with self.timed("cache_hash"):
+            content_hash = source_content_hash(path)
+        if not content_hash:
+            return None
+        signature = {"character": self.current_character, "source_plot": SOURCE_PLOT_OPTIONS}
+        if self.multi_take():
+            signature["takes"] = {"mode": self.takes, "filter": self.take_filter}
+        return self.animation_cache.key(content_hash, signature)
+    
+    def cached_animation(self, fbx_file, cache_key):
+        """缓存命中时把缓存的动画放到中间动画目录并返回其路径，未命中返回None"""
+        anim_file = self.intermediate_anim_file(fbx_file)
+        if not os.path.isdir(os.path.dirname(anim_file)):
+            os.makedirs(os.path.dirname(anim_file))
+        with self.timed("cache_fetch"):
+            hit = self.animation_cache.get(cache_key, anim_file)
+        if self.current_record is not None:
+            self.current_record["animation_cache"] = "hit" if hit else "miss"
+        if not hit:
+            return None
+        takes = self.animation_cache.takes(cache_key)
+        if takes is not None:
+            self.anim_takes[anim_file] = takes
+        self.record_size("intermediate", anim_file)
+        self.log("  -> 动画缓存命中，跳过打开、Plot和导出: {}".format(anim_file))
+        return anim_file
+    
+    def store_cached_animation(self, cache_key, anim_file):
+        """把导出的动画存入缓存，失败只记录警告"""
+        try:
+            with self.timed("cache_store"):
+                self.animation_cache.put(cache_key, anim_file, self.anim_takes.get(anim_file))
+        except (IOError, OSError) as e:
+            self.log("  -> 存入动画缓存失败: {}".format(str(e)), level="warning")
+    
+    def inspect_source(self, fbx_file, path=None):
+        """预检源文件（path为实际读取的路径，例如预读副本），返回(错误信息或None, 文件信息)；调度时已读取过的直接复用"""
+        result = self.fbx_info.pop(fbx_file, None)
+        if result is None:
+            result = preflight_fbx(path or fbx_file, require_takes=True)
+        return result
+    
+    def preflight_source(self, fbx_file, path=None):
+        """FileOpen前预检源文件（文件头、版本、节点边界、角色、Take），失败时记录原因并返回False"""
+        with self.timed("preflight"):
+            error, info = self.inspect_source(fbx_file, path)
+        if self.current_record is not None:
+            self.current_record["frames"] = fbx_frame_count(info)
+        if error:
+            self.file_error = "预检失败: {}".format(error)
+            self.log("  -> {}，跳过FileOpen".format(self.file_error), level="error")
+            return False
+        if info["binary"]:
+            self.log("  -> 预检通过: FBX {}, {} 个Take".format(info["version"], len(info["takes"])))
+        return True
+    
+    def plot_to_control_rig(self):
+        """把当前场景角色的动画Plot到Control Rig"""
+        self.begin_stage("plot")
+        try:
+            self.log("  -> 准备将动画Plot到Control Rig...")
+            with self.timed("resolve_character"):
+                character = self.character_resolver.resolve()
+            if not character:
+                self.log("    --> 未找到角色，无法Plot到Control Rig")
+            else:
+                self.log("    --> 使用角色: {}".format(character.Name))
+                # 确保角色已Characterize
+                if not character.GetCharacterize():
+                    self.log("    --> 角色未Characterize，执行Characterize...")
+                    character.SetCharacterizeOn(True)
+                # 确保存在Control Rig
+                if not getattr(character, 'ControlRig', None):
+                    self.log("    --> 未检测到Control Rig，自动创建...")
+                    character.CreateControlRig(True)
+                    self.log("    --> Control Rig创建完成")
+                # Plot到Control Rig
+                plot_options = FBPlotOptions()
+                for name, value in SOURCE_PLOT_OPTIONS.items():
+                    setattr(plot_options, name, value)
+                if self.multi_take():
+                    plot_result = self.plot_takes(character, plot_options)
+                else:
+                    with self.timed("plot"):
+                        plot_result = character.PlotAnimation(FBCharacterPlotWhere.kFBCharacterPlotOnControlRig,
+                                                              plot_options)
+                self.log("    --> Plot到Control Rig结果: {}".format(plot_result))
+        except Exception as e:
+            self.log("    --> Plot到Control Rig异常: {}".format(str(e)), level="error")
+    
+    def plot_takes(self, character, plot_options):
+        """多Take模式：不过滤、不拆分时用PlotAllTakes一次Plot，否则逐个切换Take分别Plot并记录每个Take的耗时"""
+        takes = self.selected_takes()
+        self.log("    --> 处理 {} 个Take: {}".format(len(takes), ", ".join(take.Name for take in takes)))
+        if not takes:
+            return False
+        if not self.take_filter and not self.split_takes:
+            plot_options.PlotAllTakes = True
+            with self.timed("plot"):
+                return character.PlotAnimation(FBCharacterPlotWhere.kFBCharacterPlotOnControlRig, plot_options)
+        system = FBSystem()
+        current_take = system.CurrentTake
+        result = True
+        try:
+            for take in takes:
+                system.CurrentTake = take
+                start = monotonic()
+                with self.timed("plot"):
+                    result = character.PlotAnimation(FBCharacterPlotWhere.kFBCharacterPlotOnControlRig,
+                                                     plot_options) and result
+                self.record_take_time(take.Name, "plot", monotonic() - start)
+        finally:
+            system.CurrentTake = current_take
+        return result
+    
+    def load_target_scene(self, hik_file):
+        """新建场景并静默合并HIK目标文件"""
+        self.begin_stage("load_target")
+        self.resident_hik_file = None
+        self.log("  -> 创建新场景...")
+        # 创建新场景
+        with self.timed("file_new"):
             FBApplication().FileNew()
-            self.log("  -> 新场景创建成功")
-            
-            self.log("  -> 导入HIK文件: {}".format(os.path.basename(hik_file)))
-            # 合并HIK文件到当前场景
-            # 静默合并，避免弹出merge选项框
-            if not FBApplication().FileAppend(hik_file, False):
-                self.log("  -> HIK文件合并失败")
-                return False
-            self.log("  -> HIK文件合并成功")
-            
-            self.log("  -> 加载角色动画...")
-            # 使用Character Controls的Load Character Animation方式
-            system = FBSystem()
-            character = FBApplication().CurrentCharacter  # 修复：使用FBApplication()
-            
-            # 确保动画文件路径是str类型
-            anim_file = self.ensure_str(anim_file)
+        self.character_resolver.invalidate()
+        self.log("  -> 新场景创建成功")
+        
+        self.log("  -> 导入HIK文件: {}".format(os.path.basename(hik_file)))
+        # 合并HIK文件到当前场景
+        # 静默合并，避免弹出merge选项框
+        with self.timed("file_append"):
+            appended = FBApplication().FileAppend(hik_file, False)
+        self.character_resolver.invalidate()
+        if not appended:
+            self.log("  -> HIK文件合并失败", level="error")
+            return False
+        self.log("  -> HIK文件合并成功")
+        return True
+    
+    def load_animation_on_target(self, anim_file):
+        """把保存的角色动画加载到目标场景的CurrentCharacter上"""
+        self.begin_stage("load_animation")
+        self.log("  -> 加载角色动画...")
+        # 使用Character Controls的Load Character Animation方式
+        with self.timed("resolve_character"):
+            character = self.character_resolver.resolve()
+        
+        # 确保动画文件路径是str类型
+        anim_file = self.ensure_str(anim_file)
+        self.loaded_takes = self.anim_takes.get(anim_file)
+        
+        self.log("    --> 检查加载时的CurrentCharacter...")
+        if not character:
+            self.log("  -> 没有找到有效的CurrentCharacter")
+            return False
+        
+        self.log("    --> 找到Character: {}".format(character.Name))
+        try:
+            # 使用正确的MotionBuilder API加载角色动画
+            self.log("    --> 使用官方API: FBApplication().LoadAnimationOnCharacter...")
             
-            self.log("    --> 检查加载时的CurrentCharacter...")
-            if character:
-                self.log("    --> 找到Character: {}".format(character.Name))
-                try:
-                    # 使用正确的MotionBuilder API加载角色动画
-                    self.log("    --> 使用官方API: FBApplication().LoadAnimationOnCharacter...")
-                    
-                    # 设置FBX选项 - 按照官方文档
-                    fbx_options = FBFbxOptions(True)
-                    fbx_options.TransferMethod = FBCharacterLoadAnimationMethod.kFBCharacterLoadCopy
-                    fbx_options.ProcessAnimationOnExtension = False
-                    fbx_options.ShowOptionsDialog = False  # 禁用弹窗
-                    fbx_options.ShowFileDialog = False     # 禁用文件对话框
-                    
-                    # 设置Plot选项
-                    plot_options = FBPlotOptions()
-                    
-                    # 加载动画到角色 - 官方API方法
-                    load_result = FBApplication().LoadAnimationOnCharacter(anim_file, character, fbx_options, plot_options)
-                    self.log("    --> LoadAnimationOnCharacter结果: {}".format(load_result))
-                    
-                    if load_result:
-                        self.log("  -> 成功使用官方API加载角色动画")
-                    else:
-                        self.log("  -> 官方API加载失败")
-                        return False
-                        
-                except Exception as e:
-                    self.log("  -> 加载角色动画异常: {}".format(str(e)))
-                    import traceback
-                    # 获取完整的异常信息
-                    exc_info = traceback.format_exc()
-                    self.log("加载动画异常详情: {}".format(exc_info))
-                    return False
-            else:
-                self.log("  -> 没有找到有效的CurrentCharacter")
-                return False
+            # 设置FBX选项 - 按照官方文档
+            fbx_options = FBFbxOptions(True)
+            fbx_options.TransferMethod = getattr(FBCharacterLoadAnimationMethod, TARGET_LOAD_METHOD)
+            fbx_options.ProcessAnimationOnExtension = False
+            fbx_options.ShowOptionsDialog = False  # 禁用弹窗
+            fbx_options.ShowFileDialog = False     # 禁用文件对话框
             
-            self.log("  -> 保存最终场景...")
-            # 保存场景
-            base_name = os.path.splitext(os.path.basename(fbx_file))[0]
-            save_file = os.path.join(self.save_path, "{}.fbx".format(base_name))
-            # 确保保存路径是str类型
-            save_file = self.ensure_str(save_file)
-            if not FBApplication().FileSave(save_file):
-                self.log("  -> 保存最终场景失败")
-                return False
-            self.log("  -> 最终场景保存成功: {}".format(save_file))
+            # 设置Plot选项
+            plot_options = FBPlotOptions()
             
-            return True
+            # 加载动画到角色 - 官方API方法
+            load_start = monotonic()
+            with self.timed("load_animation"):
+                load_result = FBApplication().LoadAnimationOnCharacter(anim_file, character, fbx_options, plot_options)
+            load_time = monotonic() - load_start
+            self.log("    --> LoadAnimationOnCharacter结果: {}".format(load_result))
             
+            if load_result:
+                self.log("  -> 成功使用官方API加载角色动画")
+                save_time = 0.0
+                if self.current_record is not None:
+                    save_time = self.current_record["stages"].get("save_animation", 0.0)
+                round_trip = save_time + load_time
+                self.round_trip_total += round_trip
+                self.log("  -> 中间文件往返耗时: 保存 {:.3f}s + 加载 {:.3f}s = {:.3f}s".format(
+                    save_time, load_time, round_trip))
+                return True
+            self.log("  -> 官方API加载失败", level="error")
+            return False
+                
         except Exception as e:
-            self.log("  -> process_single_file异常: {}".format(str(e)))
+            self.log("  -> 加载角色动画异常: {}".format(str(e)), level="error")
             import traceback
             # 获取完整的异常信息
             exc_info = traceback.format_exc()
-            self.log("process_single_file异常详情: {}".format(exc_info))
+            self.log("加载动画异常详情: {}".format(exc_info), level="error")
+            return False
+    
+    def save_result_scene(self, fbx_file, hik_file=None):
+        """把当前场景保存到保存位置，文件名与源文件相同（扇出模式下按目标分目录）"""
+        self.begin_stage("save_result")
+        self.log("  -> 保存最终场景...")
+        if self.split_takes:
+            return self.save_take_outputs(fbx_file, hik_file)
+        if self.benchmark_save_profiles:
+            self.benchmark_profiles()
+        # 保存场景
+        save_file = self.output_file_for(fbx_file, hik_file)
+        local_file = self.write_output(save_file, self.save_options(self.save_profile))
+        if not local_file:
+            self.log("  -> 保存最终场景失败", level="error")
+            return False
+        self.record_output_size(hik_file, [local_file])
+        if self.uploader:
+            # 上传完成后才写入清单
+            self.uploader.submit(local_file, save_file, (fbx_file, hik_file, None), remove_source=True)
+            self.log("  -> 最终场景已保存到本地，后台上传: {}".format(save_file))
+            return True
+        if self.current_record is not None and hik_file:
+            self.current_record["targets"].append(hik_file)
+        self.log("  -> 最终场景保存成功: {}".format(save_file))
+        return True
+    
+    def save_take_outputs(self, fbx_file, hik_file):
+        """每个Take单独保存为一个输出文件（FBFbxOptions只选中该Take），不需要重新打开源文件
+
+        只保存中间动画导出时包含的源Take（目标场景FileNew后自带的Take不保存），
+        没有记录时（旧版本的缓存条目）按take_filter从目标场景的Take中选择。
+        """
+        names = self.loaded_takes
+        if names is None:
+            names = [take.Name for take in FBSystem().Scene.Takes if self.take_selected(take.Name)]
+        if not names:
+            self.log("  -> 场景中没有要保存的Take", level="error")
             return False
+        local_files = []
+        for name in names:
+            save_file = self.output_file_for(fbx_file, hik_file, name)
+            options = self.save_options(self.save_profile or "full")
+            self.select_takes(options, [name])
+            start = monotonic()
+            local_file = self.write_output(save_file, options)
+            self.record_take_time(name, "save", monotonic() - start)
+            if not local_file:
+                self.log("  -> 保存Take失败: {}".format(name), level="error")
+                if self.uploader:
+                    for path in local_files:
+                        self.discard_intermediate(path)
+                return False
+            local_files.append(local_file)
+            self.log("  -> Take {} 保存成功: {}".format(name, save_file))
+        self.record_output_size(hik_file, local_files)
+        if self.uploader:
+            # 所有Take上传完成后才写入清单
+            self.upload_remaining[(fbx_file, hik_file)] = len(names)
+            for name, local_file in zip(names, local_files):
+                self.uploader.submit(local_file, self.output_file_for(fbx_file, hik_file, name),
+                                     (fbx_file, hik_file, names), remove_source=True)
+        elif self.current_record is not None and hik_file:
+            self.current_record["targets"].append(hik_file)
+            self.current_record.setdefault("split_outputs", {})[hik_file] = names
+        return True
+    
+    def save_options(self, profile_name):
+        """按保存配置构建FBFbxOptions（强制二进制），profile_name为None时返回None（FileSave默认选项）"""
+        if not profile_name:
+            return None
+        profile = self.save_profiles[profile_name]
+        options = FBFbxOptions(False)
+        default = profile.get("default", True)
+        options.SetAll(FBElementAction.kFBElementActionSave if default else FBElementAction.kFBElementActionDiscard,
+                       default)
+        for name, save in profile.get("elements", {}).items():
+            self.set_fbx_option(options, name, FBElementAction.kFBElementActionSave if save
+                                else FBElementAction.kFBElementActionDiscard)
+        for name, value in profile.get("flags", {}).items():
+            self.set_fbx_option(options, name, value)
+        self.set_fbx_option(options, "UseASCIIFormat", False)
+        if profile.get("current_take"):
+            self.select_takes(options, [FBSystem().CurrentTake.Name])
+        return options
+    
+    def set_fbx_option(self, options, name, value):
+        """设置一个FBFbxOptions属性，当前版本没有该属性时记录警告（每个名称只记录一次）"""
+        if hasattr(options, name):
+            setattr(options, name, value)
+            return
+        if name not in self.missing_fbx_options:
+            self.missing_fbx_options.add(name)
+            self.log("    --> FBFbxOptions没有属性 {}，忽略".format(name), level="warning")
+    
+    def benchmark_profiles(self):
+        """用每个要比较的保存配置把当前场景保存到中间文件目录，记录耗时和文件大小后删除"""
+        bench_dir = os.path.join(self.ensure_str(self.intermediate_dir), "profile_bench")
+        if not os.path.isdir(bench_dir):
+            os.makedirs(bench_dir)
+        results = {}
+        for name in self.benchmark_save_profiles:
+            path = os.path.join(bench_dir, "{}_{}.fbx".format(os.getpid(), "".join(
+                c if c.isalnum() else "_" for c in name)))
+            start = monotonic()
+            with self.timed("save_profiles"):
+                saved = FBApplication().FileSave(path, self.save_options(name))
+            elapsed = monotonic() - start
+            try:
+                size = os.path.getsize(path) if saved else None
+                os.remove(path)
+            except OSError:
+                size = None
+            results[name] = {"time": elapsed, "size": size}
+            self.log("    --> 保存配置 {}: {:.3f}s, {} bytes".format(name, elapsed, size))
+        if self.current_record is not None:
+            self.current_record.setdefault("save_profiles", {}).update(results)
+    
+    def log_profile_benchmark(self):
+        """汇总运行报告中每个保存配置的平均保存耗时和输出大小"""
+        totals = collections.OrderedDict((name, [0, 0.0, 0]) for name in self.benchmark_save_profiles)
+        for row in self.report.rows:
+            for name, result in (row.get("save_profiles") or {}).items():
+                if name in totals and result.get("size") is not None:
+                    totals[name][0] += 1
+                    totals[name][1] += result["time"]
+                    totals[name][2] += result["size"]
+        self.log("保存配置对比（平均每个文件）:")
+        for name, (count, elapsed, size) in totals.items():
+            if count:
+                self.log("  {:<16} {:8.3f}s {:12,.0f} bytes（{} 个文件）".format(
+                    name, elapsed / count, float(size) / count, count))
+            else:
+                self.log("  {:<16} 没有成功保存".format(name))
+    
+    def write_output(self, save_file, options=None):
+        """保存当前场景，异步上传时先保存到本地（之后由后台线程.partial写入再原子重命名），返回写入的路径，失败返回None"""
+        local_file = self.upload_staging_file(save_file) if self.uploader else save_file
+        save_dir = os.path.dirname(local_file)
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        with self.timed("file_save"):
+            if options is None:
+                saved = FBApplication().FileSave(local_file)
+            else:
+                saved = FBApplication().FileSave(local_file, options)
+        return local_file if saved else None
+    
+    def record_output_size(self, hik_file, paths):
+        """记录输出文件大小（拆分Take时为合计），扇出模式下按目标分别记录"""
+        if self.current_record is None:
+            return
+        name = "output_" + self.target_name(hik_file) if self.fan_out and hik_file else "output"
+        try:
+            self.current_record["sizes"][name] = sum(os.path.getsize(path) for path in paths)
+        except OSError:
+            pass
+    
+    def post_processes_keys(self):
+        """是否在加载动画后精简/重采样关键帧（需要NumPy）"""
+        return bool(self.key_reduction or self.resample_fps)
+    
+    def key_tolerance(self, kind):
+        if not self.key_reduction:
+            return None
+        return self.key_reduction.get(kind, self.key_reduction.get("*"))
+    
+    def character_key_curves(self, character):
+        """目标角色骨骼和Control Rig上所有有关键帧的FCurve，返回[(FCurve, 属性类型)]"""
+        models = []
+        seen = set()
+        for node_id in FBBodyNodeId.values.values():
+            for getter in ("GetModel", "GetCtrlRigModel"):
+                try:
+                    model = getattr(character, getter)(node_id)
+                except Exception:
+                    model = None
+                if model is not None and id(model) not in seen:
+                    seen.add(id(model))
+                    models.append(model)
+        curves = []
+        for model in models:
+            for property_name, kind in KEY_CURVE_PROPERTIES:
+                prop = getattr(model, property_name, None)
+                node = prop.GetAnimationNode() if prop is not None else None
+                if node is None:
+                    continue
+                for sub_node in node.Nodes:
+                    fcurve = sub_node.FCurve
+                    if fcurve is not None and len(fcurve.Keys) > 2:
+                        curves.append((fcurve, kind))
+        return curves
+    
+    def post_process_keys(self):
+        """加载动画后把目标角色的FCurve批量读入NumPy数组，重采样、按容差精简后分批写回
+
+        关键帧数量变化和耗时记入当前文件记录；失败只记录警告，不影响保存。
+        """
+        self.begin_stage("reduce_keys")
+        if numpy is None:
+            self.log("  -> 未安装NumPy，跳过关键帧精简", level="warning")
+            return
+        try:
+            with self.timed("reduce_keys"):
+                character = self.character_resolver.resolve()
+                if not character:
+                    return
+                before = after = 0
+                curves = self.character_key_curves(character)
+                for fcurve, kind in curves:
+                    keys = fcurve.Keys
+                    times = numpy.array([key.Time.GetSecondDouble() for key in keys])
+                    values = numpy.array([key.Value for key in keys])
+                    before += len(times)
+                    if self.resample_fps:
+                        times, values = resample_keys(times, values, self.resample_fps)
+                    tolerance = self.key_tolerance(kind)
+                    if tolerance is not None:
+                        keep = reduce_keys(times, values, tolerance)
+                        times, values = times[keep], values[keep]
+                    after += len(times)
+                    if len(times) != len(keys) or self.resample_fps:
+                        self.write_key_curve(fcurve, times, values)
+            ratio = float(after) / before if before else 1.0
+            self.log("  -> 关键帧精简: {} 条曲线, {} -> {} 个关键帧（{:.1%}）".format(len(curves), before, after, ratio))
+            if self.current_record is not None:
+                keys = self.current_record.setdefault("keys", {"before": 0, "after": 0})
+                keys["before"] += before
+                keys["after"] += after
+                keys["ratio"] = float(keys["after"]) / keys["before"] if keys["before"] else 1.0
+        except Exception as e:
+            self.log("  -> 关键帧精简异常: {}".format(str(e)), level="warning")
+    
+    def write_key_curve(self, fcurve, times, values):
+        """在一次EditBegin/EditEnd中清空FCurve并写回关键帧（线性插值，和精简时的误差计算一致）"""
+        linear = FBInterpolation.kFBInterpolationLinear
+        fcurve.EditBegin(len(times))
+        try:
+            fcurve.EditClear()
+            for seconds, value in zip(times.tolist(), values.tolist()):
+                key_time = FBTime()
+                key_time.SetSecondDouble(seconds)
+                index = fcurve.KeyAdd(key_time, value)
+                fcurve.Keys[index].Interpolation = linear
+        finally:
+            fcurve.EditEnd(len(times))
+    
+    def discard_intermediate(self, anim_file):
+        """删除中间动画文件（设置了keep_intermediates时保留，已删除时直接返回）
+
+        中间动画要加载到源文件的每个HIK目标上，所以在最后一个目标的LoadAnimationOnCharacter之后
+        （无论成功与否）立即删除，不等保存；中途失败或被停止时由调用方在结束时兜底删除。
+        """
+        self.anim_takes.pop(anim_file, None)
+        if self.keep_intermediates or not os.path.isfile(anim_file):
+            return
+        try:
+            os.remove(anim_file)
+        except OSError as e:
+            self.log("    --> 删除中间动画文件失败: {}".format(str(e)), level="warning")
+    
+    def intermediate_anim_file(self, fbx_file):
+        """源文件对应的中间动画文件路径：文件名（不含扩展名）加上源路径校验和，避免不同目录的同名文件/并行进程互相覆盖"""
+        base_name = os.path.splitext(os.path.basename(fbx_file))[0]
+        path_digest = hashlib.md5(to_bytes(os.path.abspath(fbx_file))).hexdigest()[:8]
+        # 确保动画文件路径是str类型
+        return self.ensure_str(os.path.join(self.ensure_str(self.intermediate_dir),
+                                            "{}_{}.fbx".format(base_name, path_digest)))
     
     def save_character_animation(self, fbx_file):
-        """保存角色动画到桌面/Animation目录 """
+        """保存角色动画到中间动画目录（intermediate_dir）"""
         # 确保文件路径是str类型
         fbx_file = self.ensure_str(fbx_file)
         
+        self.begin_stage("save_animation")
         self.log("    --> 开始保存角色动画...")
         
-        # 创建桌面/Animation目录
-        desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-        animation_dir = os.path.join(desktop_path, "Animation")
+        # 创建中间动画目录
+        animation_dir = self.ensure_str(self.intermediate_dir)
         
         if not os.path.exists(animation_dir):
             os.makedirs(animation_dir)
             self.log("    --> 创建动画目录: {}".format(animation_dir))
         
-        # 获取文件名（不含扩展名）
-        base_name = os.path.splitext(os.path.basename(fbx_file))[0]
-        anim_file = os.path.join(animation_dir, "{}.fbx".format(base_name))
-        # 确保动画文件路径是str类型
-        anim_file = self.ensure_str(anim_file)
+        anim_file = self.intermediate_anim_file(fbx_file)
         self.log("    --> 目标动画文件: {}".format(anim_file))
         
         try:
-            # 获取/修复当前角色
-            target_rigged_character = FBApplication().CurrentCharacter
+            # 获取当前角色（UI选择的角色优先），并设为CurrentCharacter
+            with self.timed("resolve_character"):
+                target_rigged_character = self.character_resolver.resolve()
             if not target_rigged_character:
-                self.log("    --> 未检测到CurrentCharacter，尝试从场景中定位角色...")
-                chosen_char = None
-                # 优先用UI中记录的名称
-                try:
-                    if hasattr(self, 'current_character') and self.current_character:
-                        for comp in FBSystem().Scene.Components:
-                            if comp.ClassName() == 'FBCharacter' and comp.Name == self.current_character:
-                                chosen_char = comp
-                                break
-                except Exception:
-                    pass
-                # 其次选择场景中的第一个FBCharacter
-                if not chosen_char:
-                    for comp in FBSystem().Scene.Components:
-                        if comp.ClassName() == 'FBCharacter':
-                            chosen_char = comp
-                            break
-                # 设置为CurrentCharacter
-                if chosen_char:
-                    FBApplication().CurrentCharacter = chosen_char
-                    target_rigged_character = chosen_char
-                    self.log("    --> 已设置CurrentCharacter为: {}".format(chosen_char.Name))
-                else:
-                    self.log("    --> 错误：场景中未找到任何FBCharacter")
-                    return None
+                self.log("    --> 错误：场景中未找到任何FBCharacter", level="error")
+                return None
              
             self.log("    --> 找到角色: {}".format(target_rigged_character.Name))
              
             # 设置FBX选项用于保存
             fbx_options_save = FBFbxOptions(False)
             fbx_options_save.SetAll(FBElementAction.kFBElementActionSave, True)
+            if self.multi_take():
+                # 多Take模式：中间动画文件带上所有要处理的Take，加载时一次加载
+                take_names = self.select_takes(fbx_options_save)
+                self.log("    --> 保存Take: {}".format(", ".join(take_names)))
+            else:
+                take_names = [take.Name for take in self.selected_takes()]
              
             # 使用SaveCharacterRigAndAnimation保存角色动画和装备
             self.log("    --> 使用SaveCharacterRigAndAnimation保存...")
-            save_result = FBApplication().SaveCharacterRigAndAnimation(
-                os.path.normpath(anim_file),
-                target_rigged_character,
-                fbx_options_save
-            )
+            with self.timed("save_animation"):
+                save_result = FBApplication().SaveCharacterRigAndAnimation(
+                    os.path.normpath(anim_file),
+                    target_rigged_character,
+                    fbx_options_save
+                )
             
             if save_result:
+                self.anim_takes[anim_file] = take_names
                 self.log("    --> 成功保存角色动画到: {}".format(anim_file))
                 # 验证文件是否真的创建了
                 if os.path.exists(anim_file):
                     file_size = os.path.getsize(anim_file)
+                    self.record_size("intermediate", anim_file)
                     self.log("    --> 文件大小: {} bytes".format(file_size))
                     return anim_file
                 else:
-                    self.log("    --> 错误：文件没有被创建")
+                    self.log("    --> 错误：文件没有被创建", level="error")
                     return None
             else:
-                self.log("    --> 错误：SaveCharacterRigAndAnimation返回False")
+                self.log("    --> 错误：SaveCharacterRigAndAnimation返回False", level="error")
                 return None
                 
         except Exception as e:
-            self.log("    --> 保存角色动画异常: {}".format(str(e)))
+            self.log("    --> 保存角色动画异常: {}".format(str(e)), level="error")
             import traceback
             exc_info = traceback.format_exc()
-            self.log("保存动画异常详情: {}".format(exc_info))
+            self.log("保存动画异常详情: {}".format(exc_info), level="error")
             return None
 
 
-class AnimationReplaceBatchUI(QWidget):
-    """动画替换批处理UI"""
+def run_job(job, fbsdk_module=None, watch=False):
+    """无界面执行一个批处理任务（任务字典），返回进程退出码；watch为True时以监视模式常驻运行"""
+    if fbsdk_module:
+        load_fbsdk(fbsdk_module)
+    try:
+        processor = BatchProcessor.from_job(job, None)
+    except ValueError as e:
+        print("错误：{}".format(str(e)))
+        return 2
+    errors = validate_batch_settings(job.get("source_path"), job.get("hik_path"), job.get("save_path"),
+                                     require_character=False, catalog=processor.catalog)
+    if errors:
+        for title, message in errors:
+            print("错误：{}".format(message))
+        return 2
+    if fbsdk_module and not processor.fbsdk_module:
+        processor.fbsdk_module = fbsdk_module
+    success, message = processor.watch() if watch else processor.run()
+    print(message)
+    return 0 if success else 1
+
+
+def load_job_file(job_path):
+    """读取JSON任务文件"""
+    with open(job_path, "r") as f:
+        return json.load(f)
+
+
+class AnimationReplaceBatchUIMixin(object):
+    """动画替换批处理UI（界面逻辑，与QWidget组合成AnimationReplaceBatchUI）"""
     
     def __init__(self):
-        super(AnimationReplaceBatchUI, self).__init__()
+        super(AnimationReplaceBatchUIMixin, self).__init__()
         self.source_path = ""
         self.hik_path = ""
         self.save_path = ""
         self.current_character = ""
         self.batch_processor = None
+        self.batch_steps = None  # 正在运行的批处理生成器（iter_run）
+        self.batch_timer = None  # 驱动批处理的QTimer
+        self.log_sink = LogSink()  # 等待刷新到日志文本框的日志
         
         self.init_ui()
         
@@ -487,6 +4608,24 @@ class AnimationReplaceBatchUI(QWidget):
         self.stop_button.clicked.connect(self.stop_batch_process)
         self.stop_button.setEnabled(False)
         
+        # 并行工作进程数量（1为在当前场景中串行处理）
+        self.worker_spin = QSpinBox()
+        self.worker_spin.setRange(1, multiprocessing.cpu_count())
+        self.worker_spin.setValue(1)
+        self.worker_spin.setToolTip("大于1时启动多个无界面MotionBuilder工作进程并行处理")
+        
+        # 常驻目标场景：HIK目标只加载一次，每个文件只清空Take动画
+        self.resident_checkbox = QCheckBox("常驻目标场景")
+        self.resident_checkbox.setToolTip("HIK目标只加载一次，避免每个文件都FileNew+FileAppend")
+        
+        # 扇出：每个源动画只打开/Plot/导出一次，依次应用到HIK目录中的所有目标
+        self.fan_out_checkbox = QCheckBox("应用到所有HIK目标")
+        self.fan_out_checkbox.setToolTip("每个源文件只打开一次，动画依次加载到每个HIK目标，输出保存在以目标名命名的子目录")
+        
+        control_layout.addWidget(QLabel("并行进程:"))
+        control_layout.addWidget(self.worker_spin)
+        control_layout.addWidget(self.resident_checkbox)
+        control_layout.addWidget(self.fan_out_checkbox)
         control_layout.addWidget(self.start_button)
         control_layout.addWidget(self.stop_button)
         main_layout.addLayout(control_layout)
@@ -500,12 +4639,19 @@ class AnimationReplaceBatchUI(QWidget):
         self.status_label = QLabel("就绪")
         main_layout.addWidget(self.status_label)
         
-        # 日志文本框
+        # 日志文本框（只保留最近LOG_WIDGET_MAX_LINES行，完整日志写入保存位置的日志文件）
         self.log_text = QTextEdit()
         self.log_text.setMaximumHeight(100)
+        self.log_text.setReadOnly(True)
         self.log_text.setPlaceholderText("处理日志将显示在这里...")
+        self.log_text.document().setMaximumBlockCount(LOG_WIDGET_MAX_LINES)
         main_layout.addWidget(self.log_text)
         
+        # 日志先写入缓冲，由定时器批量刷新到日志文本框
+        self.log_flush_timer = QTimer(self)
+        self.log_flush_timer.timeout.connect(self.flush_log)
+        self.log_flush_timer.start(LOG_FLUSH_INTERVAL_MS)
+        
         self.setLayout(main_layout)
         
         # 测试日志系统
@@ -585,40 +4731,14 @@ class AnimationReplaceBatchUI(QWidget):
         """开始批处理"""
         self.log("=== 开始批处理配置检查 ===")
         
-        # 验证输入
-        if not self.source_path:
-            self.log("错误：未选择源数据目录")
-            QMessageBox.warning(self, "警告", "请选择源数据目录")
-            return
-            
-        if not self.hik_path:
-            self.log("错误：未选择HIK文件目录")
-            QMessageBox.warning(self, "警告", "请选择HIK文件目录")
-            return
-            
-        if not self.save_path:
-            self.log("错误：未选择保存位置")
-            QMessageBox.warning(self, "警告", "请选择保存位置")
-            return
-            
-        if not self.current_character:
-            self.log("错误：未获取当前场景角色")
-            QMessageBox.warning(self, "警告", "请先获取当前场景角色")
-            return
-            
-        if not os.path.exists(self.source_path):
-            self.log("错误：源数据目录不存在: {}".format(self.source_path))
-            QMessageBox.warning(self, "错误", "源数据目录不存在: {}".format(self.source_path))
-            return
-            
-        if not os.path.exists(self.hik_path):
-            self.log("错误：HIK文件目录不存在: {}".format(self.hik_path))
-            QMessageBox.warning(self, "错误", "HIK文件目录不存在: {}".format(self.hik_path))
-            return
-            
-        if not os.path.exists(self.save_path):
-            self.log("错误：保存位置不存在: {}".format(self.save_path))
-            QMessageBox.warning(self, "错误", "保存位置不存在: {}".format(self.save_path))
+        # 验证输入（扫描结果缓存在catalog中，文件检查和批处理复用）
+        catalog = FileCatalog()
+        errors = validate_batch_settings(self.source_path, self.hik_path, self.save_path, self.current_character,
+                                         catalog=catalog)
+        if errors:
+            title, message = errors[0]
+            self.log("错误：{}".format(message))
+            QMessageBox.warning(self, title, message)
             return
         
         # 添加调试信息
@@ -643,11 +4763,7 @@ class AnimationReplaceBatchUI(QWidget):
                 self.log("当前角色: None")
                 
             # 检查是否有Character在场景中
-            characters = []
-            for comp in scene.Components:
-                if comp.ClassName() == 'FBCharacter':
-                    characters.append(comp.Name)
-            self.log("场景中的角色: {}".format(characters))
+            self.log("场景中的角色: {}".format(CharacterResolver().names()))
             
         except Exception as e:
             self.log("检查MotionBuilder状态时出错: {}".format(str(e)))
@@ -655,18 +4771,12 @@ class AnimationReplaceBatchUI(QWidget):
             exc_info = traceback.format_exc()
             self.log("MotionBuilder状态检查异常详情: {}".format(exc_info))
         
-        # 快速检查是否能找到文件
-        import glob
-        source_fbx = glob.glob(os.path.join(self.source_path, "*.fbx"))
-        hik_fbx = glob.glob(os.path.join(self.hik_path, "*.fbx"))
+        # 文件检查：源目录不等扫描完，批处理边扫描边处理
+        hik_fbx = catalog.files(self.hik_path)
         self.log("\n=== 文件检查 ===")
-        self.log("源目录FBX文件数量: {}".format(len(source_fbx)))
+        self.log("源文件示例: {}".format(catalog.first(self.source_path)))
         self.log("HIK目录FBX文件数量: {}".format(len(hik_fbx)))
-        
-        if len(source_fbx) > 0:
-            self.log("源文件示例: {}".format(source_fbx[0]))
-        if len(hik_fbx) > 0:
-            self.log("HIK文件示例: {}".format(hik_fbx[0]))
+        self.log("HIK文件示例: {}".format(hik_fbx[0]))
         
         # 启动批处理
         self.log("=== 准备启动批处理 ===")
@@ -678,26 +4788,56 @@ class AnimationReplaceBatchUI(QWidget):
         self.progress_bar.setValue(0)
         self.update_status("开始批处理...")
         
-        # 创建批处理器并运行
-        self.batch_processor = BatchProcessor(self.source_path, self.hik_path, self.save_path, self.current_character, self.log_message)
+        # 创建批处理器
+        # 多进程模式下每步只短暂等待工作进程事件，保持界面响应
+        self.batch_processor = BatchProcessor(self.source_path, self.hik_path, self.save_path, self.current_character, self.log_message,
+                                              worker_count=self.worker_spin.value(),
+                                              resident_target=self.resident_checkbox.isChecked(),
+                                              fan_out=self.fan_out_checkbox.isChecked(),
+                                              progress_callback=self.on_batch_progress,
+                                              poll_interval=0.02,
+                                              echo_console=False,
+                                              catalog=catalog)
         
-        # 运行批处理
-        success, message = self.batch_processor.run()
+        # 由QTimer逐阶段驱动批处理，两个阶段之间处理界面事件（停止按钮、进度条）
+        self.batch_steps = self.batch_processor.iter_run()
+        self.batch_timer = QTimer(self)
+        self.batch_timer.timeout.connect(self.run_batch_step)
+        self.batch_timer.start(0)
         
-        # 批处理完成
-        self.batch_finished(success, message)
+    def run_batch_step(self):
+        """执行批处理的下一个阶段，全部完成后调用batch_finished"""
+        try:
+            next(self.batch_steps)
+        except StopIteration:
+            self.batch_timer.stop()
+            success, message = self.batch_processor.run_result
+            self.finished_processor = self.batch_processor
+            self.batch_processor = None
+            self.batch_steps = None
+            # 批处理完成
+            self.batch_finished(success, message)
         
     def stop_batch_process(self):
-        """停止批处理"""
+        """停止批处理（在当前阶段结束后生效）"""
         if hasattr(self, 'batch_processor') and self.batch_processor:
             self.batch_processor.stop()
-            self.batch_processor = None
-            self.batch_finished(False, "批处理已停止")
+            self.stop_button.setEnabled(False)
+            self.status_label.setText("正在停止，等待当前阶段完成...")
             
     def update_progress(self, value):
         """更新进度条"""
         self.progress_bar.setValue(value)
         
+    def on_batch_progress(self, done, total, eta):
+        """批处理进度回调：更新进度条和预计剩余时间"""
+        self.progress_bar.setMaximum(max(1, total))
+        self.update_progress(done)
+        if eta is None:
+            self.status_label.setText("处理中 {}/{}".format(done, total))
+        else:
+            self.status_label.setText("处理中 {}/{}，预计剩余 {}".format(done, total, format_duration(eta)))
+        
     def update_status(self, message):
         """更新状态"""
         self.status_label.setText(message)
@@ -709,10 +4849,17 @@ class AnimationReplaceBatchUI(QWidget):
         self.log_message(message)  # 输出到UI日志
         
     def log_message(self, message):
-        """添加日志消息"""
+        """添加日志消息（写入缓冲，由flush_log批量显示）"""
         timestamp = time.strftime("%H:%M:%S")
         log_entry = "[{}] {}".format(timestamp, message)
-        self.log_text.append(log_entry)
+        self.log_sink.emit(log_entry)
+        
+    def flush_log(self):
+        """把缓冲中的日志一次性追加到日志文本框"""
+        lines = self.log_sink.drain()
+        if not lines:
+            return
+        self.log_text.append("\n".join(lines))
         
         # 自动滚动到底部
         scrollbar = self.log_text.verticalScrollBar()
@@ -723,33 +4870,22 @@ class AnimationReplaceBatchUI(QWidget):
         self.log("=== 批处理结束回调 ===")
         self.log("成功: {}, 消息: {}".format(success, message))
         
-        # 检查桌面Animation文件夹
-        desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-        animation_dir = os.path.join(desktop_path, "Animation")
-        self.log("检查桌面Animation文件夹: {}".format(animation_dir))
-        
-        if os.path.exists(animation_dir):
-            anim_files = [f for f in os.listdir(animation_dir) if f.lower().endswith('.fbx')]
-            self.log("Animation文件夹中的FBX文件数量: {}".format(len(anim_files)))
-            if anim_files:
-                self.log("Animation文件夹中的文件:")
-                for f in anim_files[:5]:  # 显示前5个
-                    self.log("  - {}".format(f))
-        else:
-            self.log("Animation文件夹不存在")
-        
-        # 检查保存位置
-        if hasattr(self, 'save_path') and self.save_path:
-            self.log("检查保存位置: {}".format(self.save_path))
-            if os.path.exists(self.save_path):
-                save_files = [f for f in os.listdir(self.save_path) if f.lower().endswith('.fbx')]
-                self.log("保存位置中的FBX文件数量: {}".format(len(save_files)))
-                if save_files:
-                    self.log("保存位置中的文件:")
-                    for f in save_files[:5]:  # 显示前5个
-                        self.log("  - {}".format(f))
-            else:
-                self.log("保存位置不存在")
+        # 本次运行的结果来自运行报告（已写入运行历史数据库），不再重新列出目录
+        processor = getattr(self, 'finished_processor', None)
+        if processor is not None:
+            rows = processor.report.rows
+            saved = [row["file"] for row in rows if row["status"] == "success"]
+            failed = [row for row in rows if row["status"] != "success"]
+            self.log("本次保存的文件数量: {}".format(len(saved)))
+            for fbx_file in saved[:5]:  # 显示前5个
+                self.log("  - {}".format(fbx_file if processor.fan_out else processor.output_file_for(fbx_file)))
+            if failed:
+                self.log("失败的文件:")
+                for row in failed[:5]:
+                    self.log("  - {}: {}".format(row["file"], row.get("error") or "文件处理失败"))
+            if processor.history_run_id is not None:
+                self.log("运行历史run {}，可用 --history trends/slowest/regressions 查询".format(processor.history_run_id))
+            self.finished_processor = None
         
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
@@ -765,20 +4901,104 @@ class AnimationReplaceBatchUI(QWidget):
             QMessageBox.warning(self, "错误", message)
 
 
+AnimationReplaceBatchUI = None  # 第一次打开UI时创建（需要PySide2）
+
+
+def get_ui_class():
+    """导入PySide2并创建UI类"""
+    global AnimationReplaceBatchUI
+    if AnimationReplaceBatchUI is None:
+        import_qt()
+        
+        class AnimationReplaceBatchUI(AnimationReplaceBatchUIMixin, QWidget):
+            """动画替换批处理UI"""
+    return AnimationReplaceBatchUI
+
+
 def show_animation_batch_ui():
     """显示动画批处理UI"""
+    try:
+        ui_class = get_ui_class()
+    except ImportError:
+        print("错误：无法导入PySide2，请确保已安装PySide2")
+        return None
+    
     app = QApplication.instance()
     if app is None:
         app = QApplication(sys.argv)
     
-    window = AnimationReplaceBatchUI()
+    window = ui_class()
     window.show()
     
     return window
 
+def inspect_main(paths):
+    """输出FBX文件信息（JSON），有文件预检失败时返回1"""
+    exit_code = 0
+    for path in paths:
+        error, info = preflight_fbx(path, require_character=False)
+        result = dict(info or {"path": path}, error=error)
+        print(json.dumps(result, indent=1, sort_keys=True))
+        if error:
+            exit_code = 1
+    return exit_code
+
+
+def main(argv=None):
+    """命令行入口：--job 无界面执行任务文件，--worker 以工作进程模式运行，否则打开UI
+
+    例如在渲染农场节点上: mobupy Animation_replace_batch_pyside.py --job job.json
+    """
+    parser = argparse.ArgumentParser(description="MotionBuilder动画替换批处理")
+    parser.add_argument("--job", help="JSON任务文件（source_path/hik_path/save_path/character/options）")
+    parser.add_argument("--source", help="源数据目录（覆盖任务文件）")
+    parser.add_argument("--hik", help="HIK文件目录（覆盖任务文件）")
+    parser.add_argument("--save", help="保存位置（覆盖任务文件）")
+    parser.add_argument("--character", help="角色名称（覆盖任务文件）")
+    parser.add_argument("--workers", type=int, help="并行工作进程数量（覆盖任务文件）")
+    parser.add_argument("--watch", action="store_true", help="监视模式：常驻运行，源目录中新增或变化的文件稳定后立即处理")
+    parser.add_argument("--fbsdk-module", help="代替pyfbsdk导入的模块（测试用）")
+    parser.add_argument("--worker", action="store_true", help="以无界面工作进程模式运行（由WorkerPool启动）")
+    parser.add_argument("--worker-config", default="{}", help="工作进程配置（JSON）")
+    parser.add_argument("--inspect", nargs="+", metavar="FBX", help="只读取并输出FBX文件信息（不需要MotionBuilder）")
+    parser.add_argument("--history", choices=("trends", "slowest", "regressions"),
+                        help="查询运行历史：吞吐量趋势、最慢的文件、耗时回归（不需要MotionBuilder）")
+    parser.add_argument("--history-db", help="运行历史数据库路径（默认{}环境变量或用户目录）".format(HISTORY_DB_ENV))
+    parser.add_argument("--limit", type=int, default=20, help="--history输出的最多行数")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="--history regressions：变慢超过多少百分比")
+    args, _ = parser.parse_known_args(argv)
+    if args.worker:
+        return worker_main(json.loads(args.worker_config))
+    if args.inspect:
+        return inspect_main(args.inspect)
+    if args.history:
+        return history_main(args.history, args.history_db, args.limit, args.threshold)
+    if args.job or args.source:
+        job = load_job_file(args.job) if args.job else {}
+        for key, value in (("source_path", args.source), ("hik_path", args.hik),
+                           ("save_path", args.save), ("character", args.character)):
+            if value:
+                job[key] = value
+        if args.workers:
+            job.setdefault("options", {})["worker_count"] = args.workers
+        return run_job(job, args.fbsdk_module, args.watch)
+    return show_animation_batch_ui()
+
+
+def imported_as_module():
+    """是否被其他Python代码以模块方式导入（此时不自动打开UI）"""
+    module_file = globals().get("__file__")
+    if not module_file:
+        return False
+    return __name__ == os.path.splitext(os.path.basename(module_file))[0]
+
+
 # 运行UI
 if __name__ == "__main__":
-    ui = show_animation_batch_ui()
-else:
+    ui = main()
+    if isinstance(ui, int):
+        sys.exit(ui)
+elif not imported_as_module():
     # 在MotionBuilder中运行
-    ui = show_animation_batch_ui() 
\ No newline at end of file
+    ui = show_animation_batch_ui()
\ No newline at end of file
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批处理基准测试 - 在普通CPython（不需要MotionBuilder）上用替身pyfbsdk运行BatchProcessor
+在临时目录中生成10~10000个假FBX文件，统计吞吐量、每文件调度开销和内存占用。
+
+用法：
+    python benchmark/benchmark_batch.py --sizes 10 100 1000 --mode serial pool --workers 4
+    python benchmark/benchmark_batch.py --latency FileOpen=0.05 --failure-rate FileOpen=0.01
+    python benchmark/benchmark_batch.py --sizes 20 --curve-frames 600 --key-reduction "*=0.01" rotation=0.05
+    python benchmark/benchmark_batch.py --sizes 20 --latency FileSave=0.05 --save-profiles full skeleton+anim animation-only
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import random
+import argparse
+import importlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2.7
+    tracemalloc = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+SCRIPT_MODULE = "Animation_replace_batch_pyside"
+FAKE_MODULE = "fake_pyfbsdk"
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+FILES_PER_DIR = 100
+
+
+def parse_call_values(items):
+    """把 ["FileOpen=0.05", ...] 解析为 {"FileOpen": 0.05}，"*=x" 表示所有调用"""
+    values = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        values[name] = float(value)
+    return values
+
+
+def expand_call_values(values, calls):
+    if "*" in values:
+        expanded = dict((call, values["*"]) for call in calls)
+        expanded.update((k, v) for k, v in values.items() if k != "*")
+        return expanded
+    return values
+
+
+def build_tree(fake, root, file_count, file_size, frames=(100, 100), seed=1):
+    """生成源目录（每个子目录FILES_PER_DIR个文件）、HIK目录和保存目录
+
+    源文件和HIK文件都是最小的二进制FBX（能通过预检），源文件帧数在frames范围内随机。
+    """
+    rng = random.Random(seed)
+    source_path = os.path.join(root, "source")
+    hik_path = os.path.join(root, "hik")
+    save_path = os.path.join(root, "save")
+    for path in (source_path, hik_path, save_path):
+        os.makedirs(path)
+    for index in range(file_count):
+        directory = os.path.join(source_path, "dir_{:04d}".format(index // FILES_PER_DIR))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fake.write_binary_fbx(os.path.join(directory, "clip_{:05d}.fbx".format(index)),
+                              frames=rng.randint(frames[0], frames[1]), size=file_size)
+    fake.write_binary_fbx(os.path.join(hik_path, "target_hik.fbx"), frames=1, size=file_size)
+    return source_path, hik_path, save_path
+
+
+def current_rss_kb():
+    """当前进程常驻内存（KB），读取/proc，不可用时返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+def max_rss_kb(who):
+    if resource is None:
+        return None
+    return resource.getrusage(who).ru_maxrss
+
+
+def run_case(script, fake, mode, file_count, args):
+    """运行一次批处理，返回指标字典"""
+    root = tempfile.mkdtemp(prefix="mobu_batch_bench_")
+    try:
+        source_path, hik_path, save_path = build_tree(fake, root, file_count, args.file_size, args.frames, args.seed)
+        fake.STATS["calls"].clear()
+        fake.STATS["failures"].clear()
+        fake.STATS["simulated_time"] = 0.0
+        processor = script.BatchProcessor(
+            source_path, hik_path, save_path, None, None,
+            worker_count=args.workers if mode == "pool" else 1,
+            fbsdk_module=FAKE_MODULE,
+            resident_target=(mode == "resident"),
+            resident_chunk_size=args.chunk_size,
+            intermediate_dir=os.path.join(root, "scratch"),
+            resume=not args.no_resume,
+            prefetch_depth=args.prefetch_depth,
+            async_upload=args.async_upload,
+            transfer_bandwidth=args.bandwidth,
+            key_reduction=parse_call_values(args.key_reduction) or None,
+            resample_fps=args.resample_fps,
+            save_profile=args.save_profile,
+            benchmark_save_profiles=args.save_profiles,
+            history_db=args.history_db or False,
+            log_file=None if args.log_file else False,
+            echo_console=False)
+
+        if tracemalloc is not None:
+            tracemalloc.start()
+        rss_before = current_rss_kb()
+        start = time.time()
+        success, message = processor.run()
+        wall = time.time() - start
+        rss_after = current_rss_kb()
+        traced_peak = None
+        if tracemalloc is not None:
+            traced_peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+        summary = processor.report.summary()
+        stage_time = summary["total"]["sum"] + sum(processor.report.shared_stages.values())
+        parallelism = args.workers if mode == "pool" else 1
+        processed = processor.success_count + processor.error_count
+        keys = [row["keys"] for row in processor.report.rows if row.get("keys")]
+        return {
+            "mode": mode,
+            "files": file_count,
+            "workers": parallelism,
+            "success": processor.success_count,
+            "errors": processor.error_count,
+            "batch_ok": bool(success),
+            "wall_s": wall,
+            "throughput_fps": processed / wall if wall > 0 else 0.0,
+            "stage_time_s": stage_time,
+            "simulated_s": fake.STATS["simulated_time"],
+            "overhead_ms_per_file": 1000.0 * max(0.0, wall - stage_time / parallelism) / max(1, processed),
+            "rss_delta_kb": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+            "max_rss_kb": max_rss_kb(resource.RUSAGE_SELF) if resource else None,
+            "children_max_rss_kb": max_rss_kb(resource.RUSAGE_CHILDREN) if resource else None,
+            "traced_peak_kb": traced_peak,
+            "keys_before": sum(item["before"] for item in keys),
+            "keys_after": sum(item["after"] for item in keys),
+            "reduce_keys_s": summary.get("reduce_keys", {}).get("sum", 0.0),
+            "save_profiles": profile_summary(processor.report.rows),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print("保留测试目录: {}".format(root))
+
+
+def profile_summary(rows):
+    """每个保存配置的平均保存耗时（秒）和平均输出大小（字节）"""
+    totals = {}
+    for row in rows:
+        for name, result in (row.get("save_profiles") or {}).items():
+            if result.get("size") is None:
+                continue
+            total = totals.setdefault(name, [0, 0.0, 0])
+            total[0] += 1
+            total[1] += result["time"]
+            total[2] += result["size"]
+    return dict((name, {"files": count, "save_s": elapsed / count, "size": size // count})
+                for name, (count, elapsed, size) in totals.items())
+
+
+def format_row(result):
+    def kb(value):
+        return "-" if value is None else "{:,}".format(value)
+    return "{mode:<9}{files:>7}{workers:>4}{success:>7}{errors:>6}{wall:>10.2f}{fps:>10.1f}{overhead:>10.2f}{peak:>12}{rss:>12}".format(
+        mode=result["mode"], files=result["files"], workers=result["workers"],
+        success=result["success"], errors=result["errors"], wall=result["wall_s"],
+        fps=result["throughput_fps"], overhead=result["overhead_ms_per_file"],
+        peak=kb(result["traced_peak_kb"]), rss=kb(result["max_rss_kb"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MotionBuilder批处理基准测试（替身pyfbsdk）")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="每次运行的源文件数量")
+    parser.add_argument("--mode", nargs="+", default=["serial"], choices=("serial", "resident", "pool"),
+                        help="处理模式")
+    parser.add_argument("--workers", type=int, default=4, help="pool模式的工作进程数")
+    parser.add_argument("--chunk-size", type=int, default=50, help="resident模式每批文件数")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="CALL=SECONDS",
+                        help="模拟调用耗时，例如 FileOpen=0.05，*=0.01 表示所有调用")
+    parser.add_argument("--failure-rate", nargs="*", default=[], metavar="CALL=RATE",
+                        help="模拟调用失败率，例如 FileOpen=0.01")
+    parser.add_argument("--file-size", type=int, default=1024, help="假FBX文件大小（字节）")
+    parser.add_argument("--frames", type=int, nargs=2, default=[100, 100], metavar=("MIN", "MAX"),
+                        help="源文件帧数范围（随机）")
+    parser.add_argument("--seed", type=int, default=1, help="失败随机数种子")
+    parser.add_argument("--prefetch-depth", type=int, default=0, help="serial/resident模式后台预读的源文件数量")
+    parser.add_argument("--async-upload", action="store_true", help="serial/resident模式输出先保存到本地再后台上传")
+    parser.add_argument("--bandwidth", type=float, default=0, help="预读/上传限速（MB/s），0为不限速")
+    parser.add_argument("--curve-frames", type=int, default=0, help="加载动画时每条FCurve写入的逐帧关键帧数量")
+    parser.add_argument("--key-reduction", nargs="*", default=[], metavar="KIND=TOLERANCE",
+                        help="关键帧精简容差，例如 translation=0.01 rotation=0.05，*=0.01 表示所有属性")
+    parser.add_argument("--resample-fps", type=float, default=0, help="加载动画后重采样到的帧率，0为不重采样")
+    parser.add_argument("--save-profile", help="最终保存使用的配置（默认FileSave选项）")
+    parser.add_argument("--save-profiles", nargs="+", metavar="PROFILE",
+                        help="每个文件额外用这些保存配置试保存，输出平均保存耗时和大小")
+    parser.add_argument("--no-resume", action="store_true", help="关闭断点续跑清单（默认与正式运行一样写清单）")
+    parser.add_argument("--history-db", help="把每次运行写入该运行历史数据库（默认不写）")
+    parser.add_argument("--log-file", action="store_true", help="写出JSONL日志文件（默认关闭）")
+    parser.add_argument("--keep", action="store_true", help="保留生成的测试目录")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    # 替身模块通过环境变量配置和定位，工作进程会继承
+    sys.path[:0] = [BENCHMARK_DIR, REPO_DIR]
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [BENCHMARK_DIR] + [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p])
+    fake = importlib.import_module(FAKE_MODULE)
+    config = {
+        "latency": expand_call_values(parse_call_values(args.latency), fake.SIMULATED_CALLS),
+        "failure_rate": expand_call_values(parse_call_values(args.failure_rate), fake.SIMULATED_CALLS),
+        "output_size": args.file_size,
+        "seed": args.seed,
+        "curve_frames": args.curve_frames,
+    }
+    os.environ[fake.CONFIG_ENV] = json.dumps(config)
+    os.environ["MOBU_BATCH_FBSDK"] = FAKE_MODULE
+    fake.configure(config)
+    script = importlib.import_module(SCRIPT_MODULE)
+
+    print("{:<9}{:>7}{:>4}{:>7}{:>6}{:>10}{:>10}{:>10}{:>12}{:>12}".format(
+        "mode", "files", "w", "ok", "err", "wall(s)", "files/s", "ovh(ms)", "peak(KB)", "maxrss(KB)"))
+    results = []
+    for mode in args.mode:
+        for size in args.sizes:
+            result = run_case(script, fake, mode, size, args)
+            results.append(result)
+            print(format_row(result))
+            if result["keys_before"]:
+                print("  关键帧: {:,} -> {:,}（{:.1%}），精简耗时 {:.2f}s".format(
+                    result["keys_before"], result["keys_after"],
+                    float(result["keys_after"]) / result["keys_before"], result["reduce_keys_s"]))
+            for name in args.save_profiles or []:
+                profile = result["save_profiles"].get(name)
+                if profile:
+                    print("  保存配置 {:<16} {:8.3f}s {:>12,} bytes".format(name, profile["save_s"], profile["size"]))
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pyfbsdk替身模块 - 在没有MotionBuilder的普通CPython上运行批处理（基准测试、调度测试）
+每个场景操作按配置休眠一段时间、按失败率随机失败，保存操作写出指定大小的最小二进制FBX文件
+（write_binary_fbx，也用于生成基准测试的源文件）。
+
+配置通过环境变量 FAKE_FBSDK_CONFIG（JSON）传入，工作进程会继承同样的配置：
+    {"latency": {"FileOpen": 0.05, ...}, "failure_rate": {"FileOpen": 0.01, ...},
+     "output_size": 4096, "seed": 1, "character_name": "Character", "takes": ["Take 001"]}
+
+FileOpen打开的源场景包含 takes 中的所有Take，LoadAnimationOnCharacter把这些Take加载到目标场景。
+curve_frames大于0时，角色有 bones 个骨骼，LoadAnimationOnCharacter给每个骨骼的平移/旋转FCurve
+写入curve_frames个逐帧关键帧（平滑曲线加少量噪声，部分通道为常量），用于测试关键帧精简。
+FileSave传入FBFbxOptions时，输出大小和模拟耗时按保存的元素比例和选中的Take比例缩小（用于比较保存配置）。
+"""
+
+import os
+import math
+import json
+import time
+import random
+import struct
+
+__all__ = [
+    "FBApplication", "FBSystem", "FBScene", "FBComponent", "FBCharacter", "FBTake",
+    "FBPlotOptions", "FBFbxOptions", "FBElementAction", "FBCharacterPlotWhere",
+    "FBCharacterLoadAnimationMethod", "FBModel", "FBBodyNodeId", "FBTime", "FBFCurve", "FBInterpolation",
+    "configure", "STATS",
+]
+
+CONFIG_ENV = "FAKE_FBSDK_CONFIG"
+
+# 会被模拟耗时/失败的调用
+SIMULATED_CALLS = ("FileOpen", "FileNew", "FileAppend", "FileSave", "PlotAnimation",
+                   "SaveCharacterRigAndAnimation", "LoadAnimationOnCharacter")
+
+CONFIG = {
+    "latency": {},
+    "failure_rate": {},
+    "output_size": 1024,
+    "seed": None,
+    "character_name": "Character",
+    "takes": ["Take 001"],
+    "bones": 20,
+    "curve_frames": 0,
+}
+
+# 本进程内的调用统计：次数、失败次数、模拟耗时总和
+STATS = {"calls": {}, "failures": {}, "simulated_time": 0.0}
+
+_random = random.Random()
+
+
+def configure(config=None, **overrides):
+    """更新替身配置（不传参数时从环境变量读取）"""
+    if config is None:
+        config = json.loads(os.environ.get(CONFIG_ENV) or "{}")
+    config = dict(config, **overrides)
+    for key, value in config.items():
+        CONFIG[key] = value
+    if CONFIG.get("seed") is not None:
+        _random.seed(CONFIG["seed"])
+
+
+def _simulate(call, scale=1.0):
+    """按配置休眠（scale为耗时比例）并决定本次调用是否失败，返回True表示成功"""
+    STATS["calls"][call] = STATS["calls"].get(call, 0) + 1
+    latency = float(CONFIG["latency"].get(call, 0.0)) * scale
+    if latency > 0:
+        time.sleep(latency)
+        STATS["simulated_time"] += latency
+    if _random.random() < float(CONFIG["failure_rate"].get(call, 0.0)):
+        STATS["failures"][call] = STATS["failures"].get(call, 0) + 1
+        return False
+    return True
+
+
+FBX_MAGIC = b"Kaydara FBX Binary  \x00\x1a\x00"
+KTIME_PER_SECOND = 46186158000
+
+
+def _encode_property(value):
+    if isinstance(value, bool):
+        return b"C" + struct.pack("<?", value)
+    if isinstance(value, int):
+        if -2 ** 31 <= value < 2 ** 31:
+            return b"I" + struct.pack("<i", value)
+        return b"L" + struct.pack("<q", value)
+    if isinstance(value, float):
+        return b"D" + struct.pack("<d", value)
+    if isinstance(value, bytes):
+        return b"R" + struct.pack("<I", len(value)) + value
+    data = value.encode("utf-8")
+    return b"S" + struct.pack("<I", len(data)) + data
+
+
+def _encode_node(offset, node, wide):
+    """node为(名称, 属性列表, 子节点列表)，offset为节点在文件中的绝对偏移"""
+    name, properties, children = node
+    header_size = 25 if wide else 13
+    name_data = name.encode("ascii")
+    property_data = b"".join(_encode_property(value) for value in properties)
+    position = offset + header_size + len(name_data) + len(property_data)
+    child_data = []
+    for child in children:
+        encoded = _encode_node(position, child, wide)
+        child_data.append(encoded)
+        position += len(encoded)
+    if children:
+        child_data.append(b"\0" * header_size)
+        position += header_size
+    header = struct.pack("<QQQB" if wide else "<IIIB", position, len(properties), len(property_data), len(name_data))
+    return header + name_data + property_data + b"".join(child_data)
+
+
+def write_binary_fbx(path, frames=100, frame_rate_mode=6, characters=1, takes=("Take 001",),
+                     size=0, version=7500):
+    """写出一个最小的二进制FBX：Definitions（角色数量）、GlobalSettings（TimeMode）、Takes（时长）
+
+    size大于实际内容时用Objects中的原始数据填充到该大小。
+    """
+    wide = version >= 7500
+    stop = int(KTIME_PER_SECOND * max(0, frames - 1) / 30.0)
+    definitions = [("Count", [characters], [])] if characters else []
+    nodes = [
+        ("GlobalSettings", [], [("Properties70", [], [("P", ["TimeMode", "enum", "", "", frame_rate_mode], [])])]),
+        ("Definitions", [], [("ObjectType", ["Character"], definitions)] if characters else []),
+        ("Objects", [b""], []),
+        ("Takes", [], [("Current", [takes[0] if takes else ""], [])] +
+         [("Take", [name], [("LocalTime", [0, stop], []), ("ReferenceTime", [0, stop], [])]) for name in takes]),
+    ]
+    body = FBX_MAGIC + struct.pack("<I", version)
+    for index, node in enumerate(nodes):
+        body += _encode_node(len(body), node, wide)
+    padding = size - len(body) - (25 if wide else 13)
+    if padding > 0:
+        # 重新编码，把填充数据放进Objects节点
+        nodes[2] = ("Objects", [b"\0" * padding], [])
+        body = FBX_MAGIC + struct.pack("<I", version)
+        for node in nodes:
+            body += _encode_node(len(body), node, wide)
+    body += b"\0" * (25 if wide else 13)
+    with open(path, "wb") as f:
+        f.write(body)
+
+
+def _write_dummy(path, takes=None, scale=1.0):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    if takes is None:
+        takes = [take.Name for take in _scene.Takes] or ["Take 001"]
+    write_binary_fbx(path, takes=takes, size=int(CONFIG["output_size"] * scale))
+
+
+class FBComponent(object):
+    def __init__(self, name):
+        self.Name = name
+        self.LongName = name
+
+    def ClassName(self):
+        return self.__class__.__name__
+
+    def FBDelete(self):
+        _scene.remove(self)
+
+
+class FBTime(object):
+    def __init__(self, hour=0, minute=0, second=0, frame=0):
+        self.seconds = hour * 3600.0 + minute * 60.0 + second + frame / 30.0
+
+    def GetSecondDouble(self):
+        return self.seconds
+
+    def SetSecondDouble(self, seconds):
+        self.seconds = seconds
+
+
+class FBInterpolation(object):
+    kFBInterpolationConstant = 0
+    kFBInterpolationLinear = 1
+    kFBInterpolationCubic = 2
+
+
+class FBFCurveKey(object):
+    def __init__(self, time, value):
+        self.Time = time
+        self.Value = value
+        self.Interpolation = FBInterpolation.kFBInterpolationCubic
+
+
+class FBFCurve(object):
+    def __init__(self):
+        self.Keys = []
+
+    def KeyAdd(self, time, value):
+        self.Keys.append(FBFCurveKey(time, value))
+        return len(self.Keys) - 1
+
+    def EditBegin(self, count=-1):
+        return True
+
+    def EditEnd(self, count=-1):
+        self.Keys.sort(key=lambda key: key.Time.GetSecondDouble())
+        return True
+
+    def EditClear(self):
+        self.Keys = []
+
+
+class _AnimationNode(object):
+    def __init__(self, nodes=(), fcurve=None):
+        self.Nodes = list(nodes)
+        self.FCurve = fcurve
+
+
+class _AnimatableProperty(object):
+    def __init__(self):
+        self.node = _AnimationNode([_AnimationNode(fcurve=FBFCurve()) for _ in range(3)])
+
+    def GetAnimationNode(self):
+        return self.node
+
+
+class FBModel(FBComponent):
+    def __init__(self, name):
+        super(FBModel, self).__init__(name)
+        self.Translation = _AnimatableProperty()
+        self.Rotation = _AnimatableProperty()
+        self.Scaling = _AnimatableProperty()
+
+
+class FBBodyNodeId(object):
+    values = {}
+
+
+class FBCharacter(FBComponent):
+    def __init__(self, name):
+        super(FBCharacter, self).__init__(name)
+        self.characterized = True
+        self.ControlRig = None
+        self.models = {}
+
+    def GetModel(self, node_id):
+        if node_id not in self.models and node_id < int(CONFIG["bones"]):
+            self.models[node_id] = FBModel("{}_bone{}".format(self.Name, node_id))
+        return self.models.get(node_id)
+
+    def GetCtrlRigModel(self, node_id):
+        return None
+
+    def write_curves(self, frames):
+        """给每个骨骼的平移/旋转曲线写入逐帧关键帧"""
+        for node_id in range(int(CONFIG["bones"])):
+            model = self.GetModel(node_id)
+            for channel, prop in enumerate((model.Translation, model.Rotation)):
+                for axis, sub_node in enumerate(prop.GetAnimationNode().Nodes):
+                    fcurve = sub_node.FCurve
+                    fcurve.EditClear()
+                    constant = (node_id + axis) % 3 == 0
+                    phase = _random.random() * 6.0
+                    for frame in range(frames):
+                        if constant:
+                            value = float(channel)
+                        else:
+                            value = 20.0 * math.sin(frame / 15.0 + phase) + _random.gauss(0.0, 0.001)
+                        fcurve.KeyAdd(FBTime(frame=frame), value)
+
+    def GetCharacterize(self):
+        return self.characterized
+
+    def SetCharacterizeOn(self, on):
+        self.characterized = on
+        return True
+
+    def CreateControlRig(self, forward_kinematic):
+        self.ControlRig = FBComponent(self.Name + "_Ctrl")
+        return True
+
+    def PlotAnimation(self, where, options):
+        return _simulate("PlotAnimation")
+
+
+class FBTake(FBComponent):
+    def __init__(self, name):
+        super(FBTake, self).__init__(name)
+        _scene.Takes.append(self)
+        _scene.Components.append(self)
+
+    def ClearAllProperties(self, on_selected_only, on_locked_properties=False):
+        return None
+
+
+class FBScene(object):
+    def __init__(self):
+        self.Components = []
+        self.Characters = []
+        self.Takes = []
+        self.current_take = None
+
+    def add(self, component):
+        self.Components.append(component)
+        if isinstance(component, FBCharacter):
+            self.Characters.append(component)
+
+    def remove(self, component):
+        for collection in (self.Components, self.Characters, self.Takes):
+            if component in collection:
+                collection.remove(component)
+
+
+_scene = FBScene()
+_application_state = {"CurrentCharacter": None}
+
+
+def _reset_scene(with_character):
+    """模拟FileNew/FileOpen：替换整个场景，新场景只有默认的Take 001，打开的源场景只包含配置中的Take"""
+    global _scene
+    _scene = FBScene()
+    _application_state["CurrentCharacter"] = None
+    if with_character:
+        _add_character()
+        _add_takes(CONFIG["takes"])
+    if not _scene.Takes:
+        FBTake("Take 001")
+    _scene.current_take = _scene.Takes[0]
+
+
+def _add_takes(names):
+    """添加场景中还没有的Take"""
+    existing = set(take.Name for take in _scene.Takes)
+    for name in names:
+        if name not in existing:
+            FBTake(name)
+
+
+def _add_character():
+    character = FBCharacter(CONFIG["character_name"])
+    _scene.add(character)
+    _scene.add(FBComponent(CONFIG["character_name"] + "_Hips"))
+    _application_state["CurrentCharacter"] = character
+    return character
+
+
+class FBSystem(object):
+    @property
+    def Scene(self):
+        return _scene
+
+    @property
+    def CurrentTake(self):
+        return _scene.current_take
+
+    @CurrentTake.setter
+    def CurrentTake(self, take):
+        _scene.current_take = take
+
+
+class FBApplication(object):
+    CurrentActor = None
+
+    @property
+    def CurrentCharacter(self):
+        return _application_state["CurrentCharacter"]
+
+    @CurrentCharacter.setter
+    def CurrentCharacter(self, character):
+        _application_state["CurrentCharacter"] = character
+
+    def FileOpen(self, path, show_options=False, options=None):
+        if not os.path.isfile(path) or not _simulate("FileOpen"):
+            return False
+        _reset_scene(with_character=True)
+        return True
+
+    def FileNew(self):
+        _simulate("FileNew")
+        _reset_scene(with_character=False)
+        return True
+
+    def FileAppend(self, path, show_options=True, options=None):
+        if not os.path.isfile(path) or not _simulate("FileAppend"):
+            return False
+        _add_character()
+        return True
+
+    def FileSave(self, path=None, options=None):
+        scale = options.save_scale() if options is not None else 1.0
+        if not _simulate("FileSave", scale):
+            return False
+        _write_dummy(path, options.selected_takes() if options is not None else None, scale)
+        return True
+
+    def SaveCharacterRigAndAnimation(self, path, character, options):
+        if not _simulate("SaveCharacterRigAndAnimation"):
+            return False
+        _write_dummy(path, options.selected_takes() if options is not None else None)
+        return True
+
+    def LoadAnimationOnCharacter(self, path, character, options, plot_options):
+        if not os.path.isfile(path) or not _simulate("LoadAnimationOnCharacter"):
+            return False
+        _add_takes(CONFIG["takes"])
+        if int(CONFIG["curve_frames"]):
+            character.write_curves(int(CONFIG["curve_frames"]))
+        return True
+
+
+class FBPlotOptions(object):
+    def __init__(self):
+        self.ConstantKeyReducerKeepOneKey = False
+        self.PlotAllTakes = False
+        self.PlotTranslationOnRootOnly = False
+
+
+class FBFbxOptions(object):
+    # 元素属性（FBElementAction）和布尔选项
+    ELEMENTS = ("Models", "Characters", "Constraints", "Poses", "Cameras", "BaseCameras", "Lights",
+                "Materials", "Textures", "Shaders", "Video", "Audio", "Devices", "Story", "Groups",
+                "Sets", "Notes", "Actors", "OpticalData", "Solvers", "KeyingGroups")
+    FLAGS = ("ModelsAnimation", "SaveCharacter", "SaveControlSet", "SaveCharacterExtention", "UseASCIIFormat")
+
+    def __init__(self, load, path=None):
+        self.load = load
+        self.element_actions = {}
+        self.SetAll(FBElementAction.kFBElementActionSave, True)
+        self.UseASCIIFormat = False
+        # 保存选项的Take列表取自当前场景，默认全部选中
+        self.takes = [[take.Name, True] for take in _scene.Takes]
+
+    def SetAll(self, action, value):
+        self.element_actions["*"] = (action, value)
+        for name in self.ELEMENTS:
+            setattr(self, name, action)
+        for name in self.FLAGS[:-1]:
+            setattr(self, name, value)
+
+    def save_scale(self):
+        """模拟的输出大小比例：固定部分 + 保存的元素比例，乘以选中的Take比例"""
+        saved = sum(1 for name in self.ELEMENTS if getattr(self, name) == FBElementAction.kFBElementActionSave)
+        fraction = 0.3 + 0.7 * saved / float(len(self.ELEMENTS))
+        if self.takes:
+            fraction *= len(self.selected_takes()) / float(len(self.takes))
+        return fraction
+
+    def GetTakeCount(self):
+        return len(self.takes)
+
+    def GetTakeName(self, index):
+        return self.takes[index][0]
+
+    def SetTakeSelect(self, index, select):
+        self.takes[index][1] = select
+
+    def GetTakeSelect(self, index):
+        return self.takes[index][1]
+
+    def selected_takes(self):
+        return [name for name, select in self.takes if select]
+
+
+FBBodyNodeId.values = dict((node_id, node_id) for node_id in range(64))
+
+
+class FBElementAction(object):
+    kFBElementActionDiscard = 0
+    kFBElementActionAppend = 1
+    kFBElementActionMerge = 2
+    kFBElementActionSave = 3
+
+
+class FBCharacterPlotWhere(object):
+    kFBCharacterPlotOnControlRig = 0
+    kFBCharacterPlotOnSkeleton = 1
+
+
+class FBCharacterLoadAnimationMethod(object):
+    kFBCharacterLoadConnect = 0
+    kFBCharacterLoadCopy = 1
+    kFBCharacterLoadRetarget = 2
+    kFBCharacterLoadPlot = 3
+
+
+configure()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+多节点协作测试 - 在本机启动多个批处理进程（模拟渲染农场节点），共用一个临时目录中的源目录、
+保存位置和租约目录，检查每个文件只被处理一次、所有文件都有完成标记。
+
+--kill-after 秒数后强制结束第一个节点（模拟节点死亡），它持有的租约过期后由其他节点回收。
+
+用法：
+    python benchmark/lease_nodes.py --files 200 --nodes 3 --latency "*=0.01"
+    python benchmark/lease_nodes.py --files 100 --nodes 3 --ttl 3 --kill-after 1 --latency FileOpen=0.05
+    python benchmark/lease_nodes.py --files 60 --nodes 3 --workers 2 --latency "*=0.01"
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import collections
+
+import benchmark_batch
+
+BENCHMARK_DIR = benchmark_batch.BENCHMARK_DIR
+SCRIPT_PATH = os.path.join(benchmark_batch.REPO_DIR, benchmark_batch.SCRIPT_MODULE + ".py")
+
+
+def start_node(index, root, job_path, env):
+    """启动一个节点进程，输出写到 root/node_<序号>.log"""
+    node_env = dict(env, MOBU_BATCH_SCRATCH=os.path.join(root, "scratch_{}".format(index)),
+                    MOBU_BATCH_HISTORY=os.path.join(root, "history_{}.sqlite".format(index)))
+    log = open(os.path.join(root, "node_{}.log".format(index)), "wb")
+    process = subprocess.Popen([sys.executable, SCRIPT_PATH, "--job", job_path,
+                                "--fbsdk-module", benchmark_batch.FAKE_MODULE],
+                               stdout=log, stderr=subprocess.STDOUT, env=node_env)
+    return process, log
+
+
+def collect_results(save_path, lease_dir):
+    """读取各节点的运行报告和租约目录中的标记"""
+    processed = collections.defaultdict(list)  # 源文件 -> [(节点, 状态)]
+    for name in sorted(os.listdir(save_path)):
+        if not (name.startswith("mobu_batch_report_") and name.endswith(".json")):
+            continue
+        with open(os.path.join(save_path, name)) as f:
+            report = json.load(f)
+        for row in report["files"]:
+            processed[row["file"]].append((report.get("node"), row["status"]))
+    markers = collections.Counter(os.path.splitext(name)[1] for name in os.listdir(lease_dir))
+    return processed, markers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多节点租约协作测试（替身pyfbsdk）")
+    parser.add_argument("--files", type=int, default=200, help="源文件数量")
+    parser.add_argument("--nodes", type=int, default=3, help="节点进程数量")
+    parser.add_argument("--ttl", type=float, default=5.0, help="租约有效期（秒）")
+    parser.add_argument("--workers", type=int, default=1, help="每个节点的工作进程数量（大于1时为多进程模式）")
+    parser.add_argument("--kill-after", type=float, help="多少秒后强制结束第一个节点")
+    parser.add_argument("--latency", nargs="*", default=["*=0.01"], metavar="CALL=SECONDS",
+                        help="模拟调用耗时，例如 FileOpen=0.05，*=0.01 表示所有调用")
+    parser.add_argument("--file-size", type=int, default=1024, help="假FBX文件大小（字节）")
+    parser.add_argument("--keep", action="store_true", help="保留生成的测试目录")
+    args = parser.parse_args(argv)
+
+    sys.path[:0] = [BENCHMARK_DIR]
+    fake = __import__(benchmark_batch.FAKE_MODULE)
+    config = {"latency": benchmark_batch.expand_call_values(benchmark_batch.parse_call_values(args.latency),
+                                                            fake.SIMULATED_CALLS),
+              "output_size": args.file_size}
+    env = dict(os.environ)
+    env[fake.CONFIG_ENV] = json.dumps(config)
+    env["PYTHONPATH"] = os.pathsep.join([BENCHMARK_DIR] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+
+    root = tempfile.mkdtemp(prefix="mobu_batch_lease_")
+    try:
+        source_path, hik_path, save_path = benchmark_batch.build_tree(fake, root, args.files, args.file_size)
+        lease_dir = os.path.join(root, "leases")
+        job_path = os.path.join(root, "job.json")
+        with open(job_path, "w") as f:
+            json.dump({"source_path": source_path, "hik_path": hik_path, "save_path": save_path,
+                       "options": {"lease_dir": lease_dir, "lease_ttl": args.ttl, "worker_count": args.workers}}, f)
+
+        start = time.time()
+        nodes = [start_node(index, root, job_path, env) for index in range(args.nodes)]
+        if args.kill_after is not None:
+            time.sleep(args.kill_after)
+            nodes[0][0].kill()
+            print("已强制结束节点0（{:.1f}s）".format(time.time() - start))
+        exit_codes = []
+        for process, log in nodes:
+            exit_codes.append(process.wait())
+            log.close()
+        wall = time.time() - start
+
+        processed, markers = collect_results(save_path, lease_dir)
+        outputs = [name for name in os.listdir(save_path) if name.endswith(".fbx")]
+        per_node = collections.Counter(node for runs in processed.values() for node, _ in runs)
+        duplicates = [path for path, runs in processed.items() if len(runs) > 1]
+
+        print("节点: {}（每个 {} 个工作进程），文件: {}，耗时: {:.2f}s，退出码: {}".format(
+            args.nodes, args.workers, args.files, wall, exit_codes))
+        for node, count in sorted(per_node.items()):
+            print("  {}: {} 个文件".format(node, count))
+        print("输出文件: {}，完成标记: {}，失败标记: {}，残留租约: {}".format(
+            len(outputs), markers[".done"], markers[".failed"], markers[".lease"]))
+        print("重复处理: {}".format(len(duplicates)))
+        for path in duplicates[:10]:
+            print("  {}: {}".format(path, processed[path]))
+        ok = (not duplicates and len(outputs) == args.files and markers[".done"] == args.files
+              and not markers[".lease"])
+        print("结果: {}".format("通过" if ok else "失败"))
+        return 0 if ok else 1
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print("保留测试目录: {}".format(root))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
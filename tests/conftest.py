@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""测试环境：用 benchmark/fake_pyfbsdk.py 代替pyfbsdk，在普通Python中导入批处理脚本"""
+
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(REPO_DIR, "benchmark")
+
+for path in (REPO_DIR, BENCHMARK_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("MOBU_BATCH_FBSDK", "fake_pyfbsdk")
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""FbxReader / preflight_fbx：损坏、版本不支持、没有角色的文件在FileOpen之前被拒绝"""
+
+import os
+
+import fake_pyfbsdk
+import Animation_replace_batch_pyside as batch
+
+
+def test_valid_file_reports_frames_and_takes(tmp_path):
+    path = str(tmp_path / "clip.fbx")
+    fake_pyfbsdk.write_binary_fbx(path, frames=120, takes=("Walk", "Run"))
+    error, info = batch.preflight_fbx(path, require_takes=True)
+    assert error is None
+    assert info["binary"]
+    assert [take["name"] for take in info["takes"]] == ["Walk", "Run"]
+    assert batch.fbx_frame_count(info) == 120
+
+
+def test_truncated_file(tmp_path):
+    path = str(tmp_path / "clip.fbx")
+    fake_pyfbsdk.write_binary_fbx(path, size=4096)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+    error, info = batch.preflight_fbx(path)
+    assert error is not None
+    assert info is None
+
+
+def test_unsupported_version(tmp_path):
+    path = str(tmp_path / "clip.fbx")
+    fake_pyfbsdk.write_binary_fbx(path, version=batch.FBX_MAX_VERSION + 100)
+    error, info = batch.preflight_fbx(path)
+    assert error is not None and str(batch.FBX_MAX_VERSION + 100) in error
+
+
+def test_no_character(tmp_path):
+    path = str(tmp_path / "clip.fbx")
+    fake_pyfbsdk.write_binary_fbx(path, characters=0)
+    error, info = batch.preflight_fbx(path)
+    assert error == "文件中没有角色（Character/HIK）定义"
+    assert batch.preflight_fbx(path, require_character=False)[0] is None
+
+
+def test_not_an_fbx(tmp_path):
+    path = str(tmp_path / "clip.fbx")
+    with open(path, "wb") as f:
+        f.write(os.urandom(64))
+    assert batch.preflight_fbx(path)[0] is not None
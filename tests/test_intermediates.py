@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""中间动画文件：加载到最后一个HIK目标之后、最终保存之前删除"""
+
+import os
+
+import pytest
+
+import Animation_replace_batch_pyside as batch
+import fake_pyfbsdk as fake
+
+
+class RecordingProcessor(batch.BatchProcessor):
+    """保存时记录中间动画文件是否还在"""
+
+    def save_result_scene(self, fbx_file, hik_file=None):
+        self.intermediate_at_save.append((os.path.basename(hik_file),
+                                          os.path.isfile(self.intermediate_anim_file(fbx_file))))
+        return batch.BatchProcessor.save_result_scene(self, fbx_file, hik_file)
+
+
+def make_tree(tmp_path, targets):
+    source_path = tmp_path / "source"
+    hik_path = tmp_path / "hik"
+    save_path = tmp_path / "save"
+    for path in (source_path, hik_path, save_path):
+        path.mkdir()
+    fake.write_binary_fbx(str(source_path / "clip.fbx"))
+    for name in targets:
+        fake.write_binary_fbx(str(hik_path / name), frames=1)
+    return str(source_path), str(hik_path), str(save_path)
+
+
+@pytest.mark.parametrize("resident", [False, True])
+def test_intermediate_removed_after_last_load(tmp_path, resident):
+    source_path, hik_path, save_path = make_tree(tmp_path, ["a_hik.fbx", "b_hik.fbx"])
+    scratch = tmp_path / "scratch"
+    processor = RecordingProcessor(source_path, hik_path, save_path, None, None,
+                                   fan_out=True, resident_target=resident, intermediate_dir=str(scratch),
+                                   history_db=False, log_file=False, echo_console=False)
+    processor.intermediate_at_save = []
+    success, message = processor.run()
+    assert success, message
+    assert processor.success_count == 1
+    assert processor.intermediate_at_save == [("a_hik.fbx", True), ("b_hik.fbx", False)]
+    assert not [name for name in os.listdir(str(scratch)) if name.endswith(".fbx")]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""reduce_keys / resample_keys：精简后的曲线误差不超过容差"""
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import Animation_replace_batch_pyside as batch
+
+
+def max_error(times, values, keep):
+    return numpy.abs(numpy.interp(times, times[keep], values[keep]) - values).max()
+
+
+def test_straight_line_keeps_only_endpoints():
+    times = numpy.linspace(0.0, 10.0, 301)
+    keep = batch.reduce_keys(times, 3.0 * times + 1.0, 1e-6)
+    assert numpy.flatnonzero(keep).tolist() == [0, 300]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_error_within_tolerance(seed):
+    rng = numpy.random.RandomState(seed)
+    times = numpy.arange(200) / 30.0
+    values = numpy.sin(times * rng.uniform(0.5, 3.0)) * 10.0 + rng.normal(0.0, 0.01, len(times))
+    tolerance = rng.uniform(0.005, 0.5)
+    keep = batch.reduce_keys(times, values, tolerance)
+    assert keep[0] and keep[-1]
+    assert keep.sum() < len(times)
+    assert max_error(times, values, keep) <= tolerance + 1e-9
+
+
+def test_short_curves_are_untouched():
+    times = numpy.array([0.0, 1.0])
+    assert batch.reduce_keys(times, numpy.array([0.0, 5.0]), 10.0).all()
+
+
+def test_resample_keys():
+    times = numpy.array([0.0, 0.5, 1.0])
+    values = numpy.array([0.0, 5.0, 10.0])
+    new_times, new_values = batch.resample_keys(times, values, 10.0)
+    assert len(new_times) == 11
+    assert new_times[-1] == pytest.approx(1.0)
+    assert numpy.allclose(new_values, new_times * 10.0)
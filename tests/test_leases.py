@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""LeaseDirectory：租约只能被一个节点领取，没有心跳超过TTL后由其他节点回收"""
+
+import os
+import time
+
+import Animation_replace_batch_pyside as batch
+
+
+def stop_heartbeat(leases):
+    """模拟节点死亡：停止心跳但不释放租约"""
+    leases.stopped.set()
+    leases.thread.join()
+    leases.thread = None
+
+
+def test_claim_is_exclusive_and_done_marker_blocks(tmp_path):
+    first = batch.LeaseDirectory(str(tmp_path), "node-a", ttl=60)
+    second = batch.LeaseDirectory(str(tmp_path), "node-b", ttl=60)
+    try:
+        assert first.claim("clip")
+        assert not second.claim("clip")
+        first.complete("clip", True)
+        assert first.is_finished("clip")
+        assert not second.claim("clip")
+    finally:
+        first.close()
+        second.close()
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    dead = batch.LeaseDirectory(str(tmp_path), "node-a", ttl=1)
+    alive = batch.LeaseDirectory(str(tmp_path), "node-b", ttl=1)
+    try:
+        assert dead.claim("clip")
+        stop_heartbeat(dead)
+        assert not alive.claim("clip")  # 租约仍在有效期内
+
+        lease_path = dead.path("clip", ".lease")
+        past = time.time() - 5
+        os.utime(lease_path, (past, past))
+        assert alive.claim("clip")
+        assert alive.reclaimed_count == 1
+        assert alive.owner("clip")["node"] == "node-b"
+    finally:
+        alive.close()
+        dead.held.clear()
+        dead.close()
+
+
+def test_release_lets_other_node_claim(tmp_path):
+    first = batch.LeaseDirectory(str(tmp_path), "node-a", ttl=60)
+    second = batch.LeaseDirectory(str(tmp_path), "node-b", ttl=60)
+    try:
+        assert first.claim("clip")
+        first.release("clip")
+        assert second.claim("clip")
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""BatchManifest：记录追加到日志，中断后重新加载时合并日志"""
+
+import json
+import os
+
+import Animation_replace_batch_pyside as batch
+
+
+def make_outputs(tmp_path, count):
+    pairs = []
+    for index in range(count):
+        source = tmp_path / "clip_{}.fbx".format(index)
+        output = tmp_path / "out_{}.fbx".format(index)
+        source.write_bytes(b"s" * (index + 1))
+        output.write_bytes(b"o" * 10)
+        pairs.append((str(source), str(output)))
+    return pairs
+
+
+def test_journal_replayed_after_crash(tmp_path):
+    path = str(tmp_path / batch.MANIFEST_NAME)
+    pairs = make_outputs(tmp_path, 3)
+    manifest = batch.BatchManifest(path)
+    for source, output in pairs:
+        manifest.record(source, "target", "options", output)
+    # 没有close()就结束，最后一行只写了一半
+    manifest.journal.close()
+    with open(manifest.journal_path, "a") as f:
+        f.write('{"key": "trunc')
+    assert not os.path.exists(path)
+
+    reloaded = batch.BatchManifest(path)
+    assert len(reloaded.entries) == 3
+    assert not os.path.exists(reloaded.journal_path)
+    with open(path) as f:
+        assert len(json.load(f)["files"]) == 3
+    for source, output in pairs:
+        assert reloaded.is_up_to_date(source, "target", "options", output)
+    assert not reloaded.is_up_to_date(pairs[0][0], "other-target", "options", pairs[0][1])
+
+
+def test_close_compacts_journal(tmp_path):
+    path = str(tmp_path / batch.MANIFEST_NAME)
+    (source, output), = make_outputs(tmp_path, 1)
+    manifest = batch.BatchManifest(path)
+    manifest.record(source, "target", "options", output)
+    manifest.close()
+    assert not os.path.exists(manifest.journal_path)
+    assert batch.BatchManifest(path).is_up_to_date(source, "target", "options", output)
+
+
+def test_changed_source_is_not_up_to_date(tmp_path):
+    path = str(tmp_path / batch.MANIFEST_NAME)
+    (source, output), = make_outputs(tmp_path, 1)
+    manifest = batch.BatchManifest(path)
+    manifest.record(source, "target", "options", output)
+    with open(source, "ab") as f:
+        f.write(b"changed")
+    assert not manifest.is_up_to_date(source, "target", "options", output)
+
+
+def test_shared_journals_are_merged(tmp_path):
+    path = str(tmp_path / batch.MANIFEST_NAME)
+    pairs = make_outputs(tmp_path, 2)
+    first = batch.BatchManifest(path, shared=True)
+    first.journal_path = path + ".node-a" + batch.MANIFEST_JOURNAL_SUFFIX
+    second = batch.BatchManifest(path, shared=True)
+    second.journal_path = path + ".node-b" + batch.MANIFEST_JOURNAL_SUFFIX
+    first.record(pairs[0][0], "target", "options", pairs[0][1])
+    second.record(pairs[1][0], "target", "options", pairs[1][1])
+
+    # 另一个节点仍在运行（没有合并）时也能读到它的记录
+    reader = batch.BatchManifest(path, shared=True)
+    assert len(reader.entries) == 2
+    first.close()
+    second.close()
+    assert len(batch.BatchManifest(path).entries) == 2
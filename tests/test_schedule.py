@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""schedule_jobs / CostModel：按估计耗时调度和耗时模型拟合"""
+
+import pytest
+
+import Animation_replace_batch_pyside as batch
+
+
+COSTS = [("a", 5.0), ("d", 3.0), ("b", 4.0), ("c", 3.0)]
+
+
+def test_longest_first_shared_queue():
+    assignment, makespan = batch.schedule_jobs(COSTS, 2, "longest")
+    assert [job for job, _ in assignment] == ["a", "b", "d", "c"]
+    assert all(slot is None for _, slot in assignment)
+    assert makespan == 8.0
+
+
+def test_binpack_pins_jobs_to_least_loaded_slot():
+    assignment, makespan = batch.schedule_jobs(COSTS, 2, "binpack")
+    assert assignment == [("a", 0), ("b", 1), ("d", 1), ("c", 0)]
+    assert makespan == 8.0
+
+
+def test_single_worker_makespan_is_total():
+    assert batch.schedule_jobs(COSTS, 1)[1] == sum(cost for _, cost in COSTS)
+
+
+def test_cost_model_fits_linear_history():
+    model = batch.CostModel()
+    for index, (frames, size_mb) in enumerate([(100, 1), (300, 2), (500, 1), (900, 4), (200, 3)]):
+        model.history["/src/clip_{}.fbx".format(index)] = {
+            "total": 2.0 + 0.01 * frames + 0.5 * size_mb, "frames": frames, "size": int(size_mb * 1048576)}
+    assert model.fit()
+    base, per_frame, per_mb = model.coefficients
+    assert base == pytest.approx(2.0)
+    assert per_frame == pytest.approx(0.01)
+    assert per_mb == pytest.approx(0.5)
+    assert model.estimate("/src/new.fbx", 1048576, 400) == pytest.approx(6.5)
+
+
+def test_cost_model_needs_three_samples():
+    model = batch.CostModel()
+    model.history[model.key("/src/a.fbx")] = {"total": 12.0, "frames": 100, "size": 1048576}
+    assert not model.fit()
+    assert model.coefficients == (batch.DEFAULT_COST_BASE, batch.DEFAULT_COST_PER_FRAME,
+                                  batch.DEFAULT_COST_PER_MB)
+    # 同一文件（大小未变）直接使用历史耗时
+    assert model.estimate("/src/a.fbx", 1048576) == 12.0
+    assert model.estimate("/src/a.fbx", 2 * 1048576) != 12.0
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""SourceWatcher：文件大小和修改时间保持settle秒不变后才返回，之后只有再次变化才返回"""
+
+import os
+
+import pytest
+
+import Animation_replace_batch_pyside as batch
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(batch, "monotonic", clock)
+    return clock
+
+
+def write(path, size, mtime):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_file_released_after_settle(tmp_path, clock):
+    path = str(tmp_path / "clip.fbx")
+    write(path, 10, 1000)
+    watcher = batch.SourceWatcher(str(tmp_path), settle=5.0)
+    assert watcher.poll() == []
+    clock.now += 4.0
+    assert watcher.poll() == []
+    clock.now += 1.0
+    assert watcher.poll() == [path]
+    assert watcher.first_seen(path) is not None
+    clock.now += 10.0
+    assert watcher.poll() == []
+
+
+def test_growing_file_restarts_settle(tmp_path, clock):
+    path = str(tmp_path / "clip.fbx")
+    write(path, 10, 1000)
+    watcher = batch.SourceWatcher(str(tmp_path), settle=5.0)
+    watcher.poll()
+    clock.now += 4.0
+    write(path, 20, 1004)  # 仍在复制
+    assert watcher.poll() == []
+    clock.now += 4.0
+    assert watcher.poll() == []
+    clock.now += 1.0
+    assert watcher.poll() == [path]
+
+
+def test_changed_file_released_again(tmp_path, clock):
+    path = str(tmp_path / "clip.fbx")
+    write(path, 10, 1000)
+    watcher = batch.SourceWatcher(str(tmp_path), settle=1.0)
+    watcher.poll()
+    clock.now += 1.0
+    assert watcher.poll() == [path]
+    write(path, 12, 2000)
+    assert watcher.poll() == []
+    clock.now += 1.0
+    assert watcher.poll() == [path]
+
+
+def test_excluded_and_deleted_files(tmp_path, clock):
+    write(str(tmp_path / "notes.txt"), 10, 1000)
+    path = str(tmp_path / "clip.fbx")
+    write(path, 10, 1000)
+    watcher = batch.SourceWatcher(str(tmp_path), settle=1.0)
+    watcher.poll()
+    os.remove(path)
+    clock.now += 1.0
+    assert watcher.poll() == []
+    assert not watcher.pending
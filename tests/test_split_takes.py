@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""拆分Take保存：只保存从源文件导出的Take，不保存目标场景FileNew后自带的Take"""
+
+import os
+
+import pytest
+
+import Animation_replace_batch_pyside as batch
+import fake_pyfbsdk as fake
+
+
+@pytest.fixture
+def walk_run_takes():
+    saved = dict(fake.CONFIG)
+    fake.configure(takes=["Walk", "Run"], latency={}, failure_rate={}, curve_frames=0)
+    yield
+    fake.CONFIG.clear()
+    fake.CONFIG.update(saved)
+
+
+def make_tree(tmp_path, count=2):
+    source_path = tmp_path / "source"
+    hik_path = tmp_path / "hik"
+    save_path = tmp_path / "save"
+    for path in (source_path, hik_path, save_path):
+        path.mkdir()
+    for index in range(count):
+        fake.write_binary_fbx(str(source_path / "c{}.fbx".format(index)), takes=("Walk", "Run"))
+    fake.write_binary_fbx(str(hik_path / "target_hik.fbx"), frames=1)
+    return str(source_path), str(hik_path), str(save_path)
+
+
+@pytest.mark.parametrize("resident", [False, True])
+def test_split_saves_only_source_takes(tmp_path, walk_run_takes, resident):
+    source_path, hik_path, save_path = make_tree(tmp_path)
+    processor = batch.BatchProcessor(source_path, hik_path, save_path, None, None,
+                                     takes="all", split_takes=True, resident_target=resident,
+                                     intermediate_dir=str(tmp_path / "scratch"),
+                                     history_db=False, log_file=False, echo_console=False)
+    success, message = processor.run()
+    assert success, message
+    assert processor.success_count == 2
+    outputs = sorted(name for name in os.listdir(save_path) if name.endswith(".fbx") and not name.startswith("."))
+    assert outputs == ["c0_Run.fbx", "c0_Walk.fbx", "c1_Run.fbx", "c1_Walk.fbx"]
+    for row in processor.report.rows:
+        assert sorted(row["takes"]) == ["Run", "Walk"]
+
+
+def test_split_after_cache_hit_uses_cached_take_names(tmp_path, walk_run_takes):
+    source_path, hik_path, save_path = make_tree(tmp_path, count=1)
+    for run_index in range(2):
+        output_path = str(tmp_path / "save_{}".format(run_index))
+        os.mkdir(output_path)
+        processor = batch.BatchProcessor(source_path, hik_path, output_path, None, None,
+                                         takes="all", split_takes=True,
+                                         animation_cache_dir=str(tmp_path / "cache"),
+                                         intermediate_dir=str(tmp_path / "scratch"),
+                                         history_db=False, log_file=False, echo_console=False)
+        success, message = processor.run()
+        assert success, message
+        outputs = sorted(name for name in os.listdir(output_path) if name.endswith(".fbx") and not name.startswith("."))
+        assert outputs == ["c0_Run.fbx", "c0_Walk.fbx"]
+    assert processor.report.rows[0]["animation_cache"] == "hit"
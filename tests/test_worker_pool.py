@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""WorkerPool：崩溃/卡死的任务退避重试，超过重试次数后标记隔离"""
+
+import sys
+import textwrap
+import time
+
+import Animation_replace_batch_pyside as batch
+
+# 工作进程替身：忽略命令行参数，按模式处理stdin中的每个任务
+WORKER_SCRIPT = textwrap.dedent("""
+    import json, sys, time
+    mode = {mode!r}
+    for line in iter(sys.stdin.readline, ""):
+        job = json.loads(line)
+        if mode == "crash":
+            sys.exit(3)
+        if mode == "hang":
+            sys.stdout.write("{stage}open_source\\n")
+            sys.stdout.flush()
+            time.sleep(60)
+        result = {{"index": job["index"], "fbx_file": job["fbx_file"], "success": True, "error": None}}
+        sys.stdout.write("{result}" + json.dumps(result) + "\\n")
+        sys.stdout.flush()
+""")
+
+
+def make_pool(tmp_path, mode, **options):
+    script = tmp_path / "worker_{}.py".format(mode)
+    script.write_text(WORKER_SCRIPT.format(mode=mode, stage=batch.WORKER_STAGE_PREFIX,
+                                           result=batch.WORKER_RESULT_PREFIX))
+    options.setdefault("retry_backoff", 0.01)
+    return batch.WorkerPool(1, [sys.executable], str(script), {}, **options)
+
+
+def wait_results(pool, count, timeout=30.0):
+    results = []
+    deadline = time.time() + timeout
+    while len(results) < count and time.time() < deadline:
+        results.extend(payload for kind, payload in pool.poll(0.1) if kind == "result")
+    return results
+
+
+def job(index=0):
+    return {"index": index, "fbx_file": "clip_{}.fbx".format(index), "hik_files": []}
+
+
+def test_successful_jobs(tmp_path):
+    pool = make_pool(tmp_path, "ok")
+    pool.start([job(0), job(1)])
+    results = wait_results(pool, 2)
+    pool.shutdown()
+    assert sorted(result["index"] for result in results) == [0, 1]
+    assert all(result["success"] and result["attempts"] == 1 for result in results)
+    assert pool.is_done()
+
+
+def test_crash_is_retried_then_quarantined(tmp_path):
+    pool = make_pool(tmp_path, "crash", max_retries=2)
+    pool.start([job()])
+    result, = wait_results(pool, 1)
+    pool.shutdown()
+    assert not result["success"]
+    assert result["attempts"] == 3
+    assert result["quarantined"]
+
+
+def test_stage_timeout_kills_hung_worker(tmp_path):
+    pool = make_pool(tmp_path, "hang", stage_timeouts={"open_source": 0.3}, max_retries=1)
+    pool.start([job()])
+    result, = wait_results(pool, 1)
+    pool.shutdown()
+    assert result["attempts"] == 2
+    assert result["quarantined"]
+    assert pool.timeout_count == 2
+
+
+def test_unstartable_worker_fails_jobs(tmp_path):
+    pool = batch.WorkerPool(2, ["/nonexistent/mobupy"], str(tmp_path / "worker.py"), {})
+    pool.start([job(index) for index in range(4)])
+    results = wait_results(pool, 4)
+    pool.shutdown()
+    assert len(results) == 4
+    assert not any(result["success"] for result in results)
+    assert pool.is_done()
+
+
+def test_crash_after_stop_is_not_quarantined(tmp_path):
+    pool = make_pool(tmp_path, "hang", stage_timeouts={"open_source": 0.5}, max_retries=2)
+    pool.start([job()])
+    time.sleep(0.2)
+    pool.stop()
+    result, = wait_results(pool, 1)
+    pool.shutdown()
+    assert not result["success"]
+    assert result["attempts"] == 1
+    assert not result.get("quarantined")